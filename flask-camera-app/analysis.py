@@ -0,0 +1,284 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image, ImageOps
+
+from blob_store import file_digest
+
+# Bump when the algorithm changes so cached spectra are recomputed
+ANALYSIS_VERSION = 1
+
+# Photos are analyzed at most this many pixels along the longest edge
+MAX_EDGE = 1024
+
+# Structuring element widths in analyzed pixels (roughly sqrt(2) steps, like a sieve stack)
+SIEVE_WIDTHS = (2, 3, 4, 6, 8, 11, 16, 23, 32, 45, 64, 91, 128)
+
+# A round grain survives opening by a square up to its inscribed square, whose
+# side is diameter / sqrt(2); widths are scaled back to equivalent diameters
+INSCRIBED_TO_DIAMETER = math.sqrt(2)
+
+# Wentworth grade scale: (upper bound in mm, name)
+WENTWORTH_CLASSES = [
+    (0.0625, 'silt'),
+    (0.125, 'very fine sand'),
+    (0.25, 'fine sand'),
+    (0.5, 'medium sand'),
+    (1.0, 'coarse sand'),
+    (2.0, 'very coarse sand'),
+    (float('inf'), 'granule'),
+]
+
+# Folk & Ward (1957) sorting classes: (upper bound of sigma in phi units, name)
+SORTING_CLASSES = [
+    (0.35, 'very well sorted'),
+    (0.5, 'well sorted'),
+    (0.71, 'moderately well sorted'),
+    (1.0, 'moderately sorted'),
+    (2.0, 'poorly sorted'),
+    (4.0, 'very poorly sorted'),
+    (float('inf'), 'extremely poorly sorted'),
+]
+
+
+def _span(a, start, stop, axis):
+    return a[(slice(None),) * axis + (slice(start, stop),)]
+
+
+def _window_reduce(a, width, axis, ufunc):
+    """ufunc over every run of `width` samples along an axis; the result is width - 1 shorter
+
+    Windows are built by doubling (runs of 1, 2, 4, ... samples combined
+    pairwise), so a width costs about log2(width) whole-array passes and
+    every pass works on contiguous slices.
+    """
+    span = 1
+    while span * 2 <= width:
+        n = a.shape[axis]
+        a = ufunc(_span(a, 0, n - span, axis), _span(a, span, n, axis))
+        span *= 2
+    if span < width:
+        n = a.shape[axis]
+        shift = width - span
+        a = ufunc(_span(a, 0, n - shift, axis), _span(a, shift, n, axis))
+    return a
+
+
+def _filter_axis(a, width, axis, ufunc, fill, before):
+    """Flat 1-D min/max filter of `width` samples along an axis, `before` of them ahead of each pixel"""
+    pad = [(0, 0)] * a.ndim
+    pad[axis] = (before, width - 1 - before)
+    return _window_reduce(np.pad(a, pad, constant_values=fill), width, axis, ufunc)
+
+
+def opening(image, width):
+    """Grayscale opening by a flat width x width square (separable erosion then dilation)"""
+    low, high = (width - 1) // 2, width // 2
+    eroded = image
+    for axis in (0, 1):
+        eroded = _filter_axis(eroded, width, axis, np.minimum, np.inf, low)
+    opened = eroded
+    for axis in (0, 1):
+        # The dilation uses the reflected element so opening(image) <= image holds exactly
+        opened = _filter_axis(opened, width, axis, np.maximum, -np.inf, high)
+    return opened
+
+
+def load_gray(path, max_edge=MAX_EDGE):
+    """Load a photo as float32 grayscale in [0, 1]; returns (pixels, scale to original pixels)"""
+    with Image.open(path) as image:
+        original = max(image.size)
+        image.draft('L', (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image).convert('L')
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        pixels = np.asarray(image, dtype=np.float32) / 255.0
+    return pixels, original / max(pixels.shape)
+
+
+def size_spectrum(pixels, widths=SIEVE_WIDTHS):
+    """Granulometry: cumulative fraction of grain 'volume' finer than each width
+
+    Opening by a square of width w erases bright structures (grains) narrower
+    than w, so the image sum lost between successive widths is the amount of
+    material in that size class, the image analogue of a sieve fraction.
+    Returns (widths used, cumulative fraction finer), or None for a blank image.
+    """
+    widths = [w for w in widths if w <= min(pixels.shape) // 4]
+    if not widths:
+        return None
+    total = float(pixels.sum(dtype=np.float64))
+    volumes = np.array([total] + [float(opening(pixels, w).sum(dtype=np.float64)) for w in widths])
+    removed = volumes[0] - volumes[1:]
+    if removed[-1] <= 0:
+        return None
+    return widths, np.maximum.accumulate(removed / removed[-1])
+
+
+def percentile_size(sizes, finer, percent):
+    """Size at which `percent` of the material is finer, interpolated on a log scale"""
+    return float(np.exp(np.interp(percent / 100.0, finer, np.log(sizes))))
+
+
+def classify(value, classes):
+    for upper, name in classes:
+        if value < upper:
+            return name
+    return classes[-1][1]
+
+
+def summarize(spectrum, mm_per_pixel):
+    """Turn a cached spectrum into D10/D50/D90, Folk & Ward sorting and a sand class"""
+    sizes = np.asarray(spectrum['sizes_px']) * mm_per_pixel
+    finer = np.asarray(spectrum['finer'])
+    d = {p: percentile_size(sizes, finer, p) for p in (5, 10, 16, 50, 84, 90, 95)}
+    # Inclusive graphic standard deviation; phi = -log2(mm), so differences flip sign
+    sorting = np.log2(d[84] / d[16]) / 4 + np.log2(d[95] / d[5]) / 6.6
+    wentworth = classify(d[50], WENTWORTH_CLASSES)
+    return {
+        'd10_mm': round(d[10], 4),
+        'd50_mm': round(d[50], 4),
+        'd90_mm': round(d[90], 4),
+        'sorting_phi': round(float(sorting), 3),
+        'sorting': classify(sorting, SORTING_CLASSES),
+        'wentworth': wentworth,
+        'class': 'fine' if d[50] < 0.25 else 'medium' if d[50] < 0.5 else 'coarse',
+        'mm_per_pixel': mm_per_pixel,
+        'distribution': [
+            {'size_mm': round(float(size), 4), 'percent_finer': round(float(f) * 100, 2)}
+            for size, f in zip(sizes, finer)
+        ],
+    }
+
+
+def analyze_path(path):
+    """Compute the size spectrum of one photo (runs in pool workers)
+
+    Sizes are stored in original-image pixels so the mm scale can change
+    without re-analyzing.
+    """
+    pixels, scale = load_gray(path)
+    result = size_spectrum(pixels)
+    if result is None:
+        return None
+    widths, finer = result
+    return {'sizes_px': [w * INSCRIBED_TO_DIAMETER * scale for w in widths], 'finer': finer.tolist()}
+
+
+class AnalysisCache:
+    """Size spectra keyed on image content hash, in a table beside the photo metadata"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS grain_size_spectra (
+            digest TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            spectrum TEXT
+        );
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, digests):
+        """Return {digest: spectrum or None} for the current algorithm version"""
+        found = {}
+        digests = list(digests)
+        for start in range(0, len(digests), 500):
+            chunk = digests[start:start + 500]
+            rows = self._connect().execute(
+                'SELECT digest, spectrum FROM grain_size_spectra WHERE version = ? AND digest IN (%s)'
+                % ','.join('?' * len(chunk)), [ANALYSIS_VERSION] + chunk)
+            found.update((digest, json.loads(spectrum)) for digest, spectrum in rows)
+        return found
+
+    def put_many(self, items):
+        """Store (digest, spectrum) pairs"""
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO grain_size_spectra (digest, version, spectrum) VALUES (?, ?, ?)',
+                [(digest, ANALYSIS_VERSION, json.dumps(spectrum)) for digest, spectrum in items])
+
+
+def analyze_cached(path, cache, digest=None):
+    """Return the spectrum of one photo, computing and caching it on a miss"""
+    digest = digest or file_digest(path)
+    cached = cache.get_many([digest])
+    if digest in cached:
+        return cached[digest]
+    spectrum = analyze_path(path)
+    cache.put_many([(digest, spectrum)])
+    return spectrum
+
+
+def analyze_batch(items, cache, workers=None, force=False, on_result=None):
+    """Analyze (name, path, digest or None) items across a process pool.
+
+    Photos whose content hash already has a cached spectrum are skipped
+    unless force is set. on_result(name, spectrum, error) is called for every
+    item. Returns counts plus elapsed time and images per second.
+    """
+    start = time.perf_counter()
+    items = [(name, path, digest or file_digest(path)) for name, path, digest in items]
+    cached = {} if force else cache.get_many(set(digest for _, _, digest in items))
+
+    todo = {}
+    for name, path, digest in items:
+        if digest in cached:
+            if on_result:
+                on_result(name, cached[digest], None)
+        else:
+            todo.setdefault(digest, (path, []))[1].append(name)
+
+    failed = 0
+    workers = workers or os.cpu_count() or 1
+    digests = list(todo)
+    with ProcessPoolExecutor(max_workers=min(workers, max(len(digests), 1))) as executor:
+        paths = [todo[digest][0] for digest in digests]
+        chunksize = max(1, len(paths) // (workers * 4))
+        results = executor.map(_analyze_safely, paths, chunksize=chunksize)
+        computed = []
+        for digest, (spectrum, error) in zip(digests, results):
+            if error is None:
+                computed.append((digest, spectrum))
+            else:
+                failed += len(todo[digest][1])
+            if on_result:
+                for name in todo[digest][1]:
+                    on_result(name, spectrum, error)
+            if len(computed) >= 100:
+                cache.put_many(computed)
+                computed = []
+        cache.put_many(computed)
+
+    elapsed = time.perf_counter() - start
+    analyzed = len(digests)
+    return {
+        'images': len(items),
+        'analyzed': analyzed,
+        'cached': len(items) - sum(len(names) for _, names in todo.values()),
+        'failed': failed,
+        'elapsed_s': elapsed,
+        'images_per_second': analyzed / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def _analyze_safely(path):
+    try:
+        return analyze_path(path), None
+    except Exception as e:
+        return None, str(e)
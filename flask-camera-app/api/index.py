@@ -10,6 +10,16 @@ from datetime import datetime
 from werkzeug.utils import secure_filename
 import base64
 
+from excel_locations import ExcelLocationCache, join_sample_images, rows_to_locations
+from http_cache import conditional
+from snapshot import open_snapshot
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXCEL_PATH = os.path.join(ROOT_DIR, 'complete_gps_and_dates.xlsx')
+BUNDLED_UPLOADS = os.path.join(ROOT_DIR, 'uploads')
+# Built by 'flask --app app build-snapshot'; without it the routes below fall back to samples
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH') or os.path.join(ROOT_DIR, 'snapshot.bin')
+
 app = Flask(__name__, 
             template_folder='../templates',
             static_folder='../static')
@@ -24,6 +34,64 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Mapped once per instance: only its small index is decoded at startup
+snapshot = open_snapshot(SNAPSHOT_PATH)
+
+def snapshot_version():
+    """Cache validator: the snapshot's content hash and build time"""
+    if snapshot is None:
+        return None, None
+    return snapshot.version, snapshot.built_at
+
+def snapshot_response(name):
+    """Send a section of the snapshot as is, gzipped when the client accepts it"""
+    encoding = 'gzip' if 'gzip' in request.accept_encodings else None
+    response = app.response_class(snapshot.body(name, encoding), mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+excel_location_cache = ExcelLocationCache()
+sample_images_payload = None
+
+# Served when the deployment has neither a snapshot nor the sheet (.vercelignore
+# leaves out the sheet and uploads/), in the same shape as sheet rows
+SAMPLE_LOCATIONS = rows_to_locations([
+    ['image_name', 'latitude', 'longitude', 'date_taken'],
+    ['sample1.jpg', 19.0760, 72.8777, '2025-09-28'],
+    ['sample2.jpg', 19.0825, 72.8811, '2025-09-28'],
+    ['sample3.jpg', 19.0896, 72.8656, '2025-09-28'],
+    ['sample4.jpg', 19.0330, 72.8697, '2025-09-28'],
+    ['sample5.jpg', 19.0176, 72.8562, '2025-09-28'],
+])
+
+def get_sample_images_payload():
+    """Sheet locations joined to the images bundled in uploads/, encoded once per instance
+
+    The deployment is read-only, so the bundled files never change and the
+    directory is listed only on the first request. Without the sheet the
+    SAMPLE_LOCATIONS rows are served instead.
+    """
+    global sample_images_payload
+    if sample_images_payload is None:
+        if os.path.exists(EXCEL_PATH):
+            locations, _ = excel_location_cache.get(EXCEL_PATH)
+        else:
+            locations = SAMPLE_LOCATIONS
+        files = {}
+        if os.path.isdir(BUNDLED_UPLOADS):
+            files = {name: False for name in os.listdir(BUNDLED_UPLOADS) if allowed_file(name)}
+        rows, orphans = join_sample_images(locations, files)
+        sample_images_payload = json.dumps({
+            'success': True,
+            'locations': rows,
+            'count': len(rows),
+            'missing_count': sum(1 for row in rows if row['image_status'] == 'missing'),
+            'orphans': orphans,
+        }).encode('utf-8')
+    return sample_images_payload
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -42,8 +110,11 @@ def get_photos():
         return jsonify({'error': str(e)})
 
 @app.route('/api/photos-with-locations')
+@conditional(snapshot_version)
 def photos_with_locations():
     try:
+        if snapshot is not None:
+            return snapshot_response('photos_with_locations')
         # Sample photos with locations for Vercel deployment
         photos = [
             {
@@ -70,51 +141,15 @@ def photos_with_locations():
         return jsonify({'error': str(e)})
 
 @app.route('/api/excel-locations')
+@conditional(snapshot_version)
 def excel_locations():
     try:
-        # Sample Excel locations for Vercel deployment
-        locations = [
-            {
-                'image_name': 'sample1.jpg',
-                'latitude': 19.0760,
-                'longitude': 72.8777,
-                'date_taken': '2025-09-28',
-                'image_url': '/uploads/img1.jpg'
-            },
-            {
-                'image_name': 'sample2.jpg',
-                'latitude': 19.0825,
-                'longitude': 72.8811, 
-                'date_taken': '2025-09-28',
-                'image_url': '/uploads/img2.jpg'
-            },
-            {
-                'image_name': 'sample3.jpg',
-                'latitude': 19.0896,
-                'longitude': 72.8656,
-                'date_taken': '2025-09-28', 
-                'image_url': '/uploads/img3.jpg'
-            },
-            {
-                'image_name': 'sample4.jpg',
-                'latitude': 19.0330,
-                'longitude': 72.8697,
-                'date_taken': '2025-09-28',
-                'image_url': '/uploads/img4.jpg'
-            },
-            {
-                'image_name': 'sample5.jpg',
-                'latitude': 19.0176,
-                'longitude': 72.8562,
-                'date_taken': '2025-09-28',
-                'image_url': '/uploads/img5.jpg'
-            }
-        ]
-        print(f"Loaded {len(locations)} sample locations")
-        return jsonify({'locations': locations})
+        if snapshot is not None:
+            return snapshot_response('excel_locations')
+        return app.response_class(get_sample_images_payload(), mimetype='application/json')
     except Exception as e:
         print(f"Error loading sample locations: {str(e)}")
-        return jsonify({'locations': [], 'error': str(e)})
+        return jsonify({'success': False, 'locations': [], 'error': str(e)})
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
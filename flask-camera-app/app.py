@@ -1,144 +1,579 @@
 import os
-import uuid
+import io
+import sys
 import json
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import time
+import click
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
 from werkzeug.utils import secure_filename
 import base64
 import ssl
-import pandas as pd
+import sqlite3
+from metadata_store import PhotoMetadataStore
+from blob_store import BlobStore, file_digest
+from storage import file_lock, flat_files
+from excel_locations import ExcelLocationCache, SampleImageIndex
+from date_index import DateIndexCache, GROUPS, SOURCES, to_iso, to_ms
+from thumbnails import DerivativeGenerator, DERIVATIVE_SIZES
+from spatial_index import GridIndex, MAX_CLUSTER_ZOOM
+from http_cache import conditional
+from jobs import JobQueue, QueueFull
+from exif_gps import read_photo_metadata
+from transcode import Transcoder, sniff_format
+from upload_sessions import SessionError, UploadSessions
+from export import EXPORT_FORMATS, TEXT_WRITERS, photo_rows, sample_rows, write_xlsx, xlsx_chunks
+from metrics import REGISTRY, configure_logging, instrument, metrics_response, stage
+
+configure_logging(os.environ.get('LOG_LEVEL', 'INFO'), os.environ.get('LOG_FORMAT', 'json'))
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 # Use absolute path for uploads folder
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER') or \
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+# Sheet with the sample points' GPS coordinates, dates and image names
+app.config['EXCEL_PATH'] = os.environ.get('EXCEL_PATH') or \
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'complete_gps_and_dates.xlsx')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Resumable uploads (/api/uploads): largest file, chunk size suggested to clients (each
+# chunk is one request, so it stays under MAX_CONTENT_LENGTH) and idle session lifetime
+app.config['UPLOAD_SESSION_MAX_BYTES'] = int(os.environ.get('UPLOAD_SESSION_MAX_BYTES', 512 * 1024 * 1024))
+app.config['UPLOAD_CHUNK_SIZE'] = int(os.environ.get('UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+app.config['UPLOAD_SESSION_TTL'] = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 3600))
+# Background job workers: threads, optional processes for CPU-bound kinds, and queue bound
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_PROCESSES'] = int(os.environ.get('JOB_PROCESSES', 0))
+app.config['JOB_QUEUE_DEPTH'] = int(os.environ.get('JOB_QUEUE_DEPTH', 1000))
+# Ground distance covered by one pixel of an original photo, for grain sizes in mm
+app.config['ANALYSIS_MM_PER_PIXEL'] = float(os.environ.get('ANALYSIS_MM_PER_PIXEL', 0.05))
+app.config['ANALYSIS_WORKERS'] = int(os.environ.get('ANALYSIS_WORKERS', 0)) or os.cpu_count()
+# Requests slower than this are logged with their stage timings (0 disables); the
+# sampling profiler adds each slow request's hottest stacks to that log line
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+app.config['PROFILE_SLOW_REQUESTS'] = os.environ.get('PROFILE_SLOW_REQUESTS') == '1'
+# Background re-encoding of stored photos (canvas PNG captures by default): target
+# format ('off' disables), quality, optional downscale, JPEG chroma subsampling,
+# lossless WebP, and whether the uploaded bytes are kept alongside. The defaults
+# lose no pixel (grain edges and colour are what analysis measures), so the
+# uploaded bytes are released; keeping them, or lossy output, is opt-in
+app.config['TRANSCODE_FORMAT'] = os.environ.get('TRANSCODE_FORMAT', 'webp')
+app.config['TRANSCODE_QUALITY'] = int(os.environ.get('TRANSCODE_QUALITY', 90))
+app.config['TRANSCODE_MAX_EDGE'] = int(os.environ.get('TRANSCODE_MAX_EDGE', 0))
+app.config['TRANSCODE_SUBSAMPLING'] = os.environ.get('TRANSCODE_SUBSAMPLING', '4:4:4')
+app.config['TRANSCODE_LOSSLESS'] = os.environ.get('TRANSCODE_LOSSLESS', '1') == '1'
+app.config['TRANSCODE_KEEP_ORIGINAL'] = os.environ.get('TRANSCODE_KEEP_ORIGINAL', '0') == '1'
+app.config['TRANSCODE_SOURCES'] = os.environ.get('TRANSCODE_SOURCES', 'png')
+# Server-Sent Events stream of photo changes ('flask serve-events'): the URL browsers
+# connect to (unset: pages poll /api/changes instead) and the origin it allows
+app.config['EVENTS_URL'] = os.environ.get('EVENTS_URL') or None
+app.config['EVENTS_ALLOW_ORIGIN'] = os.environ.get('EVENTS_ALLOW_ORIGIN', '*')
+
+instrument(app, slow_request_ms=app.config['SLOW_REQUEST_MS'], profile=app.config['PROFILE_SLOW_REQUESTS'])
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
+# Photos rendered server-side on the first gallery page, and the largest /api/photos page
+GALLERY_PAGE_SIZE = 60
+MAX_PAGE_SIZE = 500
+
+# Browser cache lifetime for uploads and their derivatives (one year)
+UPLOAD_MAX_AGE = 365 * 24 * 3600
+
+# Most results /api/similar returns
+MAX_SIMILAR = 100
+
+# Most change-feed entries read for one /api/changes reply or stream message
+CHANGE_PAGE_SIZE = 1000
+
+# Map layers accepted by /api/map-points and the most points it returns before clustering
+MAP_LAYERS = {'photos': 'photo', 'samples': 'sample'}
+MAP_POINT_LIMIT = 1000
+
+# Image content types accepted as a raw /capture body, mapped to the stored extension
+CAPTURE_CONTENT_TYPES = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'application/octet-stream': 'png'
+}
+
+# Read size used when streaming request bodies to disk
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Job kinds accepted by POST /api/jobs, and the priority of post-processing queued on ingest.
+# Transcoding is queued by the analysis job once it is done (see queue_transcode), so
+# analysis always measures the uploaded bytes
+JOB_KINDS = ('derivatives', 'analysis', 'transcode')
+JOB_PRIORITIES = {'derivatives': 10, 'analysis': 0, 'transcode': -10}
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def stream_to_upload(stream, extension, location_data=None):
+    """Copy a file-like stream into the blob store in fixed-size chunks and record it
+
+    The data is hashed on the way to a temporary file. Without a location
+    from the client, GPS coordinates and the capture time are taken from the
+    file's EXIF/XMP header (the capture time becomes created_at). Bytes
+    already stored are not kept twice: an identical upload with no new
+    location returns the existing photo (duplicate=True), otherwise a new
+    photo referencing the existing blob is added. Returns (filename, sha256
+    hex digest, size in bytes, duplicate, metadata entry), or None for an
+    empty stream.
+    """
+    with stage('upload.disk_write'):
+        temp_path, sha256, size = get_blob_store().write_temp(stream, STREAM_CHUNK_SIZE)
+    if size == 0:
+        os.remove(temp_path)
+        return None
+    return store_upload(temp_path, sha256, size, extension, location_data)
+
+def store_upload(temp_path, sha256, size, extension, location_data=None):
+    """Record a fully written temporary file as a photo; same return value as stream_to_upload"""
+    taken_at = None
+    if location_data is None:
+        with stage('upload.exif'):
+            location_data, taken_at = header_metadata(temp_path)
+    with stage('upload.metadata_save'):
+        filename, entry, duplicate = get_blob_store().add(temp_path, sha256, size, extension, location_data, taken_at)
+    if not duplicate:
+        update_map_index(filename, entry)
+    return filename, sha256, size, duplicate, entry
+
+def header_metadata(path):
+    """(location, taken_at) from a photo's EXIF/XMP header; (None, None) if unreadable"""
+    try:
+        return read_photo_metadata(path)
+    except OSError as e:
+        logger.warning('Could not read EXIF', extra={'path': path, 'error': str(e)})
+        return None, None
+
+def location_from_fields(fields):
+    """Build a location dict from form or query fields sent with a binary capture
+
+    Accepts either a JSON-encoded 'location' field or separate 'latitude',
+    'longitude', 'accuracy' and 'timestamp' fields. Returns None when no
+    coordinates were sent.
+    """
+    if fields.get('location'):
+        return json.loads(fields['location'])
+    if not fields.get('latitude') or not fields.get('longitude'):
+        return None
+    location = {
+        'latitude': float(fields['latitude']),
+        'longitude': float(fields['longitude'])
+    }
+    if fields.get('accuracy'):
+        location['accuracy'] = float(fields['accuracy'])
+    if fields.get('timestamp'):
+        location['timestamp'] = fields['timestamp']
+    return location
+
 def get_metadata_file_path():
-    """Get path to metadata JSON file"""
+    """Get path to the legacy metadata JSON file (migrated into the store on first use)"""
     return os.path.join(app.config['UPLOAD_FOLDER'], 'photo_metadata.json')
 
+_metadata_store = None
+
+def get_metadata_store():
+    """Get the SQLite metadata store for the configured upload folder"""
+    global _metadata_store
+    db_path = os.path.join(app.config['UPLOAD_FOLDER'], 'photo_metadata.db')
+    if _metadata_store is None or _metadata_store.db_path != db_path:
+        store = PhotoMetadataStore(db_path, legacy_json_path=get_metadata_file_path())
+        if not store.folder_indexed():
+            # One worker scans the folder; the others wait and then find it indexed
+            with file_lock(store.lock_path):
+                if not store.folder_indexed():
+                    index_upload_folder(store)
+        _metadata_store = store
+    return _metadata_store
+
+_blob_store = None
+
+def get_blob_store():
+    """Get the content-addressed blob store (uploads/blobs) for the configured upload folder"""
+    global _blob_store
+    store = get_metadata_store()
+    if _blob_store is None or _blob_store.metadata is not store:
+        _blob_store = BlobStore(os.path.join(app.config['UPLOAD_FOLDER'], 'blobs'), store)
+    return _blob_store
+
+_upload_sessions = None
+
+def get_upload_sessions():
+    """Get the resumable upload sessions (uploads/sessions) for the configured upload folder"""
+    global _upload_sessions
+    root = os.path.join(app.config['UPLOAD_FOLDER'], 'sessions')
+    if _upload_sessions is None or _upload_sessions.root != root:
+        _upload_sessions = UploadSessions(root, max_length=app.config['UPLOAD_SESSION_MAX_BYTES'],
+                                          ttl=app.config['UPLOAD_SESSION_TTL'])
+    return _upload_sessions
+
+def get_photo_path(filename):
+    """Return the file holding a photo's bytes: its blob, or a plain file in uploads/"""
+    blob = get_metadata_store().blob_of(filename)
+    if blob is not None:
+        return get_blob_store().locate(*blob)
+    return os.path.join(app.config['UPLOAD_FOLDER'], filename)
+
+def delete_photo_file(filename):
+    """Delete a photo and its metadata; blobs are only removed with their last reference
+
+    Returns False if there is no such photo.
+    """
+    if get_blob_store().delete(filename):
+        update_map_index(filename, None)
+        return True
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not (os.path.exists(file_path) and allowed_file(filename)):
+        return False
+    os.remove(file_path)
+    remove_photo_metadata(filename)
+    return True
+
+def index_upload_folder(store):
+    """Sync the store's photo index with the files in the upload folder
+
+    Runs once per store (and from 'flask reindex-uploads'); afterwards the
+    index is maintained by the upload, capture and delete handlers, so
+    listings never need to scan the folder.
+    """
+    upload_path = app.config['UPLOAD_FOLDER']
+    files = {}
+    with os.scandir(upload_path) as entries:
+        for entry in entries:
+            if entry.is_file() and allowed_file(entry.name):
+                files[entry.name] = datetime.fromtimestamp(entry.stat().st_mtime).isoformat()
+    added, removed = store.reconcile(files)
+    logger.info('Indexed upload folder', extra={'added': added, 'removed': removed, 'photos': len(files)})
+
 def load_photo_metadata():
-    """Load photo metadata from JSON file"""
-    metadata_file = get_metadata_file_path()
-    if os.path.exists(metadata_file):
-        try:
-            with open(metadata_file, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            print("Warning: Could not load metadata file")
+    """Load photo metadata from the store (cached until the next write)"""
+    try:
+        return get_metadata_store().all()
+    except sqlite3.Error as e:
+        logger.warning('Could not load metadata', extra={'error': str(e)})
     return {}
 
 def save_photo_metadata(filename, location_data):
-    """Save photo metadata to JSON file"""
+    """Save photo metadata as a single row in the store"""
     try:
-        metadata = load_photo_metadata()
-        metadata[filename] = {
-            'location': location_data,
-            'created_at': datetime.now().isoformat()
-        }
-        
-        metadata_file = get_metadata_file_path()
-        with open(metadata_file, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        entry = get_metadata_store().put(filename, location_data)
+        update_map_index(filename, entry)
     except Exception as e:
-        print(f"Warning: Could not save metadata for {filename}: {e}")
+        logger.warning('Could not save metadata', extra={'photo': filename, 'error': str(e)})
+
+_derivative_generator = None
+
+def get_derivative_generator():
+    """Get the thumbnail/preview generator for the configured upload folder"""
+    global _derivative_generator
+    upload_folder = app.config['UPLOAD_FOLDER']
+    if _derivative_generator is None or _derivative_generator.upload_folder != upload_folder:
+        _derivative_generator = DerivativeGenerator(upload_folder, source_path=get_photo_path)
+    return _derivative_generator
+
+def remove_derivatives(filename):
+    """Remove thumbnails and previews when a photo is deleted"""
+    try:
+        get_derivative_generator().remove(filename)
+    except OSError as e:
+        logger.warning('Could not remove derivatives', extra={'photo': filename, 'error': str(e)})
+
+_analysis_cache = None
+
+def get_analysis_cache():
+    """Get the grain-size spectrum cache stored beside the photo metadata"""
+    global _analysis_cache
+    db_path = os.path.join(app.config['UPLOAD_FOLDER'], 'photo_metadata.db')
+    if _analysis_cache is None or _analysis_cache.db_path != db_path:
+        # analysis pulls in NumPy and Pillow, so it is imported on first use rather than at startup
+        from analysis import AnalysisCache
+        _analysis_cache = AnalysisCache(db_path)
+    return _analysis_cache
+
+def analysis_items(filenames):
+    """Build (name, path, content digest or None) items for analyze_batch"""
+    store = get_metadata_store()
+    items = []
+    for filename in filenames:
+        blob = store.blob_of(filename)
+        path = get_blob_store().locate(*blob) if blob else os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        if os.path.isfile(path):
+            items.append((filename, path, blob[0] if blob else None))
+    return items
+
+_job_queue = None
+
+def get_job_queue():
+    """Get the persistent background job queue (uploads/jobs.db)"""
+    global _job_queue
+    db_path = os.path.join(app.config['UPLOAD_FOLDER'], 'jobs.db')
+    if _job_queue is None or _job_queue.db_path != db_path:
+        if _job_queue is not None:
+            _job_queue.stop()
+        queue = JobQueue(db_path, workers=app.config['JOB_WORKERS'],
+                         processes=app.config['JOB_PROCESSES'],
+                         max_depth=app.config['JOB_QUEUE_DEPTH'])
+        queue.register('derivatives', derivatives_job)
+        queue.register('analysis', analysis_job, processes=True, then=queue_transcode)
+        queue.register('transcode', transcode_job, processes=True)
+        _job_queue = queue
+    return _job_queue
+
+def start_job_queue():
+    """Start this process's job threads, which also runs jobs still queued from before a restart"""
+    get_job_queue().start()
+
+def stop_job_queue():
+    """Stop this process's job threads after the jobs they are running (on server worker exit)"""
+    if _job_queue is not None:
+        _job_queue.stop()
+
+def derivatives_job(payload):
+    """Job handler: create the thumbnail and preview of one photo"""
+    get_derivative_generator().generate(payload['filename'])
+    return {'sizes': list(DERIVATIVE_SIZES)}
+
+def analysis_job(payload):
+    """Job handler: grain-size analysis of one photo"""
+    items = analysis_items([payload['filename']])
+    if not items:
+        raise FileNotFoundError(payload['filename'])
+    _, path, digest = items[0]
+    from analysis import analyze_cached, summarize
+    spectrum = analyze_cached(path, get_analysis_cache(), digest)
+    index_features(payload['filename'], path, digest, spectrum)
+    return summarize(spectrum, app.config['ANALYSIS_MM_PER_PIXEL']) if spectrum else None
+
+_feature_index = None
+
+def get_feature_index():
+    """Get the similarity search index (uploads/features) for the configured upload folder"""
+    global _feature_index
+    root = os.path.join(app.config['UPLOAD_FOLDER'], 'features')
+    if _feature_index is None or _feature_index.root != root:
+        from features import FeatureIndex
+        _feature_index = FeatureIndex(root)
+    return _feature_index
+
+def index_features(filename, path, digest, spectrum):
+    """Add one photo's descriptor to the similarity index (reusing it for bytes already indexed)"""
+    from features import extract_features
+    index = get_feature_index()
+    vector = index.vector_of_digest(digest) if digest else None
+    if vector is None:
+        vector = extract_features(path, spectrum)
+    # A photo deleted while its job was queued is not indexed
+    entry = get_metadata_store().get(filename)
+    if entry is not None:
+        index.put(filename, digest, vector, entry['location'])
+
+_transcoder = None
+
+def get_transcoder():
+    """Get the re-encoder configured by TRANSCODE_*, or None when TRANSCODE_FORMAT is 'off'"""
+    global _transcoder
+    if app.config['TRANSCODE_FORMAT'] == 'off':
+        return None
+    blobs = get_blob_store()
+    if _transcoder is None or _transcoder.blobs is not blobs:
+        _transcoder = Transcoder(
+            blobs, fmt=app.config['TRANSCODE_FORMAT'], quality=app.config['TRANSCODE_QUALITY'],
+            max_edge=app.config['TRANSCODE_MAX_EDGE'], subsampling=app.config['TRANSCODE_SUBSAMPLING'],
+            lossless=app.config['TRANSCODE_LOSSLESS'], keep_source=app.config['TRANSCODE_KEEP_ORIGINAL'],
+            sources=app.config['TRANSCODE_SOURCES'].split(','))
+    return _transcoder
+
+def transcode_photo(filename, dry_run=False):
+    """Re-encode one photo per TRANSCODE_*; its cached analysis moves to the new bytes
+
+    The spectrum measured on the uploaded bytes is kept for the transcoded
+    copy, so the analysis of a photo never changes because it was re-encoded.
+    """
+    result = get_transcoder().transcode(filename, dry_run=dry_run)
+    if 'digest' in result:
+        cache = get_analysis_cache()
+        cached = cache.get_many([result['source_digest']])
+        if cached:
+            cache.put_many([(result['digest'], cached[result['source_digest']])])
+    return result
+
+def transcode_job(payload):
+    """Job handler: re-encode one stored photo into the configured format"""
+    if get_transcoder() is None:
+        return {'skipped': 'transcoding is off'}
+    return transcode_photo(payload['filename'])
+
+def queue_transcode(payload, result):
+    """After a photo's analysis is done: queue its transcoding, if TRANSCODE_* wants it"""
+    transcoder = get_transcoder()
+    path = get_photo_path(payload['filename'])
+    if transcoder is None or not os.path.isfile(path) or not transcoder.wants(path):
+        return
+    try:
+        get_job_queue().submit('transcode', {'filename': payload['filename']}, JOB_PRIORITIES['transcode'])
+    except QueueFull:
+        logger.warning('Could not queue transcoding, queue is full', extra={'photo': payload['filename']})
+
+def enqueue_post_processing(filename):
+    """Queue derivatives and analysis for a new photo; returns {kind: job id}
+
+    Transcoding is queued when the analysis is done. The photo is already
+    stored, so a full queue is not an error here: derivatives are also
+    created on demand when first requested.
+    """
+    kinds = ['derivatives', 'analysis']
+    try:
+        with stage('upload.enqueue_jobs'):
+            ids = get_job_queue().submit_many([(kind, {'filename': filename}, JOB_PRIORITIES[kind]) for kind in kinds])
+        return dict(zip(kinds, ids))
+    except Exception as e:
+        logger.warning('Could not queue post-processing', extra={'photo': filename, 'error': str(e)})
+        return {}
+
+def queue_full_response():
+    """429 reply telling the client to retry once the job queue has drained"""
+    response = jsonify({'success': False, 'message': 'Server is busy processing photos, please retry shortly'})
+    response.status_code = 429
+    response.headers['Retry-After'] = '5'
+    return response
+
+def get_excel_path():
+    """Get path to the Excel sheet with sample GPS coordinates and dates"""
+    return app.config['EXCEL_PATH']
+
+excel_location_cache = ExcelLocationCache()
+sample_image_index = SampleImageIndex()
+date_index_cache = DateIndexCache()
+
+def load_excel_locations_payload():
+    """Load GPS coordinates and dates from the Excel file as (locations, json_bytes)
+
+    Both are cached until the sheet's mtime or size changes.
+    """
+    excel_path = get_excel_path()
+    if not os.path.exists(excel_path):
+        logger.warning('Excel file not found', extra={'path': excel_path})
+        return [], None
+    return excel_location_cache.get(excel_path)
 
 def load_excel_locations():
     """Load GPS coordinates and dates from Excel file"""
     try:
-        excel_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'complete_gps_and_dates.xlsx')
-        if not os.path.exists(excel_path):
-            print(f"Excel file not found at: {excel_path}")
-            return []
-        
-        # Read Excel file
-        df = pd.read_excel(excel_path)
-        print(f"Excel columns: {df.columns.tolist()}")
-        
-        locations = []
-        for index, row in df.iterrows():
-            try:
-                # Try different possible column names for latitude and longitude
-                lat_col = None
-                lng_col = None
-                
-                # Use exact column names from the Excel file
-                lat_col = 'latitude' if 'latitude' in df.columns else None
-                lng_col = 'longitude' if 'longitude' in df.columns else None
-                
-                # Fallback to checking for common variations
-                if not lat_col or not lng_col:
-                    for col in df.columns:
-                        col_lower = col.lower()
-                        if not lat_col and ('lat' in col_lower or 'latitude' in col_lower):
-                            lat_col = col
-                        elif not lng_col and ('lng' in col_lower or 'lon' in col_lower or 'longitude' in col_lower):
-                            lng_col = col
-                
-                if lat_col and lng_col:
-                    lat = float(row[lat_col])
-                    lng = float(row[lng_col])
-                    
-                    # Get additional data if available
-                    location_data = {
-                        'lat': lat,
-                        'lng': lng,
-                        'index': index + 1
-                    }
-                    
-                    # Add date if available (use exact column name)
-                    if 'date_taken' in df.columns:
-                        location_data['date'] = str(row['date_taken'])
-                    else:
-                        # Fallback to searching for date columns
-                        for col in df.columns:
-                            col_lower = col.lower()
-                            if 'date' in col_lower or 'time' in col_lower:
-                                location_data['date'] = str(row[col])
-                                break
-                    
-                    # Add image filename if available (use exact column name)
-                    if 'image_name' in df.columns:
-                        location_data['image'] = str(row['image_name'])
-                    else:
-                        # Fallback to searching for image columns
-                        for col in df.columns:
-                            col_lower = col.lower()
-                            if 'image' in col_lower or 'photo' in col_lower or 'file' in col_lower:
-                                location_data['image'] = str(row[col])
-                                break
-                    
-                    locations.append(location_data)
-                
-            except (ValueError, TypeError) as e:
-                print(f"Error processing row {index}: {e}")
-                continue
-        
-        print(f"Loaded {len(locations)} locations from Excel")
-        return locations
-        
+        return load_excel_locations_payload()[0]
     except Exception as e:
-        print(f"Error loading Excel file: {e}")
+        logger.error('Could not load Excel file', extra={'error': str(e)})
         return []
 
+def load_sample_images():
+    """Excel sample rows joined to the stored photos they name, as (rows, json_bytes)"""
+    return sample_image_index.get(get_metadata_store(), load_excel_locations())
+
+def get_date_index():
+    """Sorted timestamps of photos and sample points, rebuilt after photo writes or a sheet change"""
+    return date_index_cache.get(get_metadata_store(), load_excel_locations())
+
+def photos_version():
+    """Cache validator for responses built from the photo metadata"""
+    return get_metadata_store().version()
+
+def excel_version():
+    """Cache validator for responses built from the Excel sheet"""
+    try:
+        stat = os.stat(get_excel_path())
+    except OSError:
+        return None, None
+    return (stat.st_mtime_ns, stat.st_size), datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+
+def map_version():
+    """Cache validator for responses that combine photos and Excel samples"""
+    photos, photos_modified = photos_version()
+    excel, excel_modified = excel_version()
+    return (photos, excel), max(filter(None, (photos_modified, excel_modified)), default=None)
+
 def remove_photo_metadata(filename):
     """Remove photo metadata when photo is deleted"""
     try:
-        metadata = load_photo_metadata()
-        if filename in metadata:
-            del metadata[filename]
-            metadata_file = get_metadata_file_path()
-            with open(metadata_file, 'w') as f:
-                json.dump(metadata, f, indent=2)
+        get_metadata_store().delete(filename)
+        update_map_index(filename, None)
     except Exception as e:
-        print(f"Warning: Could not remove metadata for {filename}: {e}")
+        logger.warning('Could not remove metadata', extra={'photo': filename, 'error': str(e)})
+
+class MapIndex:
+    """Spatial index over photo locations and Excel sample points for the map API
+
+    Photos are kept in step with the metadata store: local writes are applied
+    incrementally, and if the store's generation moved by more than our own
+    write (another worker process wrote), the photo layer is rebuilt on the
+    next query. The sample layer is reloaded when the Excel cache reloads.
+    """
+
+    def __init__(self):
+        self.grid = GridIndex()
+        self.lock = threading.Lock()
+        self.generation = None
+        self.excel_locations = None
+
+    @staticmethod
+    def photo_point(filename, entry):
+        """Return (lat, lng, payload) for a located photo, or None"""
+        location = entry['location'] if entry else None
+        try:
+            lat = float(location['latitude'])
+            lng = float(location['longitude'])
+        except (TypeError, KeyError, ValueError):
+            return None
+        payload = photo_to_dict(filename, entry)
+        payload['kind'] = 'photo'
+        return lat, lng, payload
+
+    def apply(self, filename, entry):
+        point = self.photo_point(filename, entry)
+        if point is None:
+            self.grid.remove('photo:' + filename)
+        else:
+            self.grid.add('photo:' + filename, point[0], point[1], 'photo', point[2])
+
+    def sync(self, store):
+        """Rebuild the photo layer if the store changed behind our back"""
+        generation = store.generation()
+        if generation != self.generation:
+            self.grid.remove_kind('photo')
+            points = (self.photo_point(filename, entry) for filename, entry in store.all().items())
+            self.grid.add_many('photo', [
+                ('photo:' + point[2]['filename'], point[0], point[1], point[2])
+                for point in points if point is not None
+            ])
+            self.generation = generation
+
+        locations = load_sample_images()[0]
+        if locations is not self.excel_locations:
+            self.grid.remove_kind('sample')
+            self.grid.add_many('sample', [
+                (f"sample:{location['index']}", location['lat'], location['lng'], dict(location, kind='sample'))
+                for location in locations
+            ])
+            self.excel_locations = locations
+
+map_index = MapIndex()
+
+def update_map_index(filename, entry):
+    """Apply a just-committed metadata write to the map index"""
+    with map_index.lock:
+        if map_index.generation is None:
+            return
+        if get_metadata_store().generation() == map_index.generation + 1:
+            map_index.apply(filename, entry)
+            map_index.generation += 1
 
 @app.route('/')
 def index():
@@ -158,16 +593,28 @@ def upload_file():
             return jsonify({'success': False, 'message': 'No file selected'})
         
         if file and allowed_file(file.filename):
-            # Generate unique filename
-            filename = str(uuid.uuid4()) + '.' + file.filename.rsplit('.', 1)[1].lower()
-            secure_name = secure_filename(filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_name)
-            file.save(file_path)
+            if get_job_queue().full(len(JOB_KINDS)):
+                return queue_full_response()
+            
+            # Stream into the blob store; identical bytes are stored once
+            extension = file.filename.rsplit('.', 1)[1].lower()
+            stored = stream_to_upload(file.stream, extension)
+            if stored is None:
+                return jsonify({'success': False, 'message': 'Uploaded file is empty'})
+            secure_name, _, _, duplicate, entry = stored
+            jobs = {} if duplicate else enqueue_post_processing(secure_name)
+            if duplicate:
+                message = 'This photo was already uploaded'
+            else:
+                message = 'File uploaded successfully!' + (' with location' if entry['location'] else '')
             
             return jsonify({
                 'success': True, 
-                'message': 'File uploaded successfully!',
-                'filename': secure_name
+                'message': message,
+                'filename': secure_name,
+                'location': entry['location'],
+                'duplicate': duplicate,
+                'jobs': jobs
             })
         else:
             return jsonify({
@@ -180,87 +627,279 @@ def upload_file():
 
 @app.route('/capture', methods=['POST'])
 def capture_photo():
-    """Handle photo capture from camera"""
+    """Handle photo capture from camera
+
+    Preferred: the raw image as the request body (Content-Type image/*) with
+    location fields in the query string, or a multipart form with an 'image'
+    file part and location fields. Either way the body is streamed to disk in
+    chunks. Older clients may still POST JSON with a base64 data URL.
+    """
     try:
-        data = request.get_json()
-        
-        if 'image' not in data:
-            return jsonify({'success': False, 'message': 'No image data received'})
-        
-        # Extract base64 image data
-        image_data = data['image']
+        if get_job_queue().full(len(JOB_KINDS)):
+            return queue_full_response()
         
-        # Remove data URL prefix if present
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
+        if request.is_json:
+            return capture_photo_base64(request.get_json())
         
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data)
-        
-        # Generate unique filename
-        filename = str(uuid.uuid4()) + '.png'
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Save the image
-        with open(file_path, 'wb') as f:
-            f.write(image_bytes)
+        if request.mimetype in CAPTURE_CONTENT_TYPES:
+            stream = request.stream
+            extension = CAPTURE_CONTENT_TYPES[request.mimetype]
+            location_data = location_from_fields(request.args)
+        elif 'image' in request.files:
+            image = request.files['image']
+            stream = image.stream
+            extension = CAPTURE_CONTENT_TYPES.get(image.mimetype, 'png')
+            location_data = location_from_fields(request.form)
+        else:
+            return jsonify({'success': False, 'message': 'No image data received'})
         
-        # Handle location data if provided
-        location_data = data.get('location')
-        if location_data:
-            save_photo_metadata(filename, location_data)
-            print(f"Photo {filename} saved with location: {location_data['latitude']}, {location_data['longitude']}")
+        stored = stream_to_upload(stream, extension, location_data)
+        if stored is None:
+            return jsonify({'success': False, 'message': 'No image data received'})
         
-        return jsonify({
-            'success': True,
-            'message': 'Photo captured successfully!' + (' with location' if location_data else ''),
-            'filename': filename
-        })
+        return capture_response(stored, location_data)
     
     except Exception as e:
         return jsonify({'success': False, 'message': f'Capture failed: {str(e)}'})
 
+def capture_photo_base64(data):
+    """Legacy capture path: JSON body with a base64 data URL in 'image'"""
+    if 'image' not in data:
+        return jsonify({'success': False, 'message': 'No image data received'})
+    
+    # Extract base64 image data
+    image_data = data['image']
+    
+    # Remove data URL prefix if present; its MIME type names the stored format
+    mimetype = None
+    if ',' in image_data:
+        prefix, image_data = image_data.split(',', 1)
+        mimetype = prefix[len('data:'):].split(';')[0] if prefix.startswith('data:') else None
+    
+    # Decode base64 image and save it
+    with stage('capture.base64_decode'):
+        image_bytes = base64.b64decode(image_data)
+    # The bytes win if they disagree with the MIME type (older clients labelled JPEGs as PNG)
+    extension = (sniff_format(image_bytes[:12]) or
+                 (CAPTURE_CONTENT_TYPES.get(mimetype) if mimetype != 'application/octet-stream' else None) or 'png')
+    stored = stream_to_upload(io.BytesIO(image_bytes), extension, data.get('location'))
+    if stored is None:
+        return jsonify({'success': False, 'message': 'No image data received'})
+    
+    return capture_response(stored, data.get('location'))
+
+def capture_response(stored, location_data):
+    """Queue post-processing for a stored capture and build the JSON reply"""
+    filename, sha256, _, duplicate, _ = stored
+    if duplicate:
+        message = 'This photo was already captured'
+        jobs = {}
+    else:
+        jobs = enqueue_post_processing(filename)
+        message = 'Photo captured successfully!' + (' with location' if location_data else '')
+    
+    return jsonify({
+        'success': True,
+        'message': message,
+        'filename': filename,
+        'sha256': sha256,
+        'duplicate': duplicate,
+        'jobs': jobs
+    })
+
+def session_error_response(error):
+    """JSON reply for a SessionError with the status it carries"""
+    return jsonify({'success': False, 'message': str(error)}), error.status
+
+def upload_session_response(upload_id, status_code=200):
+    """JSON (and tus-style Upload-Offset/Upload-Length headers) describing a session's progress"""
+    progress = get_upload_sessions().status(upload_id)
+    response = jsonify({
+        'success': True,
+        'upload_id': upload_id,
+        'length': progress['length'],
+        'offset': progress['offset'],
+        'missing': progress['missing'],
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE'],
+        'expires_at': datetime.fromtimestamp(progress['expires_at'], timezone.utc).isoformat(timespec='seconds')
+    })
+    response.status_code = status_code
+    response.headers['Upload-Offset'] = str(progress['offset'])
+    response.headers['Upload-Length'] = str(progress['length'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Start a resumable upload
+
+    JSON body: 'length' in bytes, 'filename' (for its extension) or 'type'
+    (an image content type), and optionally 'sha256' of the whole file and
+    'location'. Chunks are then sent with PATCH /api/uploads/<id> and the
+    upload finished with POST /api/uploads/<id>/complete.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        length = int(data.get('length'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'length must be the file size in bytes'}), 400
+    filename = data.get('filename') or ''
+    if filename:
+        if not allowed_file(filename):
+            return jsonify({'success': False,
+                            'message': 'Invalid file type. Please upload PNG, JPG, JPEG, GIF, or WebP files.'}), 400
+        extension = filename.rsplit('.', 1)[1].lower()
+    elif data.get('type') in CAPTURE_CONTENT_TYPES:
+        extension = CAPTURE_CONTENT_TYPES[data['type']]
+    else:
+        return jsonify({'success': False, 'message': 'filename or an image type is required'}), 400
+    sha256 = data.get('sha256')
+    if sha256 is not None and (len(sha256) != 64 or any(c not in '0123456789abcdefABCDEF' for c in sha256)):
+        return jsonify({'success': False, 'message': 'sha256 must be 64 hex digits'}), 400
+    try:
+        upload_id = get_upload_sessions().create(length, extension, sha256, data.get('location'))
+    except SessionError as e:
+        return session_error_response(e)
+    response = upload_session_response(upload_id, 201)
+    response.headers['Location'] = f'/api/uploads/{upload_id}'
+    return response
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'HEAD'])
+def upload_status(upload_id):
+    """Progress of a resumable upload: contiguous offset and the byte ranges still missing"""
+    try:
+        return upload_session_response(upload_id)
+    except SessionError as e:
+        return session_error_response(e)
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+def upload_chunk(upload_id):
+    """Write the request body into a resumable upload at the Upload-Offset header (or ?offset=)
+
+    Chunks may arrive in any order and in parallel; the body is streamed
+    into place without being held in memory.
+    """
+    try:
+        offset = int(request.headers.get('Upload-Offset', request.args.get('offset')))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Upload-Offset must be a byte offset'}), 400
+    try:
+        with stage('upload.chunk_write'):
+            get_upload_sessions().write_chunk(upload_id, offset, request.stream, STREAM_CHUNK_SIZE,
+                                              request.content_length)
+        return upload_session_response(upload_id)
+    except SessionError as e:
+        return session_error_response(e)
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Verify a resumable upload's checksum and store it like a single-shot /upload
+
+    An optional JSON 'sha256' is checked in place of the one given at
+    creation. Missing ranges (409) or a checksum mismatch (422) leave the
+    session open so the client can resend.
+    """
+    if get_job_queue().full(len(JOB_KINDS)):
+        return queue_full_response()
+    data = request.get_json(silent=True) or {}
+    sessions = get_upload_sessions()
+    try:
+        with stage('upload.verify'):
+            path, sha256, size, extension, location_data = sessions.finish(upload_id, data.get('sha256'))
+    except SessionError as e:
+        return session_error_response(e)
+    try:
+        filename, _, _, duplicate, entry = store_upload(path, sha256, size, extension, location_data)
+    finally:
+        sessions.discard(upload_id)
+    jobs = {} if duplicate else enqueue_post_processing(filename)
+    if duplicate:
+        message = 'This photo was already uploaded'
+    else:
+        message = 'File uploaded successfully!' + (' with location' if entry['location'] else '')
+    return jsonify({
+        'success': True,
+        'message': message,
+        'filename': filename,
+        'sha256': sha256,
+        'location': entry['location'],
+        'duplicate': duplicate,
+        'jobs': jobs
+    })
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    """Abandon a resumable upload and delete what was received"""
+    sessions = get_upload_sessions()
+    try:
+        sessions.status(upload_id)
+    except SessionError as e:
+        return session_error_response(e)
+    sessions.discard(upload_id)
+    return jsonify({'success': True, 'message': 'Upload cancelled'})
+
+def send_upload(directory, filename, immutable=True):
+    """Send an upload or derivative with long-lived immutable caching
+
+    Upload names are generated (UUIDs) and never reused for other content,
+    so clients may cache them for a year. send_from_directory already adds a
+    strong ETag and answers conditional and Range requests (206) itself.
+    With immutable=False (a photo a transcode job may still re-encode under
+    the same URL) clients must revalidate instead; the ETag changes with the
+    blob.
+    """
+    response = send_from_directory(directory, filename, max_age=UPLOAD_MAX_AGE if immutable else None)
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+def may_be_transcoded(path):
+    """Whether the stored file at path is one TRANSCODE_* would still re-encode"""
+    transcoder = get_transcoder()
+    return transcoder is not None and os.path.isfile(path) and transcoder.wants(path)
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    """Serve uploaded files"""
+    """Serve uploaded files; ?size=thumb or ?size=medium serves a downscaled copy"""
+    size = request.args.get('size')
+    filename = secure_filename(filename)
+    path = get_photo_path(filename)
+    if size in DERIVATIVE_SIZES and allowed_file(filename) and os.path.exists(path):
+        try:
+            derivative = get_derivative_generator().get_or_create(filename, size)
+            return send_upload(os.path.dirname(derivative), os.path.basename(derivative))
+        except Exception as e:
+            # Not decodable as an image; fall back to the original below
+            logger.warning('Could not create derivative', extra={'photo': filename, 'size': size, 'error': str(e)})
     try:
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+        return send_upload(os.path.dirname(path), os.path.basename(path), immutable=not may_be_transcoded(path))
     except FileNotFoundError:
         return jsonify({'error': 'File not found'}), 404
 
 @app.route('/gallery')
+@conditional(photos_version)
 def gallery():
-    """Show all uploaded images"""
+    """Show the newest uploaded images; the page loads further ones from /api/photos"""
     try:
-        files = []
-        upload_path = app.config['UPLOAD_FOLDER']
-        metadata = load_photo_metadata()
+        entries = get_metadata_store().page(GALLERY_PAGE_SIZE + 1)
+        files = [
+            {
+                'filename': filename,
+                'has_location': entry['location'] is not None,
+                'location': entry['location'],
+                'created_at': entry['created_at']
+            }
+            for filename, entry in entries[:GALLERY_PAGE_SIZE]
+        ]
+        next_cursor = encode_cursor(entries[GALLERY_PAGE_SIZE - 1]) if len(entries) > GALLERY_PAGE_SIZE else None
         
-        # Debug: print upload folder path
-        print(f"Looking for files in: {upload_path}")
-        
-        if os.path.exists(upload_path):
-            for filename in os.listdir(upload_path):
-                if allowed_file(filename):
-                    # Create file info with metadata
-                    file_info = {
-                        'filename': filename,
-                        'has_location': filename in metadata and metadata[filename].get('location') is not None,
-                        'location': metadata.get(filename, {}).get('location'),
-                        'created_at': metadata.get(filename, {}).get('created_at')
-                    }
-                    files.append(file_info)
-                    print(f"Found file: {filename} (location: {'yes' if file_info['has_location'] else 'no'})")
-        else:
-            print(f"Upload directory does not exist: {upload_path}")
-        
-        files.sort(key=lambda x: x['created_at'] or '', reverse=True)  # Show newest first
-        print(f"Total files to display: {len(files)}")
-        
-        return render_template('gallery.html', files=files)
+        return render_template('gallery.html', files=files, next_cursor=next_cursor)
     
     except Exception as e:
-        print(f"Gallery error: {str(e)}")
+        logger.exception('Gallery error')
         return render_template('gallery.html', files=[], error=str(e))
 
 @app.route('/remove', methods=['POST'])
@@ -282,19 +921,15 @@ def remove_photo():
                 errors.append(f"Invalid filename: {filename}")
                 continue
             
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            
-            # Check if file exists and is in uploads folder
-            if os.path.exists(file_path) and allowed_file(filename):
-                try:
-                    os.remove(file_path)
-                    remove_photo_metadata(filename)  # Also remove metadata
+            try:
+                if delete_photo_file(filename):
+                    remove_derivatives(filename)
                     removed_files.append(filename)
-                    print(f"Removed file: {filename}")
-                except Exception as e:
-                    errors.append(f"Failed to remove {filename}: {str(e)}")
-            else:
-                errors.append(f"File not found: {filename}")
+                    logger.info('Removed photo', extra={'photo': filename})
+                else:
+                    errors.append(f"File not found: {filename}")
+            except Exception as e:
+                errors.append(f"Failed to remove {filename}: {str(e)}")
         
         return jsonify({
             'success': True,
@@ -304,7 +939,7 @@ def remove_photo():
         })
         
     except Exception as e:
-        print(f"Remove photo error: {str(e)}")
+        logger.exception('Remove photo error')
         return jsonify({'success': False, 'message': str(e)})
 
 @app.route('/map')
@@ -312,53 +947,411 @@ def map_view():
     """Show map with photo locations"""
     return render_template('map.html')
 
+REGISTRY.gauge('photos_total', 'Photos in the metadata store', lambda: get_metadata_store().count())
+REGISTRY.gauge('job_queue_depth', 'Queued plus running background jobs', lambda: get_job_queue().depth())
+
+@app.route('/metrics')
+def metrics():
+    """Request latency, stage timings and queue gauges in the Prometheus text format"""
+    return metrics_response()
+
 @app.route('/test')
 def test_page():
     """Mobile connectivity and camera test page"""
     return render_template('test.html')
 
 @app.route('/api/excel-locations')
+@conditional(map_version)
 def excel_locations():
-    """API endpoint to get GPS locations from Excel file"""
+    """GPS locations from the Excel file, joined to the uploaded photos they name
+
+    Each location carries image_status (found, missing or none) and, when
+    found, the stored filename, url and thumbnail_url. orphans lists uploads
+    that no row names and that have no location of their own.
+    """
     try:
-        locations = load_excel_locations()
+        return app.response_class(load_sample_images()[1], mimetype='application/json')
+    except Exception as e:
         return jsonify({
+            'success': False,
+            'message': f'Error loading Excel locations: {str(e)}'
+        })
+
+def photo_to_dict(filename, entry):
+    """Shape a metadata row for the photo JSON APIs"""
+    return {
+        'filename': filename,
+        'url': f'/uploads/{filename}',
+        'thumbnail_url': f'/uploads/{filename}?size=thumb',
+        'location': entry['location'],
+        'created_at': entry['created_at']
+    }
+
+def parse_bbox(value):
+    """Parse a 'west,south,east,north' bbox argument into (south, west, north, east)"""
+    west, south, east, north = [float(v) for v in value.split(',')]
+    return south, west, north, east
+
+def export_rows(sources, start=None, end=None, bbox=None):
+    """Chain the photo and Excel sample export rows for the requested sources"""
+    if 'photos' in sources:
+        yield from photo_rows(get_metadata_store(), get_analysis_cache(),
+                              app.config['ANALYSIS_MM_PER_PIXEL'], start=start, end=end, bbox=bbox)
+    if 'samples' in sources:
+        yield from sample_rows(load_sample_images()[0], start=start, end=end, bbox=bbox)
+
+def encode_cursor(row):
+    """Encode the (created_at, filename) key of a listing row as an opaque cursor"""
+    filename, entry = row
+    key = json.dumps([entry['created_at'], filename]).encode('utf-8')
+    return base64.urlsafe_b64encode(key).decode('ascii')
+
+def decode_cursor(cursor):
+    created_at, filename = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return created_at, filename
+
+def parse_bool_arg(value):
+    if value is None or value == '':
+        return None
+    return value.lower() in ('1', 'true', 'yes')
+
+@app.route('/api/photos')
+@conditional(photos_version)
+def list_photos():
+    """Paginated photo listing, newest first
+
+    Query parameters: limit (default 50, max 500), after (cursor from the
+    previous page's 'next'), has_location (true/false), from and to (dates
+    in any format /api/dates accepts, normalized to ISO; to is exclusive).
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), MAX_PAGE_SIZE)
+        after = request.args.get('after')
+        store = get_metadata_store()
+        entries = store.page(
+            limit + 1,
+            after=decode_cursor(after) if after else None,
+            has_location=parse_bool_arg(request.args.get('has_location')),
+            start=to_iso(request.args['from']) if request.args.get('from') else None,
+            end=to_iso(request.args['to']) if request.args.get('to') else None
+        )
+        response = {
             'success': True,
-            'locations': locations,
-            'count': len(locations)
+            'photos': [photo_to_dict(*row) for row in entries[:limit]],
+            'next': encode_cursor(entries[limit - 1]) if len(entries) > limit else None
+        }
+        if not after:
+            response['total'] = store.count()
+        return jsonify(response)
+    
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'message': f'Invalid listing parameters: {str(e)}'}), 400
+    except Exception as e:
+        logger.exception('List photos error')
+        return jsonify({'success': False, 'message': str(e)})
+
+def change_delta(since, limit=CHANGE_PAGE_SIZE):
+    """Body of /api/changes (and of each stream message): photo changes after cursor since"""
+    store = get_metadata_store()
+    delta = store.changes_since(since, limit)
+    if delta is None:
+        return {'success': True, 'reset': True, 'seq': store.change_seq(), 'changes': [], 'more': False}
+    changes, seq, more = delta
+    return {
+        'success': True,
+        'reset': False,
+        'seq': seq,
+        'changes': [{'op': op, 'filename': filename, 'photo': photo_to_dict(filename, entry) if entry else None}
+                    for filename, op, entry in changes],
+        'more': more
+    }
+
+@app.route('/api/changes')
+@conditional(photos_version)
+def list_changes():
+    """Photos added, updated or deleted since a change-feed cursor
+
+    Without since, returns only the current cursor ('seq'): take it before
+    loading the full photo list, then pass it back as since to get what
+    changed after. Each change carries the photo as /api/photos shapes it
+    (None when deleted). 'more' means limit cut the reply short; 'reset'
+    means the cursor is too old and the client must reload everything.
+    'stream' is the Server-Sent Events URL pushing the same deltas, if any.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', CHANGE_PAGE_SIZE)), 1), CHANGE_PAGE_SIZE)
+        since = request.args.get('since')
+        if since is None:
+            response = {'success': True, 'reset': False, 'seq': get_metadata_store().change_seq(),
+                        'changes': [], 'more': False}
+        else:
+            response = change_delta(int(since), limit)
+        response['stream'] = app.config['EVENTS_URL']
+        return jsonify(response)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid change parameters: {str(e)}'}), 400
+
+@app.route('/api/map-points')
+@conditional(map_version)
+def map_points():
+    """Points or pre-aggregated clusters inside the visible map area
+
+    Query parameters: bbox (west,south,east,north as from Leaflet's
+    toBBoxString, default whole world), zoom (default 0), layers
+    (comma-separated: photos, samples; default both) and cluster (1 to
+    always cluster, 0 never, default auto: individual points unless more
+    than MAP_POINT_LIMIT are visible).
+    """
+    try:
+        bbox = parse_bbox(request.args.get('bbox', '-180,-90,180,90'))
+        zoom = int(request.args.get('zoom', 0))
+        layer_names = request.args.get('layers', 'photos,samples').split(',')
+        kinds = {MAP_LAYERS[name] for name in layer_names if name in MAP_LAYERS}
+        cluster = request.args.get('cluster', 'auto')
+        
+        with map_index.lock:
+            map_index.sync(get_metadata_store())
+        
+        if cluster != '1':
+            points, total = map_index.grid.points(bbox, kinds=kinds, limit=MAP_POINT_LIMIT)
+            if cluster == '0' or total <= MAP_POINT_LIMIT or zoom > MAX_CLUSTER_ZOOM:
+                return jsonify({
+                    'success': True,
+                    'mode': 'points',
+                    'points': points,
+                    'total': total,
+                    'truncated': total > len(points)
+                })
+        
+        clusters = map_index.grid.clusters(bbox, zoom, kinds=kinds)
+        return jsonify({
+            'success': True,
+            'mode': 'clusters',
+            'clusters': clusters,
+            'total': sum(c['count'] for c in clusters)
         })
+    
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'message': f'Invalid map query: {str(e)}'}), 400
     except Exception as e:
+        logger.exception('Map points error')
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/dates')
+@conditional(map_version)
+def date_query():
+    """Photos and sample points in a date range, or their counts per day, week or site
+
+    Query parameters: from and to (ISO or DD-MM-YYYY dates or datetimes, to
+    is exclusive), sources (comma-separated: photos, samples; default both),
+    group (day, week or site: return counts instead of items), and limit
+    (default 100, max 500) and offset for items. Both are answered from the
+    date index by binary search on the range.
+    """
+    try:
+        start = to_ms(request.args['from']) if request.args.get('from') else None
+        end = to_ms(request.args['to']) if request.args.get('to') else None
+        sources = [name for name in request.args.get('sources', 'photos,samples').split(',') if name in SOURCES]
+        group = request.args.get('group')
+        index = get_date_index()
+        if group:
+            if group not in GROUPS:
+                raise ValueError(f"group must be one of {', '.join(GROUPS)}")
+            groups = index.aggregate(group, start, end, sources)
+            return jsonify({
+                'success': True,
+                'group': group,
+                'groups': groups,
+                'total': sum(row['total'] for row in groups),
+                'undated': index.undated
+            })
+        limit = min(max(int(request.args.get('limit', 100)), 1), MAX_PAGE_SIZE)
+        offset = max(int(request.args.get('offset', 0)), 0)
+        total, items = index.select(start, end, sources, offset=offset, limit=limit)
         return jsonify({
-            'success': False,
-            'message': f'Error loading Excel locations: {str(e)}'
+            'success': True,
+            'items': items,
+            'total': total,
+            'next_offset': offset + limit if offset + limit < total else None
         })
+    
+    except (ValueError, TypeError) as e:
+        return jsonify({'success': False, 'message': f'Invalid date query: {str(e)}'}), 400
+    except Exception as e:
+        logger.exception('Date query error')
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/analysis/<filename>')
+def photo_analysis(filename):
+    """Grain-size distribution of one photo (computed once per image content)
+
+    Query parameter mm_per_pixel overrides the configured scale. If the photo
+    has not been analyzed yet, an analysis job is queued and the reply is 202
+    with the job's status URL.
+    """
+    try:
+        mm_per_pixel = float(request.args.get('mm_per_pixel', app.config['ANALYSIS_MM_PER_PIXEL']))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid mm_per_pixel'}), 400
+    try:
+        items = analysis_items([secure_filename(filename)])
+        if not items:
+            return jsonify({'success': False, 'message': 'File not found'}), 404
+        name, path, digest = items[0]
+        digest = digest or file_digest(path)
+        cached = get_analysis_cache().get_many([digest])
+        if digest not in cached:
+            job_id = get_job_queue().submit('analysis', {'filename': name}, JOB_PRIORITIES['analysis'])
+            return jsonify({
+                'success': True,
+                'status': 'queued',
+                'job_id': job_id,
+                'status_url': f'/api/jobs/{job_id}'
+            }), 202
+        spectrum = cached[digest]
+        if spectrum is None:
+            return jsonify({'success': False, 'message': 'No grains could be measured in this photo'})
+        from analysis import summarize
+        return jsonify({'success': True, 'filename': name, 'analysis': summarize(spectrum, mm_per_pixel)})
+    
+    except QueueFull:
+        return queue_full_response()
+    except Exception as e:
+        logger.exception('Analysis error')
+        return jsonify({'success': False, 'message': str(e)})
+
+def similar_version():
+    """Cache validator for similarity results: photo writes and similarity index updates"""
+    generation, modified = photos_version()
+    return (generation, get_feature_index().stamp()), modified
+
+@app.route('/api/similar/<filename>')
+@conditional(similar_version)
+def similar_photos(filename):
+    """Photos that look most like this one (colour, texture and grain size)
+
+    Query parameters: k (default 10, max 100) and within_km, which keeps
+    only photos within that distance of this photo's location. Results are
+    nearest first; distance is between descriptors (0 for identical
+    images), distance_km between locations when both have one.
+    """
+    try:
+        k = min(max(int(request.args.get('k', 10)), 1), MAX_SIMILAR)
+        within_km = float(request.args['within_km']) if request.args.get('within_km') else None
+        if within_km is not None and within_km <= 0:
+            raise ValueError('within_km must be positive')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid similarity parameters: {str(e)}'}), 400
+    filename = secure_filename(filename)
+    index = get_feature_index()
+    with stage('similar.sync'):
+        index.sync(get_metadata_store())
+    try:
+        with stage('similar.search'):
+            matches = index.similar(filename, k, within_km)
+    except KeyError:
+        return jsonify({'success': False, 'message': f'{filename} is not in the similarity index yet'}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    store = get_metadata_store()
+    results = []
+    for name, distance, km in matches:
+        entry = store.get(name)
+        if entry is None:
+            continue
+        result = photo_to_dict(name, entry)
+        result['distance'] = round(distance, 4)
+        result['distance_km'] = round(km, 3) if km is not None else None
+        results.append(result)
+    return jsonify({'success': True, 'filename': filename, 'results': results})
+
+@app.route('/api/export')
+def export_data():
+    """Stream photos and Excel samples as CSV, NDJSON, GeoJSON or XLSX
+
+    Query parameters: format (csv, ndjson, geojson, xlsx; default csv),
+    sources (comma-separated: photos, samples; default both), from and to
+    (ISO or DD-MM-YYYY dates or datetimes, to is exclusive) and bbox
+    (west,south,east,north). Rows are generated while the response is sent,
+    so memory use stays flat.
+    """
+    try:
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'success': False, 'message': f'Unknown export format: {export_format}'}), 400
+        sources = set(request.args.get('sources', 'photos,samples').split(','))
+        bbox = parse_bbox(request.args['bbox']) if request.args.get('bbox') else None
+        start = to_iso(request.args['from']) if request.args.get('from') else None
+        end = to_iso(request.args['to']) if request.args.get('to') else None
+        rows = export_rows(sources, start=start, end=end, bbox=bbox)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid export parameters: {str(e)}'}), 400
+    
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    chunks = xlsx_chunks(rows) if export_format == 'xlsx' else TEXT_WRITERS[export_format](rows)
+    filename = f"sand-export-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{extension}"
+    return Response(chunks, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_jobs():
+    """Batch-submit background jobs
+
+    Body: {"kind": "analysis", "filenames": [...], "priority": 0} or
+    {"jobs": [{"kind": ..., "filename": ..., "priority": ...}, ...]}.
+    All jobs are queued or none are: 429 if the queue cannot take them all.
+    """
+    try:
+        data = request.get_json() or {}
+        if 'jobs' in data:
+            specs = data['jobs']
+        else:
+            specs = [{'kind': data.get('kind'), 'filename': filename, 'priority': data.get('priority', 0)}
+                     for filename in data.get('filenames', [])]
+        jobs = []
+        for spec in specs:
+            kind = spec.get('kind')
+            filename = secure_filename(spec.get('filename') or '')
+            if kind not in JOB_KINDS or not filename:
+                return jsonify({'success': False, 'message': f'Invalid job: {spec}'}), 400
+            jobs.append((kind, {'filename': filename}, int(spec.get('priority', 0))))
+        if not jobs:
+            return jsonify({'success': False, 'message': 'No jobs provided'}), 400
+        
+        ids = get_job_queue().submit_many(jobs)
+        return jsonify({'success': True, 'job_ids': ids}), 202
+    
+    except QueueFull:
+        return queue_full_response()
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify({'success': False, 'message': f'Invalid job request: {str(e)}'}), 400
+    except Exception as e:
+        logger.exception('Submit jobs error')
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/jobs/<int:job_id>')
+def job_status(job_id):
+    """Status of a background job: queued (with queue_position), running, done (with result) or failed"""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/jobs/stats')
+def job_stats():
+    """Queue depth by status and wait/run latency percentiles per job kind"""
+    return jsonify({'success': True, 'stats': get_job_queue().stats()})
 
 @app.route('/api/photos-with-locations')
+@conditional(photos_version)
 def photos_with_locations():
-    """API endpoint to get all photos with their location data"""
+    """API endpoint to get all photos with their location data
+
+    Prefer /api/photos for large archives; this returns the whole list.
+    """
     try:
-        files = []
-        upload_path = app.config['UPLOAD_FOLDER']
-        metadata = load_photo_metadata()
-        
-        if os.path.exists(upload_path):
-            for filename in os.listdir(upload_path):
-                if allowed_file(filename):
-                    photo_data = {
-                        'filename': filename,
-                        'url': f'/uploads/{filename}',
-                        'location': None,
-                        'created_at': None
-                    }
-                    
-                    # Add metadata if available
-                    if filename in metadata:
-                        photo_data['location'] = metadata[filename].get('location')
-                        photo_data['created_at'] = metadata[filename].get('created_at')
-                    
-                    files.append(photo_data)
-        
-        files.sort(key=lambda x: x['created_at'] or '', reverse=True)
+        files = [photo_to_dict(filename, entry)
+                 for filename, entry in get_metadata_store().created_between()]
         
         return jsonify({
             'success': True,
@@ -366,7 +1359,7 @@ def photos_with_locations():
         })
     
     except Exception as e:
-        print(f"Photos with locations error: {str(e)}")
+        logger.exception('Photos with locations error')
         return jsonify({'success': False, 'message': str(e)})
 
 @app.route('/delete_photo', methods=['POST'])
@@ -383,23 +1376,370 @@ def delete_single_photo():
         if '..' in filename or '/' in filename or '\\' in filename:
             return jsonify({'success': False, 'error': 'Invalid filename'})
         
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Check if file exists and is in uploads folder
-        if os.path.exists(file_path) and allowed_file(filename):
-            try:
-                os.remove(file_path)
-                remove_photo_metadata(filename)  # Also remove metadata
-                print(f"Deleted file: {filename}")
-                return jsonify({'success': True, 'message': f'Successfully deleted {filename}'})
-            except Exception as e:
-                return jsonify({'success': False, 'error': f'Failed to delete {filename}: {str(e)}'})
-        else:
-            return jsonify({'success': False, 'error': 'File not found'})
+        try:
+            if not delete_photo_file(filename):
+                return jsonify({'success': False, 'error': 'File not found'})
+            remove_derivatives(filename)
+            logger.info('Deleted photo', extra={'photo': filename})
+            return jsonify({'success': True, 'message': f'Successfully deleted {filename}'})
+        except Exception as e:
+            return jsonify({'success': False, 'error': f'Failed to delete {filename}: {str(e)}'})
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.cli.command('reindex-uploads')
+def reindex_uploads_command():
+    """Resync the photo index with the files in uploads/"""
+    index_upload_folder(get_metadata_store())
+
+@app.cli.command('backfill-derivatives')
+@click.option('--workers', default=4, show_default=True, help='Parallel generator threads')
+def backfill_derivatives_command(workers):
+    """Create missing thumbnails and previews for every photo"""
+    filenames = [name for name in load_photo_metadata() if allowed_file(name)]
+    start = time.perf_counter()
+    done, failed = get_derivative_generator().backfill(filenames, workers=workers)
+    elapsed = time.perf_counter() - start
+    for filename, error in failed:
+        print(f"Failed: {filename}: {error}")
+    print(f"Processed {done} of {len(filenames)} photos in {elapsed:.1f}s")
+
+@app.cli.command('run-jobs')
+@click.option('--once', is_flag=True, help='Exit when no queued job is ready instead of waiting for more')
+def run_jobs_command(once):
+    """Process background jobs in the foreground (e.g. as a dedicated worker process)"""
+    queue = get_job_queue()
+    if once:
+        print(f"Ran {queue.run_pending()} jobs")
+        return
+    queue.start()
+    try:
+        while True:
+            time.sleep(60)
+            print(f"Job queue: {queue.stats()['counts']}")
+    except KeyboardInterrupt:
+        queue.stop()
+
+@app.cli.command('analyze')
+@click.option('--source', type=click.Choice(['all', 'excel']), default='all', show_default=True,
+              help='Every photo, or only the photos named in complete_gps_and_dates.xlsx')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+@click.option('--force', is_flag=True, help='Recompute even if a cached result exists')
+@click.option('--output', type=click.File('w'), default=None, help='Write per-photo results as JSON lines')
+def analyze_command(source, workers, force, output):
+    """Compute grain-size distributions for the photo archive"""
+    from analysis import analyze_batch, summarize
+    if source == 'excel':
+        filenames = [row['filename'] for row in load_sample_images()[0] if row['filename']]
+    else:
+        filenames = list(load_photo_metadata())
+    items = analysis_items(filenames)
+    mm_per_pixel = app.config['ANALYSIS_MM_PER_PIXEL']
+
+    def report(name, spectrum, error):
+        if error is not None:
+            print(f"Failed: {name}: {error}")
+        elif output is not None:
+            result = summarize(spectrum, mm_per_pixel) if spectrum else None
+            output.write(json.dumps({'filename': name, 'analysis': result}) + '\n')
+
+    stats = analyze_batch(items, get_analysis_cache(), workers=workers or app.config['ANALYSIS_WORKERS'],
+                          force=force, on_result=report)
+    print(f"{stats['images']} photos: {stats['analyzed']} analyzed, {stats['cached']} cached, "
+          f"{stats['failed']} failed in {stats['elapsed_s']:.1f}s "
+          f"({stats['images_per_second']:.1f} images/s)")
+
+@app.cli.command('index-features')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+@click.option('--force', is_flag=True, help='Recompute descriptors of photos already indexed')
+def index_features_command(workers, force):
+    """Add every photo missing from the similarity index (grain-size spectra are computed if needed)"""
+    from concurrent.futures import ProcessPoolExecutor
+    from analysis import analyze_batch
+    from features import features_for_path
+    store = get_metadata_store()
+    index = get_feature_index()
+    index.sync(store)
+    indexed = set() if force else index.indexed()
+    items = [(filename, path, digest or file_digest(path)) for filename, path, digest in
+             analysis_items([filename for filename in load_photo_metadata() if filename not in indexed])]
+    workers = workers or app.config['ANALYSIS_WORKERS']
+    cache = get_analysis_cache()
+    start = time.perf_counter()
+    analyze_batch(items, cache, workers=workers)
+    spectra = cache.get_many(set(digest for _, _, digest in items))
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        paths = [path for _, path, _ in items]
+        results = executor.map(features_for_path, paths, [spectra.get(digest) for _, _, digest in items],
+                               chunksize=max(1, len(paths) // (workers * 4)))
+        batch = []
+        for (filename, _, digest), (vector, error) in zip(items, results):
+            if error is not None:
+                failed += 1
+                click.echo(f'Failed: {filename}: {error}')
+                continue
+            entry = store.get(filename)
+            if entry is not None:
+                batch.append((filename, digest, vector, entry['location']))
+            if len(batch) >= 500:
+                index.put_many(batch)
+                batch = []
+        index.put_many(batch)
+    elapsed = time.perf_counter() - start
+    click.echo(f'Indexed {len(items) - failed} photos ({failed} failed) in {elapsed:.1f}s; '
+               f'{len(index)} in the index')
+
+@app.cli.command('backfill-exif')
+@click.option('--workers', default=8, show_default=True, help='Parallel header reader threads')
+@click.option('--batch-size', default=1000, show_default=True, help='Photos read and written per batch')
+def backfill_exif_command(workers, batch_size):
+    """Fill in locations and capture times from EXIF/XMP for photos without a location
+
+    Only each file's metadata header is read; photos are processed in
+    batches, each written to the store in a single transaction.
+    """
+    store = get_metadata_store()
+    filenames = [name for name, entry in store.all().items() if entry['location'] is None]
+    located = dated = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for offset in range(0, len(filenames), batch_size):
+            batch = filenames[offset:offset + batch_size]
+            results = executor.map(header_metadata, [get_photo_path(name) for name in batch])
+            updates = [(name, location, taken_at) for name, (location, taken_at) in zip(batch, results)
+                       if location or taken_at]
+            store.update_many(updates)
+            located += sum(1 for _, location, _ in updates if location)
+            dated += sum(1 for _, _, taken_at in updates if taken_at)
+            done = offset + len(batch)
+            elapsed = time.perf_counter() - start
+            print(f"{done}/{len(filenames)} photos, {done / elapsed:.0f} files/s")
+    elapsed = time.perf_counter() - start
+    rate = len(filenames) / elapsed if elapsed > 0 else 0
+    print(f"Read {len(filenames)} photos in {elapsed:.1f}s ({rate:.0f} files/s): "
+          f"{located} located, {dated} with a capture time")
+
+@app.cli.command('export')
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False, allow_dash=True), default='-', show_default=True,
+              help='Output file (- for stdout; xlsx needs a file)')
+@click.option('--sources', default='photos,samples', show_default=True)
+@click.option('--from', 'start', default=None, help='Earliest date (ISO or DD-MM-YYYY, inclusive)')
+@click.option('--to', 'end', default=None, help='Latest date (ISO or DD-MM-YYYY, exclusive)')
+@click.option('--bbox', default=None, help='west,south,east,north')
+def export_command(export_format, output, sources, start, end, bbox):
+    """Export photos, locations and analysis results (same data as /api/export)"""
+    try:
+        start = to_iso(start) if start else None
+        end = to_iso(end) if end else None
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    rows = export_rows(set(sources.split(',')), start=start, end=end, bbox=parse_bbox(bbox) if bbox else None)
+    if export_format == 'xlsx':
+        if output == '-':
+            raise click.UsageError('xlsx export needs --output FILE')
+        write_xlsx(rows, output)
+        return
+    with click.open_file(output, 'w', encoding='utf-8') as f:
+        for chunk in TEXT_WRITERS[export_format](rows):
+            f.write(chunk)
+
+@app.cli.command('transcode-uploads')
+@click.option('--workers', default=4, show_default=True, help='Parallel encoder threads')
+@click.option('--dry-run', is_flag=True, help='Encode in memory and report the savings without storing anything')
+def transcode_uploads_command(workers, dry_run):
+    """Re-encode stored photos per the TRANSCODE_* settings and report the bytes saved
+
+    Plain files in uploads/ are skipped; run dedupe-uploads first to move
+    them into the blob store. The savings are the bytes actually freed in
+    the blob store, so with TRANSCODE_KEEP_ORIGINAL=1 they are negative.
+    """
+    transcoder = get_transcoder()
+    if transcoder is None:
+        raise click.UsageError("TRANSCODE_FORMAT is 'off'")
+    store = get_metadata_store()
+    # Candidates by stored extension; transcode() checks each one's actual format
+    filenames = [name for name in store.all() if (store.blob_of(name) or ('', transcoder.extension))[1]
+                 != transcoder.extension]
+    transcoded = skipped = before = after = released = 0
+
+    def run(filename):
+        try:
+            return transcode_photo(filename, dry_run=dry_run)
+        except Exception as e:
+            return {'filename': filename, 'error': str(e)}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(run, filenames):
+            if 'error' in result:
+                print(f"Failed: {result['filename']}: {result['error']}")
+                skipped += 1
+                continue
+            if 'skipped' in result:
+                skipped += 1
+                continue
+            transcoded += 1
+            before += result['before']
+            after += result['after']
+            # A dry run estimates what replace() would free: the source, unless it is kept
+            released += result['released'] if 'released' in result else \
+                -result['after'] if transcoder.keep_source else result['before'] - result['after']
+    elapsed = time.perf_counter() - start
+    percent = 100 * released / before if before else 0
+    saved = (f"{'would free' if dry_run else 'freed'} {released / 1024 / 1024:.1f} MB ({percent:.0f}%)" if released >= 0
+             else f"{'would add' if dry_run else 'added'} {-released / 1024 / 1024:.1f} MB, originals kept")
+    print(f"{'Would transcode' if dry_run else 'Transcoded'} {transcoded} of {len(filenames)} photos "
+          f"({skipped} skipped) in {elapsed:.1f}s: {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB, "
+          f"blob store {saved}")
+
+@app.cli.command('gc-uploads')
+def gc_uploads_command():
+    """Delete resumable upload sessions that have expired"""
+    removed = get_upload_sessions().collect_expired()
+    click.echo(f'Removed {removed} expired upload session(s)')
+
+@app.cli.command('serve-events')
+@click.option('--host', default='0.0.0.0', show_default=True)
+@click.option('--port', default=5001, show_default=True)
+@click.option('--poll-interval', default=1.0, show_default=True, help='Seconds between change-feed checks')
+@click.option('--max-clients', default=1000, show_default=True, help='Open streams allowed at once')
+@click.option('--cert', type=click.Path(exists=True, dir_okay=False), default=None, help='TLS certificate (PEM)')
+@click.option('--key', type=click.Path(exists=True, dir_okay=False), default=None, help='TLS private key (PEM)')
+def serve_events_command(host, port, poll_interval, max_clients, cert, key):
+    """Push photo changes to browsers over Server-Sent Events
+
+    Runs in its own process next to the app, all streams on one thread.
+    Point EVENTS_URL at it (https:// with --cert/--key when the app itself
+    is served over HTTPS, as browsers block mixed content).
+    """
+    from events import ChangeStream
+    ssl_context = None
+    if cert:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(cert, key)
+    stream = ChangeStream(change_delta, lambda: get_metadata_store().change_seq(), poll_interval=poll_interval,
+                          max_clients=max_clients, allow_origin=app.config['EVENTS_ALLOW_ORIGIN'])
+    click.echo(f"Streaming changes on {'https' if cert else 'http'}://{host}:{port}/events")
+    try:
+        stream.serve(host, port, ssl_context)
+    except KeyboardInterrupt:
+        pass
+
+@app.cli.command('dedupe-uploads')
+def dedupe_uploads_command():
+    """Move plain files in uploads/ into the blob store, merging byte-identical photos
+
+    A photo whose bytes match an older photo with the same location (or that
+    has no location itself) is merged into it;
+    identical bytes with a different location become a second reference to
+    the same blob. Blob files left behind by an interrupted write are removed.
+    """
+    store = get_metadata_store()
+    blobs = get_blob_store()
+    upload_path = app.config['UPLOAD_FOLDER']
+    moved = merged = reclaimed = 0
+    for filename, entry in sorted(store.all().items(), key=lambda item: item[1]['created_at'] or ''):
+        file_path = os.path.join(upload_path, filename)
+        if store.blob_of(filename) is not None or not os.path.isfile(file_path):
+            continue
+        digest = file_digest(file_path)
+        size = os.path.getsize(file_path)
+        with store.transaction() as conn:
+            existing = blobs.find_duplicate(conn, digest, entry['location'], exclude=filename)
+            if existing is not None:
+                conn.execute('DELETE FROM photos WHERE filename = ?', (filename,))
+                os.remove(file_path)
+                merged += 1
+            else:
+                if conn.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone():
+                    reclaimed += size
+                blobs.adopt(conn, filename, file_path, digest, filename.rsplit('.', 1)[1].lower(), size)
+                moved += 1
+                continue
+        reclaimed += size
+        remove_derivatives(filename)
+    for path in blobs.orphans():
+        reclaimed += os.path.getsize(path)
+        os.remove(path)
+    print(f"Moved {moved} photos into the blob store, merged {merged} duplicates, "
+          f"reclaimed {reclaimed / 1024 / 1024:.1f} MB")
+
+@app.cli.command('build-snapshot')
+@click.option('--output', type=click.Path(dir_okay=False), default=None,
+              help='Snapshot file (default: snapshot.bin next to app.py, where api/index.py looks)')
+def build_snapshot_command(output):
+    """Compile photos, Excel locations and their join into the snapshot served by api/index.py
+
+    The bodies of /api/photos-with-locations and /api/excel-locations are
+    encoded exactly as this app sends them, so the serverless entry point
+    serves them from the mapped file without reading the sheet or a database.
+    """
+    from snapshot import write_snapshot
+    output = output or os.path.join(app.root_path, 'snapshot.bin')
+    store = get_metadata_store()
+    start = time.perf_counter()
+    photos = [photo_to_dict(filename, entry) for filename, entry in store.created_between()]
+    rows, sample_images = load_sample_images()
+    sections = {
+        'photos_with_locations': json.dumps({'success': True, 'photos': photos},
+                                            separators=(',', ':')).encode('utf-8'),
+        'excel_locations': sample_images,
+    }
+    index = write_snapshot(output, sections, info={'photos': len(photos), 'samples': len(rows),
+                                                   'generation': store.version()[0]})
+    print(f"Wrote {output} ({os.path.getsize(output) / 1024 / 1024:.1f} MB, version {index['version'][:12]}): "
+          f"{len(photos)} photos, {len(rows)} samples in {time.perf_counter() - start:.1f}s")
+
+@app.cli.command('shard-uploads')
+@click.option('--batch-size', default=500, show_default=True, help='Files moved per metadata transaction')
+def shard_uploads_command(batch_size):
+    """Move flat files into the sharded layout while the app keeps serving
+
+    Plain uploads in uploads/ become blobs (byte-identical ones share a
+    blob, but no photos are merged), then blobs and derivatives still stored
+    flat move into their prefix directories. URLs do not change, and files
+    are found on either side of each move, so this can run online and be
+    interrupted and rerun.
+    """
+    store = get_metadata_store()
+    blobs = get_blob_store()
+    upload_path = app.config['UPLOAD_FOLDER']
+    plain = [name for name in flat_files(upload_path) if allowed_file(name)]
+    adopted = 0
+    for start in range(0, len(plain), batch_size):
+        # Hashing happens outside the write lock; the move re-checks the row inside it
+        batch = [(name, os.path.join(upload_path, name)) for name in plain[start:start + batch_size]]
+        batch = [(name, path, file_digest(path), os.path.getsize(path)) for name, path in batch
+                 if os.path.isfile(path)]
+        with store.transaction() as conn:
+            for filename, file_path, digest, size in batch:
+                row = conn.execute('SELECT digest FROM photos WHERE filename = ?', (filename,)).fetchone()
+                if row is None or row[0] is not None or not os.path.isfile(file_path):
+                    continue
+                blobs.adopt(conn, filename, file_path, digest, filename.rsplit('.', 1)[1].lower(), size)
+                adopted += 1
+        print(f"{min(start + batch_size, len(plain))}/{len(plain)} plain uploads checked")
+    moved = blobs.shard(batch_size=batch_size)
+    derivatives = get_derivative_generator().shard()
+    print(f"Moved {adopted} plain uploads into the blob store, sharded {moved} blobs and {derivatives} derivatives")
+
+def serve_production(port):
+    """Replace this process with gunicorn workers configured by gunicorn.conf.py"""
+    try:
+        import gunicorn  # noqa: F401 (only checking that it is installed)
+    except ImportError:
+        logger.warning('gunicorn is not installed; serving from one process with the development server')
+        start_job_queue()
+        app.run(host='0.0.0.0', port=port, threaded=True)
+        return
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    os.environ['PORT'] = str(port)
+    os.execv(sys.executable, [sys.executable, '-m', 'gunicorn', '--config',
+                              os.path.join(app_dir, 'gunicorn.conf.py'), '--chdir', app_dir, 'app:app'])
+
 if __name__ == '__main__':
     # Create uploads directory if it doesn't exist
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -407,11 +1747,16 @@ if __name__ == '__main__':
     # Get port from environment variable (Render sets this)
     port = int(os.environ.get('PORT', 5000))
     
-    print("🚀 Starting Flask Camera App...")
-    print(f"📱 For mobile access, use: http://10.29.26.253:{port}")
-    print(f"💻 For desktop access, use: http://127.0.0.1:{port}")
-    print("📸 Camera should work on local network without HTTPS")
-    
-    # Run the app with production settings for Render
-    debug_mode = os.environ.get('FLASK_ENV') == 'development'
-    app.run(debug=debug_mode, host='0.0.0.0', port=port)
\ No newline at end of file
+    if os.environ.get('FLASK_ENV') != 'development':
+        # Production: pre-forked gunicorn workers, one per core (WEB_CONCURRENCY)
+        serve_production(port)
+    else:
+        print("🚀 Starting Flask Camera App...")
+        print(f"📱 For mobile access, use: http://10.29.26.253:{port}")
+        print(f"💻 For desktop access, use: http://127.0.0.1:{port}")
+        print("📸 Camera should work on local network without HTTPS")
+        
+        # The reloader's watcher process serves nothing; only its child runs jobs
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_job_queue()
+        app.run(debug=True, host='0.0.0.0', port=port)
@@ -0,0 +1,76 @@
+"""Micro-benchmark for the cached Excel location loader.
+
+Generates synthetic sheets shaped like complete_gps_and_dates.xlsx and
+reports cold (parse + convert + serialize) and warm (cached payload) latency.
+
+    python benchmarks/bench_excel_locations.py
+    python benchmarks/bench_excel_locations.py --sizes 20 10000
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from excel_locations import ExcelLocationCache
+
+
+def write_sheet(path, rows):
+    rng = np.random.default_rng(rows)
+    df = pd.DataFrame({
+        'image_name': [f'img{i + 1}.jpg' for i in range(rows)],
+        'latitude': 19.11 + rng.random(rows) * 0.01,
+        'longitude': 72.82 + rng.random(rows) * 0.01,
+        'date_taken': np.where(rng.random(rows) < 0.9, '2025-09-26', '26-09-2025'),
+    })
+    df.to_excel(path, index=False)
+
+
+def bench(rows, warm_iterations):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sheet.xlsx')
+        start = time.perf_counter()
+        write_sheet(path, rows)
+        build_time = time.perf_counter() - start
+
+        cache = ExcelLocationCache()
+        start = time.perf_counter()
+        locations, payload = cache.get(path)
+        cold = time.perf_counter() - start
+        assert len(locations) == rows
+
+        warm = []
+        for _ in range(warm_iterations):
+            start = time.perf_counter()
+            cache.get(path)
+            warm.append(time.perf_counter() - start)
+
+    return {
+        'rows': rows,
+        'sheet_build_s': build_time,
+        'cold_ms': cold * 1000,
+        'warm_median_us': statistics.median(warm) * 1e6,
+        'payload_bytes': len(payload),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 10_000, 500_000])
+    parser.add_argument('--warm-iterations', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'cold (ms)':>12} {'warm (us)':>10} {'payload':>12}")
+    for rows in args.sizes:
+        result = bench(rows, args.warm_iterations)
+        print(f"{result['rows']:>8} {result['cold_ms']:>12.1f} "
+              f"{result['warm_median_us']:>10.1f} {result['payload_bytes']:>12,}")
+
+
+if __name__ == '__main__':
+    main()
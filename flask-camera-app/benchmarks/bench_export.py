@@ -0,0 +1,93 @@
+"""Benchmark for the streaming bulk export (/api/export).
+
+Seeds a temporary upload folder with synthetic photo metadata (1M rows by
+default, a fifth of them with cached analysis results), then downloads the
+export in every format, each in a fresh process so peak memory is measured
+per format. The body is consumed chunk by chunk, as a client would.
+
+    python benchmarks/bench_export.py
+    python benchmarks/bench_export.py --rows 100000 --formats csv,xlsx
+"""
+import os
+import sys
+import time
+import random
+import resource
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as camera_app
+from export import EXPORT_FORMATS
+
+
+def seed(rows):
+    store = camera_app.get_metadata_store()
+    cache = camera_app.get_analysis_cache()
+    rng = random.Random(rows)
+    start = datetime(2025, 1, 1)
+    batch, spectra = [], []
+    for i in range(rows):
+        digest = f'{i:064x}' if i % 5 == 0 else None
+        batch.append(
+            ('INSERT OR REPLACE INTO photos (filename, location, created_at, digest) VALUES (?, ?, ?, ?)',
+             (f'{i:08d}.jpg',
+              store._encode_location({'latitude': 19.0 + rng.random() * 0.1,
+                                      'longitude': 72.8 + rng.random() * 0.1,
+                                      'accuracy': 10}),
+              (start + timedelta(seconds=i)).isoformat(), digest)))
+        if digest:
+            spectra.append((digest, {'sizes_px': [4, 8, 16, 32], 'finer': [0.1, 0.4, 0.8, 1.0]}))
+        if len(batch) >= 50_000:
+            store._write(batch)
+            cache.put_many(spectra)
+            batch, spectra = [], []
+    store._write(batch)
+    cache.put_many(spectra)
+
+
+def run_export(export_format):
+    """Download one export through the test client; prints seconds, bytes and peak RSS"""
+    client = camera_app.app.test_client()
+    start = time.perf_counter()
+    response = client.get(f'/api/export?format={export_format}&sources=photos', buffered=False)
+    size = sum(len(chunk) for chunk in response.response)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(elapsed, size, peak_kb)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--formats', default=','.join(EXPORT_FORMATS))
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        camera_app.app.config['UPLOAD_FOLDER'] = os.environ['BENCH_UPLOAD_FOLDER']
+        run_export(args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        camera_app.app.config['UPLOAD_FOLDER'] = tmp
+        start = time.perf_counter()
+        seed(args.rows)
+        print(f"Seeded {args.rows:,} photos in {time.perf_counter() - start:.1f}s\n")
+
+        print(f"{'format':<10} {'seconds':>9} {'rows/s':>10} {'MB out':>9} {'peak RSS (MB)':>14}")
+        for export_format in args.formats.split(','):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', export_format],
+                env=dict(os.environ, BENCH_UPLOAD_FOLDER=tmp),
+                capture_output=True, text=True, check=True).stdout
+            elapsed, size, peak_kb = output.split()[-3:]
+            elapsed = float(elapsed)
+            print(f"{export_format:<10} {elapsed:>9.1f} {args.rows / elapsed:>10,.0f} "
+                  f"{int(size) / 1e6:>9.1f} {int(peak_kb) / 1024:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark for conditional GET and compression on the map and gallery endpoints.
+
+Seeds a temporary upload folder with synthetic photo metadata, then compares
+bytes on the wire and latency for a first load, an uncompressed load, and a
+repeat load that revalidates with If-None-Match (the browser's behaviour for
+no-cache responses that carry an ETag).
+
+    python benchmarks/bench_http_caching.py
+    python benchmarks/bench_http_caching.py --photos 50000 --iterations 20
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as camera_app
+
+ENDPOINTS = [
+    '/api/map-points?zoom=3',
+    '/api/map-points?bbox=72.8,19.0,72.9,19.1&zoom=16&cluster=0',
+    '/api/photos?limit=60',
+    '/api/photos-with-locations',
+    '/gallery',
+]
+
+
+def seed(photos):
+    store = camera_app.get_metadata_store()
+    rng = random.Random(photos)
+    start = datetime(2025, 1, 1)
+    store._write(
+        ('INSERT OR REPLACE INTO photos (filename, location, created_at) VALUES (?, ?, ?)',
+         (f'{i:08d}.jpg',
+          store._encode_location({'latitude': 19.0 + rng.random() * 0.1,
+                                  'longitude': 72.8 + rng.random() * 0.1,
+                                  'accuracy': 10}),
+          (start + timedelta(seconds=i)).isoformat()))
+        for i in range(photos)
+    )
+
+
+def measure(client, url, iterations, headers=None):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers or {})
+        timings.append(time.perf_counter() - start)
+    return response, statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--photos', type=int, default=10_000)
+    parser.add_argument('--iterations', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        camera_app.app.config['UPLOAD_FOLDER'] = tmp
+        seed(args.photos)
+        client = camera_app.app.test_client()
+
+        print(f"{'endpoint':<58} {'plain':>12} {'gzip':>10} {'304':>6} "
+              f"{'full (ms)':>10} {'304 (ms)':>9}")
+        for url in ENDPOINTS:
+            client.get(url)  # warm the metadata, map index and compression caches
+            plain, _ = measure(client, url, 1, {'Accept-Encoding': 'identity'})
+            full, full_ms = measure(client, url, args.iterations, {'Accept-Encoding': 'gzip'})
+            revalidated, revalidate_ms = measure(
+                client, url, args.iterations,
+                {'Accept-Encoding': 'gzip', 'If-None-Match': full.headers['ETag']})
+            assert revalidated.status_code == 304
+            print(f"{url:<58} {len(plain.data):>12,} {len(full.data):>10,} "
+                  f"{len(revalidated.data):>6} {full_ms:>10.2f} {revalidate_ms:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Similarity search over the memory-mapped feature index at 100k+ photos.
+
+For each index size, synthetic descriptors (clustered like real archives,
+where photos of one beach resemble each other) are written to a temporary
+FeatureIndex with random locations along a coastline. The script then
+reports:
+
+- the time to open the index in a fresh view (memory map plus row table)
+- single top-k query latency, with and without a within_km filter
+- throughput when queries are batched into one matrix product per block
+- the cost of an incremental add and remove
+- separately, descriptor extraction throughput on synthetic photos
+
+    python benchmarks/bench_similar.py
+    python benchmarks/bench_similar.py --sizes 100000,250000 --queries 200
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+import numpy as np
+from PIL import Image
+from features import DIM, FeatureIndex, extract_features
+
+
+def seed(index, photos, rng, batch_size=10000):
+    """Write `photos` clustered descriptors with locations; returns seconds taken"""
+    centres = rng.random((256, DIM), dtype=np.float32)
+    start = time.perf_counter()
+    for first in range(0, photos, batch_size):
+        count = min(batch_size, photos - first)
+        clusters = rng.integers(0, len(centres), count)
+        vectors = centres[clusters] + rng.normal(0, 0.05, (count, DIM)).astype(np.float32)
+        lats = 18.9 + rng.random(count) * 0.5
+        lngs = 72.7 + rng.random(count) * 0.2
+        index.put_many((f'img{first + i}.jpg', f'digest{first + i}', vectors[i],
+                        {'latitude': float(lats[i]), 'longitude': float(lngs[i])}) for i in range(count))
+    return time.perf_counter() - start
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.95)]
+
+
+def time_queries(index, names, k, within_km=None):
+    latencies = []
+    for name in names:
+        start = time.perf_counter()
+        index.similar(name, k, within_km)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return percentiles(latencies)
+
+
+def bench_size(folder, photos, queries, k, rng):
+    index = FeatureIndex(os.path.join(folder, f'features-{photos}'))
+    build = seed(index, photos, rng)
+    size_mb = os.path.getsize(index.matrix_path) / 1024 / 1024
+    print(f"\n{photos:,} photos: written in {build:.1f}s ({photos / build:,.0f}/s), matrix {size_mb:.1f} MB")
+
+    start = time.perf_counter()
+    fresh = FeatureIndex(index.root)
+    fresh.similar('img0.jpg', k)
+    print(f"  open + first query      {(time.perf_counter() - start) * 1000:>8.1f} ms")
+
+    names = [f'img{i}.jpg' for i in rng.integers(0, photos, queries)]
+    p50, p95 = time_queries(fresh, names, k)
+    print(f"  top-{k} query             p50 {p50:>7.2f} ms  p95 {p95:>7.2f} ms")
+    p50, p95 = time_queries(fresh, names, k, within_km=5)
+    print(f"  top-{k} within 5 km       p50 {p50:>7.2f} ms  p95 {p95:>7.2f} ms")
+
+    fresh._refresh()
+    mask = fresh._valid.copy()
+    batch = np.asarray(fresh._matrix[rng.integers(0, photos, 64)], dtype=np.float32)
+    start = time.perf_counter()
+    fresh.nearest(batch, k, mask)
+    elapsed = time.perf_counter() - start
+    print(f"  64 queries batched      {elapsed * 1000:>8.1f} ms ({64 / elapsed:,.0f} queries/s)")
+
+    start = time.perf_counter()
+    index.put('added.jpg', 'digest-added', rng.random(DIM, dtype=np.float32), {'latitude': 19.0, 'longitude': 72.8})
+    added = time.perf_counter() - start
+    start = time.perf_counter()
+    fresh.similar('added.jpg', k)
+    seen = time.perf_counter() - start
+    start = time.perf_counter()
+    index.remove_many(['added.jpg'])
+    removed = time.perf_counter() - start
+    print(f"  add {added * 1000:.1f} ms, next query {seen * 1000:.1f} ms, remove {removed * 1000:.1f} ms")
+
+
+def bench_extraction(images, rng):
+    """Descriptors per second for 4000x3000 JPEGs (decoded at reduced size via draft mode)"""
+    with tempfile.TemporaryDirectory() as folder:
+        paths = []
+        for i in range(images):
+            pixels = rng.integers(0, 255, (3000 // 4, 4000 // 4, 3), dtype=np.uint8)
+            path = os.path.join(folder, f'{i}.jpg')
+            Image.fromarray(pixels).resize((4000, 3000)).save(path, quality=90)
+            paths.append(path)
+        spectrum = {'sizes_px': [4.0, 8.0, 16.0, 32.0], 'finer': [0.1, 0.4, 0.8, 1.0]}
+        start = time.perf_counter()
+        for path in paths:
+            extract_features(path, spectrum)
+        elapsed = time.perf_counter() - start
+    print(f"\nExtraction: {images} 12 MP JPEGs in {elapsed:.2f}s ({images / elapsed:.1f} images/s per core)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100000,250000', help='Comma-separated index sizes in photos')
+    parser.add_argument('--queries', type=int, default=100, help='Timed queries per size')
+    parser.add_argument('-k', type=int, default=10, help='Results per query')
+    parser.add_argument('--images', type=int, default=20, help='Photos for the extraction timing (0 skips it)')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"Descriptor: {DIM} float32 values ({DIM * 4} bytes per photo)")
+    with tempfile.TemporaryDirectory() as folder:
+        for photos in [int(size) for size in args.sizes.split(',')]:
+            bench_size(folder, photos, args.queries, args.k, rng)
+    if args.images:
+        bench_extraction(args.images, rng)
+
+
+if __name__ == '__main__':
+    main()
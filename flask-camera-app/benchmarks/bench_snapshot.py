@@ -0,0 +1,107 @@
+"""Cold-start and per-request latency of the serverless entry point (api/index.py),
+serving from a prebuilt snapshot versus the built-in sample stub.
+
+For each archive size a temporary metadata store is seeded with synthetic
+located photos and compiled with `flask build-snapshot`. A fresh Python
+process then imports api/index.py, times the first request to each route
+(the cold start a serverless instance pays), and times repeated requests.
+The stub run has no snapshot file, which is how the entry point behaved
+before snapshots existed.
+
+    python benchmarks/bench_snapshot.py
+    python benchmarks/bench_snapshot.py --sizes 1000,100000 --requests 500
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+from metadata_store import PhotoMetadataStore
+
+ROUTES = ('/api/photos-with-locations', '/api/excel-locations')
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import index
+result = {{'import_ms': (time.perf_counter() - start) * 1000, 'routes': {{}}}}
+client = index.app.test_client()
+for path in {routes!r}:
+    start = time.perf_counter()
+    response = client.get(path, headers={{'Accept-Encoding': 'gzip'}})
+    first = (time.perf_counter() - start) * 1000
+    latencies = []
+    for _ in range({requests}):
+        start = time.perf_counter()
+        client.get(path, headers={{'Accept-Encoding': 'gzip'}})
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    result['routes'][path] = {{'first_ms': first, 'bytes': len(response.data),
+                              'p50_ms': latencies[len(latencies) // 2],
+                              'p95_ms': latencies[int(len(latencies) * 0.95)]}}
+print(json.dumps(result))
+"""
+
+
+def seed(folder, photos):
+    """Metadata rows for `photos` located photos (no image files are needed)"""
+    rng = random.Random(photos)
+    start = datetime(2025, 1, 1)
+    store = PhotoMetadataStore(os.path.join(folder, 'photo_metadata.db'))
+    store._write(
+        ('INSERT INTO photos (filename, location, created_at) VALUES (?, ?, ?)',
+         (f'img{i}.jpg', store._encode_location({'latitude': 19.0 + rng.random() * 0.1,
+                                                 'longitude': 72.8 + rng.random() * 0.1, 'accuracy': 10}),
+          (start + timedelta(seconds=i)).isoformat()))
+        for i in range(photos)
+    )
+    store._write([("UPDATE meta SET value = 1 WHERE key = 'folder_indexed'", ())])
+
+
+def probe(snapshot_path, requests):
+    env = dict(os.environ, SNAPSHOT_PATH=snapshot_path)
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(routes=ROUTES, requests=requests)],
+        cwd=os.path.join(APP_DIR, 'api'), env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_result(label, result):
+    print(f"{label:<22} import {result['import_ms']:>7.1f} ms")
+    for path, stats in result['routes'].items():
+        print(f"  {path:<28} first {stats['first_ms']:>8.1f} ms  p50 {stats['p50_ms']:>7.2f} ms  "
+              f"p95 {stats['p95_ms']:>7.2f} ms  {stats['bytes'] / 1024:>8.1f} KB sent")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,100000', help='Comma-separated archive sizes in photos')
+    parser.add_argument('--requests', type=int, default=200, help='Timed requests per route after the first')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        print_result('stub (no snapshot)', probe(os.path.join(folder, 'missing.bin'), args.requests))
+        for photos in [int(size) for size in args.sizes.split(',')]:
+            uploads = os.path.join(folder, f'uploads-{photos}')
+            os.makedirs(uploads)
+            seed(uploads, photos)
+            path = os.path.join(folder, f'snapshot-{photos}.bin')
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'build-snapshot', '--output', path],
+                           cwd=APP_DIR, env=dict(os.environ, UPLOAD_FOLDER=uploads, JOB_WORKERS='0'),
+                           check=True, capture_output=True)
+            build = time.perf_counter() - start
+            print(f"\n{photos:,} photos: snapshot built in {build:.1f}s, "
+                  f"{os.path.getsize(path) / 1024 / 1024:.1f} MB")
+            print_result('snapshot', probe(path, args.requests))
+
+
+if __name__ == '__main__':
+    main()
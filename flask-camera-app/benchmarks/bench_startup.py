@@ -0,0 +1,116 @@
+"""Cold-start benchmark: import time and time to first byte from a fresh interpreter.
+
+Each run starts a new Python process, so nothing is cached in memory. It
+measures how long `import app` (and the Vercel entry point api/index.py)
+take, which heavy libraries they pull in, and how long a started server
+needs before it answers its first request.
+
+With --budget the script is a CI check. It exits with status 1 when the
+median import time goes over the budget, or when importing the app loads
+a library that should only load on first use (pandas, NumPy, Pillow,
+openpyxl).
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --budget 500
+"""
+import os
+import sys
+import time
+import json
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries that must not be imported just by loading the app
+LAZY_MODULES = ('pandas', 'numpy', 'PIL', 'openpyxl')
+
+# Entry points: (name, directory to run in, module to import)
+TARGETS = [
+    ('app', APP_DIR, 'app'),
+    ('api/index', os.path.join(APP_DIR, 'api'), 'index'),
+]
+
+IMPORT_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'import_ms': elapsed * 1000,
+                  'loaded': [name for name in {lazy!r} if name in sys.modules]}}))
+"""
+
+
+def measure_import(directory, module, env):
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_PROBE.format(module=module, lazy=LAZY_MODULES)],
+        cwd=directory, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure_first_byte(env):
+    """Milliseconds from spawning the server process to the first byte of GET /"""
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-c',
+         f'import app; app.app.run(host="127.0.0.1", port={port}, threaded=True)'],
+        cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < 60:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=5) as response:
+                    response.read(1)
+                return (time.perf_counter() - start) * 1000
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError('Server did not answer within 60s')
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Fail (exit 1) if the median import time of any entry point exceeds this many ms')
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as folder:
+        env = dict(os.environ, UPLOAD_FOLDER=folder, JOB_WORKERS='0')
+        print(f"{'entry point':<12} {'import ms (median)':>19} {'min':>8} {'max':>8}  heavy modules loaded")
+        for name, directory, module in TARGETS:
+            runs = [measure_import(directory, module, env) for _ in range(args.runs)]
+            times = [run['import_ms'] for run in runs]
+            loaded = sorted(set(name for run in runs for name in run['loaded']))
+            median = statistics.median(times)
+            print(f"{name:<12} {median:>19.1f} {min(times):>8.1f} {max(times):>8.1f}  {', '.join(loaded) or '-'}")
+            if loaded:
+                failures.append(f"{name} imports {', '.join(loaded)} at startup")
+            if args.budget is not None and median > args.budget:
+                failures.append(f"{name} import took {median:.0f}ms, budget is {args.budget:.0f}ms")
+
+        first_byte = [measure_first_byte(env) for _ in range(args.runs)]
+        print(f"\nTime to first byte of GET / from process start: median {statistics.median(first_byte):.0f}ms "
+              f"(min {min(first_byte):.0f}, max {max(first_byte):.0f})")
+
+    if args.budget is not None and failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
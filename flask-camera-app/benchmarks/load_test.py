@@ -0,0 +1,277 @@
+"""Offline load test for the capture, upload, listing and map endpoints.
+
+For each archive size, seeds a temporary upload folder with synthetic photos
+(small JPEG files plus metadata rows) and an Excel sheet with one sample row
+per photo, starts the app on a local port in a separate process, and drives
+each route with concurrent clients. Throughput, p50/p95/p99 latency and the
+server's peak RSS are printed and written as JSON, so two commits can be
+compared:
+
+    python benchmarks/load_test.py --output before.json
+    git checkout other-branch
+    python benchmarks/load_test.py --output after.json --compare before.json
+
+    python benchmarks/load_test.py --sizes 100,10000 --clients 16 --requests 500
+"""
+import io
+import os
+import sys
+import json
+import time
+import socket
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from PIL import Image
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+from metadata_store import PhotoMetadataStore
+
+DEFAULT_SIZES = '100,10000,100000'
+# Bounding box the synthetic photos and sample points are scattered over
+AREA = (19.0, 72.8, 19.1, 72.9)
+
+
+def tiny_jpeg():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (180, 160, 120)).save(buffer, 'JPEG', quality=70)
+    return buffer.getvalue()
+
+
+def seed(folder, photos):
+    """Write `photos` JPEG files, their metadata rows and a matching Excel sheet"""
+    rng = random.Random(photos)
+    jpeg = tiny_jpeg()
+    start = datetime(2025, 1, 1)
+    names = [f'img{i}.jpg' for i in range(photos)]
+    for name in names:
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(jpeg)
+
+    points = [(AREA[0] + rng.random() * (AREA[2] - AREA[0]), AREA[1] + rng.random() * (AREA[3] - AREA[1]))
+              for _ in names]
+    store = PhotoMetadataStore(os.path.join(folder, 'photo_metadata.db'))
+    store._write(
+        ('INSERT INTO photos (filename, location, created_at) VALUES (?, ?, ?)',
+         (name, store._encode_location({'latitude': lat, 'longitude': lng, 'accuracy': 10}),
+          (start + timedelta(seconds=i)).isoformat()))
+        for i, (name, (lat, lng)) in enumerate(zip(names, points))
+    )
+    # The folder is already in step with the rows, so skip the first-start scan
+    store._write([("UPDATE meta SET value = 1 WHERE key = 'folder_indexed'", ())])
+
+    sheet = os.path.join(folder, 'samples.xlsx')
+    pd.DataFrame({
+        'image_name': names,
+        'latitude': [lat for lat, _ in points],
+        'longitude': [lng for _, lng in points],
+        'date_taken': [(start + timedelta(days=i % 365)).strftime('%d-%m-%Y') for i in range(photos)],
+    }).to_excel(sheet, index=False)
+    return names, sheet
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    """The app on a local port, in its own process with its own upload folder"""
+
+    def __init__(self, folder, sheet):
+        self.port = free_port()
+        self.base = f'http://127.0.0.1:{self.port}'
+        env = dict(os.environ, UPLOAD_FOLDER=folder, EXCEL_PATH=sheet, PORT=str(self.port))
+        self.process = subprocess.Popen(
+            [sys.executable, '-c',
+             'import os, app; app.app.run(host="127.0.0.1", port=int(os.environ["PORT"]), threaded=True)'],
+            cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            try:
+                urllib.request.urlopen(self.base + '/api/photos?limit=1', timeout=1).read()
+                return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError('Server did not start within 60s')
+
+    def peak_rss_mb(self):
+        """High-water mark of the server's resident memory (Linux only, else None)"""
+        try:
+            with open(f'/proc/{self.process.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return None
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(10)
+
+
+def multipart(field, filename, data):
+    boundary = f'----loadtest{random.getrandbits(64):x}'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def routes(names):
+    """Return {route name: make_request()} where make_request() -> (path, body, content type)"""
+    jpeg = tiny_jpeg()
+    removable = iter(names)
+    lock = threading.Lock()
+
+    def unique_jpeg():
+        # Bytes after the end-of-image marker are ignored by decoders but defeat duplicate detection
+        return jpeg + os.urandom(16)
+
+    def capture():
+        lat, lng = AREA[0] + random.random() * 0.1, AREA[1] + random.random() * 0.1
+        return f'/capture?latitude={lat}&longitude={lng}', unique_jpeg(), 'image/jpeg'
+
+    def upload():
+        body, content_type = multipart('file', 'load.jpg', unique_jpeg())
+        return '/upload', body, content_type
+
+    def remove():
+        with lock:
+            name = next(removable, 'missing.jpg')
+        return '/remove', json.dumps({'filenames': [name]}).encode(), 'application/json'
+
+    return {
+        'GET /gallery': lambda: ('/gallery', None, None),
+        'GET /api/photos': lambda: ('/api/photos?limit=60', None, None),
+        'GET /api/photos-with-locations': lambda: ('/api/photos-with-locations', None, None),
+        'GET /api/excel-locations': lambda: ('/api/excel-locations', None, None),
+        'GET /api/map-points': lambda: ('/api/map-points?zoom=3', None, None),
+        'POST /capture': capture,
+        'POST /upload': upload,
+        'POST /remove': remove,
+    }
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+
+def drive(base, make_request, requests, clients):
+    """Send `requests` requests from `clients` threads; returns throughput and latency stats"""
+    def one(_):
+        path, body, content_type = make_request()
+        request = urllib.request.Request(base + path, data=body)
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                response.read()
+                ok = response.status < 400
+        except (urllib.error.URLError, OSError):
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency * 1000 for latency, ok in results if ok)
+    return {
+        'requests': requests,
+        'errors': sum(1 for _, ok in results if not ok),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    base = {(r['photos'], r['route']): r for r in (baseline or {}).get('results', [])}
+    header = f"{'photos':>7} {'route':<30} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6} {'RSS MB':>7}"
+    print(header + ('  vs base req/s, p95' if base else ''))
+    for r in results:
+        line = (f"{r['photos']:>7} {r['route']:<30} {r['throughput_rps']:>9.1f} "
+                f"{r['p50_ms'] or 0:>8.1f} {r['p95_ms'] or 0:>8.1f} {r['p99_ms'] or 0:>8.1f} "
+                f"{r['errors']:>6} {r['peak_rss_mb'] or 0:>7.0f}")
+        old = base.get((r['photos'], r['route']))
+        if old and old['throughput_rps'] and old['p95_ms'] and r['p95_ms']:
+            line += f"  {r['throughput_rps'] / old['throughput_rps']:>5.2f}x {r['p95_ms'] / old['p95_ms']:>5.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Comma-separated archive sizes in photos')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent clients per route')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per route and size')
+    parser.add_argument('--routes', default=None, help='Comma-separated subset, e.g. "GET /gallery,POST /capture"')
+    parser.add_argument('--output', default=None, help='Write results as JSON to this file')
+    parser.add_argument('--compare', default=None, help='Earlier JSON output to compare against')
+    args = parser.parse_args()
+
+    results = []
+    for photos in [int(size) for size in args.sizes.split(',')]:
+        with tempfile.TemporaryDirectory() as folder:
+            start = time.perf_counter()
+            names, sheet = seed(folder, photos)
+            print(f"Seeded {photos:,} photos in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+            server = Server(folder, sheet)
+            try:
+                for route, make_request in routes(names).items():
+                    if args.routes and route not in args.routes.split(','):
+                        continue
+                    # One untimed request loads the sheet and warms the indexes and caches
+                    path, body, content_type = make_request()
+                    if body is None:
+                        urllib.request.urlopen(server.base + path, timeout=300).read()
+                    stats = drive(server.base, make_request, args.requests, args.clients)
+                    results.append(dict(photos=photos, route=route, clients=args.clients,
+                                        peak_rss_mb=server.peak_rss_mb(), **stats))
+                    print(f"  {route}: {stats['throughput_rps']} req/s", file=sys.stderr)
+            finally:
+                server.stop()
+
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
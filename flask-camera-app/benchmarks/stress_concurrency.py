@@ -0,0 +1,286 @@
+"""Concurrent /capture and /remove against the multi-worker server; checks no record is lost.
+
+Starts the production server (`python app.py`, i.e. gunicorn with
+gunicorn.conf.py) on a temporary upload folder and fires thousands of
+captures from concurrent clients. Some photos are sent twice at the same
+moment with the same location, which must be stored once. A share of the
+captured photos is removed while captures are still arriving, some by two
+clients at once. Halfway through, the master is sent SIGHUP, so the run
+also covers a graceful reload. When the server has stopped, the metadata,
+blob and job tables are checked against what the clients were told:
+
+- every photo reported stored and not reported removed is there, and nothing else
+- every photo was removed by at most one request
+- identical bytes with the same location were stored once
+- blob reference counts match the rows using them, every blob file exists and none is orphaned
+- one job row exists per job id handed out (transcode jobs are queued by analysis jobs, not handed out)
+- no request failed, including those in flight during the reload
+
+The script exits with status 1 if any check fails.
+
+    python benchmarks/stress_concurrency.py
+    python benchmarks/stress_concurrency.py --captures 10000 --clients 128 --workers 8
+    python benchmarks/stress_concurrency.py --server werkzeug   # without gunicorn
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from PIL import Image
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+from blob_store import BlobStore
+from metadata_store import PhotoMetadataStore
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def photo_png(seed):
+    """A small PNG with pixels unique to `seed`"""
+    pixels = random.Random(seed).randbytes(16 * 16 * 3)
+    buffer = io.BytesIO()
+    Image.frombytes('RGB', (16, 16), pixels).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class Server:
+    """The app in a child process: the bundled gunicorn launcher, or Werkzeug forking per request"""
+
+    def __init__(self, folder, kind, workers, job_workers):
+        self.port = free_port()
+        self.base = f'http://127.0.0.1:{self.port}'
+        env = dict(os.environ, PORT=str(self.port), UPLOAD_FOLDER=os.path.join(folder, 'uploads'),
+                   EXCEL_PATH=os.path.join(folder, 'none.xlsx'), WEB_CONCURRENCY=str(workers),
+                   JOB_WORKERS=str(job_workers), JOB_QUEUE_DEPTH='10000000', LOG_LEVEL='WARNING')
+        env.pop('FLASK_ENV', None)
+        if kind == 'gunicorn':
+            command = [sys.executable, 'app.py']
+        else:
+            command = [sys.executable, '-c', 'import os, app; app.app.run(host="127.0.0.1", '
+                       f'port={self.port}, threaded=False, processes={workers})']
+        self.process = subprocess.Popen(command, cwd=APP_DIR, env=env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            try:
+                urllib.request.urlopen(self.base + '/api/changes', timeout=1).read()
+                return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError('Server did not start within 60s')
+
+    def reload(self):
+        self.process.send_signal(signal.SIGHUP)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(60)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class Client:
+    """Issues the requests and records what the server said about each photo"""
+
+    def __init__(self, base):
+        self.base = base
+        self.lock = threading.Lock()
+        self.latencies = {'capture': [], 'remove': []}
+        self.errors = Counter()
+        self.created = set()
+        self.duplicates = []
+        self.removed = Counter()
+        self.stored = {}
+        self.job_ids = []
+
+    def post(self, route, path, body, content_type):
+        request = urllib.request.Request(self.base + path, data=body, headers={'Content-Type': content_type})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                reply = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            reply = {'success': False, 'message': f'HTTP {e.code}'}
+        except OSError as e:
+            reply = {'success': False, 'message': type(e).__name__}
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[route].append(elapsed * 1000)
+            if not reply.get('success'):
+                self.errors[f"{route}: {reply.get('message')}"] += 1
+        return reply
+
+    def capture(self, seed, location):
+        reply = self.post('capture', f'/capture?latitude={location[0]}&longitude={location[1]}',
+                          photo_png(seed), 'image/png')
+        if not reply.get('success'):
+            return None
+        with self.lock:
+            self.stored.setdefault((seed, location), set()).add(reply['filename'])
+            if reply['duplicate']:
+                self.duplicates.append(reply['filename'])
+            else:
+                self.created.add(reply['filename'])
+                self.job_ids.extend(reply['jobs'].values())
+        return reply
+
+    def remove(self, filename):
+        reply = self.post('remove', '/remove', json.dumps({'filenames': [filename]}).encode(), 'application/json')
+        with self.lock:
+            self.removed.update(reply.get('removed_files', []))
+
+
+def run(client, executor, captures, remove_share, twin_share, rng, on_half):
+    """Submit every capture; each stored photo may be queued for removal (sometimes twice)"""
+    pending = []
+    pending_lock = threading.Lock()
+    done = Counter()
+
+    def capture_then_maybe_remove(seed, location, remove, twice):
+        reply = client.capture(seed, location)
+        with pending_lock:
+            if reply is not None and remove and not reply['duplicate']:
+                pending.extend(executor.submit(client.remove, reply['filename']) for _ in range(2 if twice else 1))
+            done['captures'] += 1
+            if done['captures'] == captures // 2:
+                on_half()
+
+    futures = []
+    for seed in range(captures):
+        location = (round(19.0 + rng.random() * 0.1, 6), round(72.8 + rng.random() * 0.1, 6))
+        remove = rng.random() < remove_share
+        twice = rng.random() < 0.2
+        # Twins: the same photo sent by two clients at once
+        for _ in range(2 if rng.random() < twin_share else 1):
+            futures.append(executor.submit(capture_then_maybe_remove, seed, location, remove, twice))
+    wait(futures)
+    while True:
+        with pending_lock:
+            batch, pending[:] = list(pending), []
+        if not batch:
+            break
+        wait(batch)
+
+
+def check(folder, client):
+    """Compare the server's tables with the replies; returns a list of problems"""
+    problems = [f'{count} requests failed ({message})' for message, count in client.errors.items()]
+    uploads = os.path.join(folder, 'uploads')
+    store = PhotoMetadataStore(os.path.join(uploads, 'photo_metadata.db'))
+    conn = sqlite3.connect(store.db_path)
+    photos = dict(conn.execute('SELECT filename, digest FROM photos'))
+
+    expected = client.created - set(client.removed)
+    lost = expected - set(photos)
+    extra = set(photos) - expected
+    if lost:
+        problems.append(f'{len(lost)} stored photos are missing, e.g. {sorted(lost)[:3]}')
+    if extra:
+        problems.append(f'{len(extra)} photos are present that were never stored or were removed, e.g. {sorted(extra)[:3]}')
+    twice = [name for name, count in client.removed.items() if count > 1]
+    if twice:
+        problems.append(f'{len(twice)} photos were reported removed by more than one request')
+    unknown = set(client.duplicates) - client.created
+    if unknown:
+        problems.append(f'{len(unknown)} duplicate replies name photos that were never stored')
+
+    stored_twice = [key for key, names in client.stored.items() if len(names - set(client.removed)) > 1]
+    if stored_twice:
+        problems.append(f'{len(stored_twice)} photos with identical bytes and location were stored more than once')
+
+    references = Counter(photos.values())
+    for digest, extension, refcount in conn.execute('SELECT digest, extension, refcount FROM blobs'):
+        if references.pop(digest, 0) != refcount:
+            problems.append(f'Blob {digest[:12]} has refcount {refcount} but is used by a different number of photos')
+        if not os.path.exists(BlobStore(os.path.join(uploads, 'blobs'), store).locate(digest, extension)):
+            problems.append(f'Blob {digest[:12]} is missing its file')
+    if references:
+        problems.append(f'{len(references)} photos reference blobs with no blobs row')
+    orphans = BlobStore(os.path.join(uploads, 'blobs'), store).orphans()
+    if orphans:
+        problems.append(f'{len(orphans)} blob files are not referenced by any row')
+
+    jobs = set(row[0] for row in sqlite3.connect(os.path.join(uploads, 'jobs.db')).execute(
+        "SELECT id FROM jobs WHERE kind != 'transcode'"))
+    if len(client.job_ids) != len(set(client.job_ids)) or set(client.job_ids) != jobs:
+        problems.append(f'{len(client.job_ids)} job ids were handed out but jobs.db has {len(jobs)} jobs')
+    return problems, len(photos)
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return 'no requests'
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+    return f'{len(latencies)} requests, p50 {pick(0.5):.1f} ms, p95 {pick(0.95):.1f} ms, p99 {pick(0.99):.1f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--captures', type=int, default=3000, help='Distinct photos captured')
+    parser.add_argument('--clients', type=int, default=64, help='Concurrent client threads')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Server worker processes')
+    parser.add_argument('--job-workers', type=int, default=0,
+                        help='Job threads per server worker (0 leaves the jobs queued)')
+    parser.add_argument('--remove', type=float, default=0.3, help='Share of photos removed while captures continue')
+    parser.add_argument('--twins', type=float, default=0.1, help='Share of photos captured twice at once')
+    parser.add_argument('--server', choices=['gunicorn', 'werkzeug'], default='gunicorn',
+                        help='gunicorn via `python app.py`, or the Werkzeug server forking per request')
+    parser.add_argument('--no-reload', action='store_true', help='Skip the SIGHUP graceful reload halfway')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as folder:
+        server = Server(folder, args.server, args.workers, args.job_workers)
+        client = Client(server.base)
+        reloads = args.server == 'gunicorn' and not args.no_reload
+        print(f"{args.server} with {args.workers} workers, {args.clients} clients, {args.captures} photos"
+              + (', graceful reload halfway' if reloads else ''))
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=args.clients) as executor:
+                run(client, executor, args.captures, args.remove, args.twins, rng,
+                    server.reload if reloads else lambda: None)
+            elapsed = time.perf_counter() - start
+        finally:
+            server.stop()
+
+        requests = sum(len(values) for values in client.latencies.values())
+        print(f"{requests} requests in {elapsed:.1f}s ({requests / elapsed:.0f} req/s)")
+        for route, latencies in client.latencies.items():
+            print(f"  {route:<8} {summary(latencies)}")
+
+        problems, count = check(folder, client)
+        print(f"Stored {len(client.created)}, duplicates {len(client.duplicates)}, removed {len(client.removed)}, "
+              f"left {count}")
+        for problem in problems:
+            print(f"FAIL: {problem}")
+        if problems:
+            sys.exit(1)
+        print('OK: no records lost or duplicated')
+
+
+if __name__ == '__main__':
+    main()
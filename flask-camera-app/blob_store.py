@@ -0,0 +1,203 @@
+import os
+import uuid
+import hashlib
+from datetime import datetime
+from storage import flat_files, move_to_shard, resolve, shard_path
+
+
+class BlobStore:
+    """Content-addressed photo files under <root>/<ab>/<cd>/<sha256>.<ext>, shared by reference.
+
+    Uploads are hashed while they are streamed to a temporary file, so
+    byte-identical uploads are detected without reading anything twice. Each
+    photo row points at its blob through photos.digest and blobs.refcount
+    counts those rows; the file is deleted when the last reference goes.
+    Blob and row changes run inside the metadata store's write transaction,
+    which also serializes them across threads and worker processes.
+    """
+
+    def __init__(self, root, metadata):
+        self.root = root
+        self.metadata = metadata
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest, extension):
+        """Where a blob is written (sharded by digest prefix)"""
+        return shard_path(self.root, digest, f'{digest}.{extension}')
+
+    def locate(self, digest, extension):
+        """Where a blob is read from: its sharded path, or the flat one until shard() has run"""
+        return resolve(self.root, digest, f'{digest}.{extension}')
+
+    def write_temp(self, stream, chunk_size):
+        """Copy a stream into a temporary file in chunks; returns (temp_path, sha256, size)"""
+        temp_path = os.path.join(self.root, f'{uuid.uuid4().hex}.part')
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return temp_path, digest.hexdigest(), size
+
+    def find_duplicate(self, conn, digest, location, exclude=None):
+        """Return (filename, entry) of the oldest photo with these bytes that a new
+        upload with this location would duplicate, or None"""
+        # source_digest catches re-uploads of bytes that were since transcoded
+        rows = conn.execute(
+            'SELECT filename, location, created_at FROM photos WHERE digest = ? OR source_digest = ? '
+            'ORDER BY created_at, filename', (digest, digest)).fetchall()
+        for filename, stored_location, created_at in rows:
+            entry = self.metadata._row_to_entry(stored_location, created_at)
+            if filename != exclude and (location is None or location == entry['location']):
+                return filename, entry
+        return None
+
+    def add(self, temp_path, digest, size, extension, location=None, created_at=None):
+        """Store a temporary file as a photo; returns (filename, entry, duplicate)
+
+        If the same bytes are already stored under a photo with the same
+        location (or the new upload has none), that photo is returned with
+        duplicate=True and nothing is written. Otherwise a new photo row
+        references the existing blob, or the file becomes a new blob.
+        """
+        with self.metadata.transaction() as conn:
+            existing = self.find_duplicate(conn, digest, location)
+            if existing is not None:
+                os.remove(temp_path)
+                return existing[0], existing[1], True
+
+            self._add_ref(conn, temp_path, digest, extension, size)
+            filename = f'{uuid.uuid4()}.{extension}'
+            created_at = created_at or datetime.now().isoformat()
+            conn.execute(
+                'INSERT INTO photos (filename, location, created_at, digest) VALUES (?, ?, ?, ?)',
+                (filename, self.metadata._encode_location(location), created_at, digest))
+        return filename, {'location': location, 'created_at': created_at}, False
+
+    def _add_ref(self, conn, file_path, digest, extension, size):
+        """Take one reference to a blob, moving file_path in as its file if it is new;
+        returns the bytes added to the store"""
+        blob = conn.execute('SELECT extension FROM blobs WHERE digest = ?', (digest,)).fetchone()
+        if blob is None:
+            path = self.path(digest, extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(file_path, path)
+            conn.execute('INSERT INTO blobs (digest, extension, size, refcount) VALUES (?, ?, ?, 1)',
+                         (digest, extension, size))
+            return size
+        os.remove(file_path)
+        conn.execute('UPDATE blobs SET refcount = refcount + 1 WHERE digest = ?', (digest,))
+        return 0
+
+    def _drop_ref(self, conn, digest):
+        """Drop one reference to a blob, deleting its file at zero; returns the bytes freed"""
+        row = conn.execute('SELECT extension, size, refcount FROM blobs WHERE digest = ?', (digest,)).fetchone()
+        if row is None:
+            return 0
+        extension, size, refcount = row
+        if refcount > 1:
+            conn.execute('UPDATE blobs SET refcount = refcount - 1 WHERE digest = ?', (digest,))
+            return 0
+        conn.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+        path = self.locate(digest, extension)
+        if os.path.exists(path):
+            os.remove(path)
+        return size or 0
+
+    def adopt(self, conn, filename, file_path, digest, extension, size):
+        """Move an existing plain upload into the blob store (within a transaction)"""
+        self._add_ref(conn, file_path, digest, extension, size)
+        conn.execute('UPDATE photos SET digest = ? WHERE filename = ?', (digest, filename))
+
+    def replace(self, filename, old_digest, temp_path, digest, size, extension, keep_source=False):
+        """Point a blob-backed photo at new bytes, such as a transcoded copy of it
+
+        Only done if the photo still points at old_digest; otherwise (or if
+        the photo is gone) the temporary file is removed and False returned.
+        The photo keeps its name, location and created_at. The digest it was
+        uploaded with is recorded as source_digest, so uploading those bytes
+        again is still caught as a duplicate. On the first replace, keep_source
+        keeps that uploaded blob referenced (and on disk); otherwise it is
+        released. A photo replaced again already has its source recorded, so
+        the blob it points at is an earlier copy and is always released.
+
+        Returns the bytes the store shrank by (negative if it grew, as when
+        the source is kept), or None if nothing was replaced.
+        """
+        with self.metadata.transaction() as conn:
+            row = conn.execute('SELECT digest, source_digest, source_kept FROM photos WHERE filename = ?',
+                               (filename,)).fetchone()
+            if row is None or row[0] != old_digest or old_digest == digest:
+                os.remove(temp_path)
+                return None
+            _, source_digest, source_kept = row
+            # On the first replace the photo's reference can pass to the kept source
+            keep = source_digest is None and keep_source
+            if source_digest is None:
+                source_digest, source_kept = old_digest, 1 if keep else 0
+            released = -self._add_ref(conn, temp_path, digest, extension, size)
+            conn.execute('UPDATE photos SET digest = ?, source_digest = ?, source_kept = ? WHERE filename = ?',
+                         (digest, source_digest, source_kept, filename))
+            if not keep:
+                released += self._drop_ref(conn, old_digest)
+        return released
+
+    def release(self, conn, filename):
+        """Drop a photo's references to its blobs, deleting files at zero (within a transaction)"""
+        row = conn.execute('SELECT digest, source_digest, source_kept FROM photos WHERE filename = ?',
+                           (filename,)).fetchone()
+        if row is None or row[0] is None:
+            return False
+        digest, source_digest, source_kept = row
+        conn.execute('DELETE FROM photos WHERE filename = ?', (filename,))
+        self._drop_ref(conn, digest)
+        if source_kept:
+            self._drop_ref(conn, source_digest)
+        return True
+
+    def delete(self, filename):
+        """Delete a blob-backed photo; returns False if it is not one"""
+        with self.metadata.transaction() as conn:
+            return self.release(conn, filename)
+
+    def orphans(self):
+        """Return blob files that no row references (left by a crash mid-write)"""
+        known = set(f'{digest}.{extension}' for digest, extension in
+                    self.metadata._connect().execute('SELECT digest, extension FROM blobs'))
+        return [os.path.join(folder, name) for folder, _, names in os.walk(self.root) for name in names
+                if not name.endswith('.part') and name not in known]
+
+    def shard(self, batch_size=500):
+        """Move blobs still stored flat in the root into their prefix directories; returns the count
+
+        Each batch is moved inside a write transaction, so it cannot race a
+        delete or a new reference to the same blob. Readers use locate(), which
+        finds a blob on either side of the move, so this can run while the app
+        is serving.
+        """
+        names = [name for name in flat_files(self.root) if not name.endswith('.part')]
+        moved = 0
+        for start in range(0, len(names), batch_size):
+            with self.metadata.transaction():
+                for name in names[start:start + batch_size]:
+                    moved += move_to_shard(self.root, name.split('.', 1)[0], name)
+        return moved
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
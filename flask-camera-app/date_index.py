@@ -0,0 +1,343 @@
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+from metrics import stage
+
+# Day-first and slashed sheet dates seen in the field, tried after ISO 8601
+DATE_FORMATS = ('%d-%m-%Y', '%d/%m/%Y', '%Y/%m/%d', '%d.%m.%Y')
+
+# Points without a site name are grouped into grid cells this many degrees wide (about 1 km)
+SITE_CELL_DEGREES = 0.01
+
+# Source names as used by /api/export and /api/dates
+SOURCES = ('photos', 'samples')
+GROUPS = ('day', 'week', 'site')
+
+EPOCH = datetime(1970, 1, 1)
+DAY_MS = 86400000
+
+
+def parse_date(value):
+    """Naive UTC datetime for an ISO 8601 value or one of DATE_FORMATS; None for blanks
+    and anything unparseable. Only the date part of non-ISO values is read."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, date):
+        parsed = datetime(value.year, value.month, value.day)
+    else:
+        text = str(value).strip()
+        try:
+            parsed = datetime.fromisoformat(text)
+        except ValueError:
+            for fmt in DATE_FORMATS:
+                try:
+                    parsed = datetime.strptime(text[:10], fmt)
+                    break
+                except ValueError:
+                    continue
+            else:
+                return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def normalize_date(value):
+    """ISO 8601 form of a date ('2025-09-26', or with the time when it is not midnight), or None"""
+    parsed = parse_date(value)
+    if parsed is None:
+        return None
+    if parsed.time() == datetime.min.time():
+        return parsed.date().isoformat()
+    return parsed.isoformat()
+
+
+def to_ms(value):
+    """Milliseconds since 1970 for a query bound; raises ValueError if it is not a date"""
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(f'Not a date: {value}')
+    return (parsed - EPOCH) // timedelta(milliseconds=1)
+
+
+def to_iso(value):
+    """normalize_date() of a query bound, comparable as text with stored ISO dates; raises
+    ValueError if it is not a date"""
+    normalized = normalize_date(value)
+    if normalized is None:
+        raise ValueError(f'Not a date: {value}')
+    return normalized
+
+
+def _parse_all(values):
+    """ms since 1970 for each value (int64 array) and a mask of the ones that parsed"""
+    import numpy as np
+    try:
+        # ISO strings, as created_at is stored, parse in one vectorized call
+        parsed = np.array([value or 'NaT' for value in values], dtype='datetime64[ms]')
+    except ValueError:
+        parsed = np.array([parse_date(value) or 'NaT' for value in values], dtype='datetime64[ms]')
+    valid = ~np.isnat(parsed)
+    return parsed.astype(np.int64), valid
+
+
+class DateIndex:
+    """Photo and sample timestamps in one sorted array, for range queries and counts.
+
+    Dates are parsed once, when the index is built. A date range maps to a
+    slice found by binary search (numpy.searchsorted), and per-day, per-week
+    and per-site counts are computed with whole-array operations on that
+    slice only. Undated photos and samples are counted but not indexed.
+    """
+
+    def __init__(self, times, sources, sites, site_names, names, latitudes, longitudes, undated, photo_times):
+        self.times = times
+        self.sources = sources
+        self.sites = sites
+        self.site_names = site_names
+        self.names = names
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.undated = undated
+        # filename -> indexed time (ms, or None if undated), to find a photo's entry again
+        self.photo_times = photo_times
+        self.site_codes = {label: code for code, label in enumerate(site_names)}
+
+    @classmethod
+    def build(cls, photos, samples):
+        """photos: (filename, created_at, latitude, longitude) rows; samples: sheet location dicts"""
+        import numpy as np
+        photos = list(photos)
+        names = [row[0] for row in photos]
+        times, valid = _parse_all([row[1] for row in photos])
+        latitudes = np.array([row[2] for row in photos], dtype=float)
+        longitudes = np.array([row[3] for row in photos], dtype=float)
+        site_labels = [None] * len(photos)
+
+        for location in samples:
+            names.append(location.get('image') or f"sample {location['index']}")
+            site = location.get('site')
+            site_labels.append(None if site in (None, 'nan') else site)
+        sample_times, sample_valid = _parse_all([location.get('date_iso') for location in samples])
+        times = np.concatenate([times, sample_times])
+        valid = np.concatenate([valid, sample_valid])
+        latitudes = np.concatenate([latitudes, [location['lat'] for location in samples]])
+        longitudes = np.concatenate([longitudes, [location['lng'] for location in samples]])
+        sources = np.repeat(np.array([0, 1], dtype=np.uint8), [len(photos), len(samples)])
+
+        # Unnamed sites are grid cells, packed into one integer per point so grouping
+        # is a plain integer unique(); labels are formatted once per distinct cell
+        located = ~(np.isnan(latitudes) | np.isnan(longitudes))
+        cells = np.full(len(latitudes), -1, dtype=np.int64)
+        cells[located] = ((np.round(latitudes[located] / SITE_CELL_DEGREES).astype(np.int64) + 100000) * 1000000 +
+                          np.round(longitudes[located] / SITE_CELL_DEGREES).astype(np.int64) + 100000)
+        unique_cells, cell_codes = np.unique(cells, return_inverse=True)
+        cell_labels = ['unlocated' if cell < 0 else
+                       f'{(cell // 1000000 - 100000) * SITE_CELL_DEGREES:.2f},'
+                       f'{(cell % 1000000 - 100000) * SITE_CELL_DEGREES:.2f}' for cell in unique_cells.tolist()]
+        site_names = list(dict.fromkeys(cell_labels + [label for label in site_labels if label]))
+        codes = {label: code for code, label in enumerate(site_names)}
+        cell_to_site = np.array([codes[label] for label in cell_labels], dtype=np.int32)
+        sites = cell_to_site[cell_codes]
+        for position, label in enumerate(site_labels):
+            if label:
+                sites[position] = codes[label]
+
+        undated = {'photos': int((~valid[:len(photos)]).sum()), 'samples': int((~valid[len(photos):]).sum())}
+        photo_times = {name: time if ok else None for name, time, ok in
+                       zip(names[:len(photos)], times[:len(photos)].tolist(), valid[:len(photos)].tolist())}
+        order = valid.nonzero()[0]
+        order = order[np.argsort(times[order], kind='stable')]
+        return cls(times[order], sources[order], sites[order], site_names, [names[i] for i in order.tolist()],
+                   latitudes[order], longitudes[order], undated, photo_times)
+
+    def _site_code(self, lat, lng):
+        """Site code of a photo's grid cell, adding the cell's label if it is new"""
+        if lat is None or lng is None:
+            label = 'unlocated'
+        else:
+            label = (f'{round(lat / SITE_CELL_DEGREES) * SITE_CELL_DEGREES:.2f},'
+                     f'{round(lng / SITE_CELL_DEGREES) * SITE_CELL_DEGREES:.2f}')
+        code = self.site_codes.get(label)
+        if code is None:
+            code = self.site_codes[label] = len(self.site_names)
+            self.site_names.append(label)
+        return code
+
+    def apply(self, changes):
+        """Return the index with photo changes ((filename, op, entry or None) from the
+        store's change feed) applied; this index stays valid for queries already using it
+
+        Each changed photo's old entry is dropped and its current one inserted
+        at its place by binary search: O(n) array copies for the whole batch,
+        with only the changed rows' dates parsed. photo_times and the site
+        labels are shared with the new index and must only be changed under
+        the cache's lock.
+        """
+        import numpy as np
+        drop = []
+        added = []
+        for filename, _, entry in changes:
+            if filename in self.photo_times:
+                time = self.photo_times.pop(filename)
+                if time is None:
+                    self.undated['photos'] -= 1
+                else:
+                    lo = int(self.times.searchsorted(time, 'left'))
+                    hi = int(self.times.searchsorted(time, 'right'))
+                    for position in range(lo, hi):
+                        if self.sources[position] == 0 and self.names[position] == filename:
+                            drop.append(position)
+                            break
+            if entry is None:
+                continue
+            parsed = parse_date(entry['created_at'])
+            if parsed is None:
+                self.photo_times[filename] = None
+                self.undated['photos'] += 1
+                continue
+            time = (parsed - EPOCH) // timedelta(milliseconds=1)
+            self.photo_times[filename] = time
+            location = entry['location'] or {}
+            try:
+                lat, lng = float(location['latitude']), float(location['longitude'])
+            except (TypeError, KeyError, ValueError):
+                lat = lng = None
+            added.append((time, filename, lat, lng, self._site_code(lat, lng)))
+
+        keep = np.ones(len(self.times), dtype=bool)
+        keep[drop] = False
+        names = [name for name, kept in zip(self.names, keep.tolist()) if kept] if drop else self.names
+        times, sources, sites = self.times[keep], self.sources[keep], self.sites[keep]
+        latitudes, longitudes = self.latitudes[keep], self.longitudes[keep]
+        if added:
+            added.sort(key=lambda item: item[0])
+            new_times = np.array([item[0] for item in added], dtype=times.dtype)
+            positions = times.searchsorted(new_times, 'right')
+            times = np.insert(times, positions, new_times)
+            sources = np.insert(sources, positions, 0)
+            sites = np.insert(sites, positions, [item[4] for item in added])
+            latitudes = np.insert(latitudes, positions, [np.nan if item[2] is None else item[2] for item in added])
+            longitudes = np.insert(longitudes, positions, [np.nan if item[3] is None else item[3] for item in added])
+            merged, previous = [], 0
+            for position, item in zip(positions.tolist(), added):
+                merged.extend(names[previous:position])
+                merged.append(item[1])
+                previous = position
+            merged.extend(names[previous:])
+            names = merged
+        index = DateIndex(times, sources, sites, self.site_names, names, latitudes, longitudes,
+                          self.undated, self.photo_times)
+        index.site_codes = self.site_codes
+        return index
+
+    def _slice(self, start=None, end=None):
+        """Positions [lo, hi) of entries with start <= time < end (ms), by binary search"""
+        lo = int(self.times.searchsorted(start, 'left')) if start is not None else 0
+        hi = int(self.times.searchsorted(end, 'left')) if end is not None else len(self.times)
+        return lo, max(lo, hi)
+
+    def _mask(self, lo, hi, sources):
+        import numpy as np
+        wanted = [SOURCES.index(source) for source in sources]
+        return np.isin(self.sources[lo:hi], wanted)
+
+    def select(self, start=None, end=None, sources=SOURCES, offset=0, limit=None):
+        """Return (total, items) for entries in the range, oldest first"""
+        lo, hi = self._slice(start, end)
+        positions = self._mask(lo, hi, sources).nonzero()[0] + lo
+        page = positions[offset:offset + limit if limit is not None else None]
+        items = []
+        for position in page.tolist():
+            lat, lng = float(self.latitudes[position]), float(self.longitudes[position])
+            items.append({
+                'source': SOURCES[self.sources[position]],
+                'name': self.names[position],
+                'date': (EPOCH + timedelta(milliseconds=int(self.times[position]))).isoformat(),
+                'latitude': None if lat != lat else lat,
+                'longitude': None if lng != lng else lng,
+                'site': self.site_names[self.sites[position]],
+            })
+        return len(positions), items
+
+    def aggregate(self, group, start=None, end=None, sources=SOURCES):
+        """Counts per day, ISO week (keyed by its Monday) or site, split by source"""
+        import numpy as np
+        if group not in GROUPS:
+            raise ValueError(f'Unknown group: {group}')
+        lo, hi = self._slice(start, end)
+        mask = self._mask(lo, hi, sources)
+        kinds = self.sources[lo:hi][mask]
+        if group == 'site':
+            keys, inverse = np.unique(self.sites[lo:hi][mask], return_inverse=True)
+            labels = [self.site_names[code] for code in keys.tolist()]
+            # Codes follow the order sites were first seen; list them by name instead
+            by_name = sorted(range(len(labels)), key=labels.__getitem__)
+            rank = np.empty(len(labels), dtype=np.int64)
+            rank[by_name] = np.arange(len(labels))
+            inverse = rank[inverse]
+            labels = [labels[i] for i in by_name]
+        else:
+            days = self.times[lo:hi][mask] // DAY_MS
+            if group == 'week':
+                # 1970-01-01 was a Thursday: step back to each day's Monday
+                days = days - (days + 3) % 7
+            # Times are sorted, so equal keys are adjacent: no sort needed to group them
+            starts = np.ones(len(days), dtype=bool)
+            starts[1:] = days[1:] != days[:-1]
+            inverse = np.cumsum(starts) - 1
+            labels = [(EPOCH + timedelta(days=day)).date().isoformat() for day in days[starts].tolist()]
+        counts = {source: np.bincount(inverse[kinds == SOURCES.index(source)], minlength=len(labels)).tolist()
+                  for source in SOURCES}
+        return [{'key': label, 'photos': photos, 'samples': samples, 'total': photos + samples}
+                for label, photos, samples in zip(labels, counts['photos'], counts['samples'])]
+
+
+class DateIndexCache:
+    """The DateIndex for the current photos and sheet
+
+    Photo writes reach the index through the metadata store's change feed:
+    the next query applies just the changed rows (created_at is stored in
+    ISO form when a photo is written, so each parses directly). The index is
+    rebuilt from every row only when the sheet is reloaded, or when the
+    feed's history no longer reaches back to the index's cursor.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = None
+        self._locations = None
+        self.index = None
+
+    def get(self, store, locations):
+        with self._lock:
+            # A missing or unreadable sheet gives a fresh empty list on every call
+            sheet_changed = locations is not self._locations and bool(locations or self._locations)
+            if self.index is None or sheet_changed:
+                self._build(store, locations)
+            elif store.change_seq() != self._seq:
+                self._follow(store, locations)
+            return self.index
+
+    def _build(self, store, locations):
+        # Read the cursor first: changes racing the build are applied again next time
+        seq = store.change_seq()
+        with stage('dates.build_index'):
+            self.index = DateIndex.build(store.date_rows(), locations)
+        self._seq = seq
+        self._locations = locations
+
+    def _follow(self, store, locations):
+        with stage('dates.apply_changes'):
+            while True:
+                delta = store.changes_since(self._seq)
+                if delta is None:
+                    self._build(store, locations)
+                    return
+                changes, self._seq, more = delta
+                if changes:
+                    self.index = self.index.apply(changes)
+                if not more:
+                    return
@@ -0,0 +1,151 @@
+import json
+import asyncio
+import logging
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# Paths the stream answers on (the second matches the app's API layout behind a proxy)
+STREAM_PATHS = ('/events', '/api/changes/stream')
+
+
+def format_event(delta):
+    """One Server-Sent Events message for a change delta, with its cursor as the event id"""
+    event = 'reset' if delta.get('reset') else 'changes'
+    data = json.dumps(delta, separators=(',', ':'))
+    return f"id: {delta['seq']}\nevent: {event}\ndata: {data}\n\n".encode('utf-8')
+
+
+class ChangeStream:
+    """Server-Sent Events push of the photo change feed to many idle clients.
+
+    Every connection is a coroutine on one asyncio loop, so hundreds of
+    open streams cost a socket and a few KB each rather than a thread. One
+    poller reads the feed's newest sequence number every poll_interval
+    seconds (a single indexed lookup) and, when it moved, builds one delta
+    per distinct client cursor, normally just one, and writes it to every
+    client at that cursor. Reconnecting browsers send Last-Event-ID and
+    resume from it. Clients that stop reading are dropped once
+    max_buffer bytes are queued for them, and a comment line every
+    heartbeat seconds keeps proxies from closing idle streams.
+
+    delta(since) returns the /api/changes body for a cursor and latest()
+    the newest sequence number; both are called on the loop thread.
+    """
+
+    def __init__(self, delta, latest, poll_interval=1.0, heartbeat=15.0, max_clients=1000,
+                 max_buffer=1024 * 1024, allow_origin='*'):
+        self.delta = delta
+        self.latest = latest
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+        self.max_clients = max_clients
+        self.max_buffer = max_buffer
+        self.allow_origin = allow_origin
+        self.clients = {}
+
+    async def _read_request(self, reader):
+        """(path, query, headers) of the HTTP request that opens a stream"""
+        request_line = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if len(request_line) != 3:
+            raise ValueError('Malformed request line')
+        url = urlsplit(request_line[1])
+        return request_line[0], url.path, parse_qs(url.query), headers
+
+    def _reply(self, writer, status, body=b''):
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\n'
+                     f'Access-Control-Allow-Origin: {self.allow_origin}\r\nConnection: close\r\n\r\n'.encode()
+                     + body)
+
+    def _send(self, writer, data):
+        """Queue data for a client; False (and the client closed) if it is not keeping up"""
+        if writer.is_closing() or writer.transport.get_write_buffer_size() > self.max_buffer:
+            self._drop(writer)
+            return False
+        writer.write(data)
+        return True
+
+    def _drop(self, writer):
+        if self.clients.pop(writer, None) is not None:
+            writer.close()
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, query, headers = await asyncio.wait_for(self._read_request(reader), 10)
+        except (asyncio.TimeoutError, ValueError, ConnectionError):
+            writer.close()
+            return
+        if method != 'GET' or path not in STREAM_PATHS:
+            self._reply(writer, '404 Not Found', b'Not found\n')
+            writer.close()
+            return
+        if len(self.clients) >= self.max_clients:
+            self._reply(writer, '503 Service Unavailable', b'Too many open streams\n')
+            writer.close()
+            return
+        try:
+            since = int(headers.get('last-event-id') or query.get('since', [self.latest()])[0])
+        except ValueError:
+            self._reply(writer, '400 Bad Request', b'since must be a change sequence number\n')
+            writer.close()
+            return
+
+        writer.write(
+            b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-store\r\n'
+            b'Connection: keep-alive\r\nX-Accel-Buffering: no\r\n'
+            + f'Access-Control-Allow-Origin: {self.allow_origin}\r\n\r\n'.encode()
+            + b'retry: 3000\n\n')
+        self.clients[writer] = since
+        # Changes the client missed while disconnected go out on the next poll. The
+        # browser never sends anything more, so reading only waits for it to hang up
+        try:
+            await reader.read()
+        except ConnectionError:
+            pass
+        finally:
+            self._drop(writer)
+
+    def broadcast(self):
+        """Send each client the changes after its cursor"""
+        latest = self.latest()
+        cursors = {}
+        for writer, since in self.clients.items():
+            if since != latest:
+                cursors.setdefault(since, []).append(writer)
+        for since, writers in cursors.items():
+            delta = self.delta(since)
+            message = format_event(delta)
+            for writer in writers:
+                if self._send(writer, message):
+                    self.clients[writer] = delta['seq']
+
+    async def _poll(self):
+        idle = 0.0
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            idle += self.poll_interval
+            try:
+                self.broadcast()
+            except Exception:
+                logger.exception('Change stream poll failed')
+            if idle >= self.heartbeat:
+                idle = 0.0
+                for writer in list(self.clients):
+                    self._send(writer, b': ping\n\n')
+
+    async def run(self, host, port, ssl_context=None):
+        server = await asyncio.start_server(self.handle, host, port, ssl=ssl_context, backlog=1024)
+        logger.info('Change stream listening', extra={'host': host, 'port': port})
+        async with server:
+            await asyncio.gather(server.serve_forever(), self._poll())
+
+    def serve(self, host, port, ssl_context=None):
+        """Serve streams until interrupted"""
+        asyncio.run(self.run(host, port, ssl_context))
@@ -0,0 +1,271 @@
+import os
+import json
+import math
+import logging
+import threading
+from xml.etree.ElementTree import ParseError
+from werkzeug.utils import secure_filename
+
+from metrics import stage
+from date_index import normalize_date
+from xlsx_reader import iter_rows
+
+logger = logging.getLogger(__name__)
+
+# Cell text pandas.read_excel reads as NaN (its default na_values)
+PANDAS_NA_STRINGS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+}
+
+
+def resolve_columns(columns):
+    """Pick the latitude, longitude, date and image columns for a sheet.
+
+    Exact column names from update_excel.py win; otherwise fall back to the
+    first column whose name looks right. Returns a dict with None for any
+    column that could not be found.
+    """
+    lat_col = 'latitude' if 'latitude' in columns else None
+    lng_col = 'longitude' if 'longitude' in columns else None
+    if not lat_col or not lng_col:
+        for col in columns:
+            col_lower = str(col).lower()
+            if not lat_col and 'lat' in col_lower:
+                lat_col = col
+            elif not lng_col and ('lng' in col_lower or 'lon' in col_lower):
+                lng_col = col
+
+    def first_matching(exact, keywords):
+        if exact in columns:
+            return exact
+        for col in columns:
+            if any(keyword in str(col).lower() for keyword in keywords):
+                return col
+        return None
+
+    return {
+        'lat': lat_col,
+        'lng': lng_col,
+        'date': first_matching('date_taken', ('date', 'time')),
+        'image': first_matching('image_name', ('image', 'photo', 'file')),
+        'site': first_matching('site', ('site', 'station')),
+    }
+
+
+def dataframe_to_locations(df):
+    """Convert a sheet DataFrame into location dicts using column-wise operations"""
+    import pandas as pd
+    columns = resolve_columns(list(df.columns))
+    if not columns['lat'] or not columns['lng']:
+        return []
+
+    lat = pd.to_numeric(df[columns['lat']], errors='coerce')
+    lng = pd.to_numeric(df[columns['lng']], errors='coerce')
+    valid = (lat.notna() & lng.notna()).to_numpy()
+
+    fields = {
+        'lat': lat.to_numpy()[valid].tolist(),
+        'lng': lng.to_numpy()[valid].tolist(),
+        # 1-based row number in the sheet, matching the old iterrows() output
+        'index': (valid.nonzero()[0] + 1).tolist(),
+    }
+    for key in ('date', 'image', 'site'):
+        if columns[key] is not None:
+            fields[key] = df[columns[key]].astype(str).to_numpy()[valid].tolist()
+    if 'date' in fields:
+        # Sheets mix '2025-09-26' and '26-09-2025'; normalized once here, at load
+        fields['date_iso'] = [normalize_date(value) for value in fields['date']]
+
+    keys = list(fields)
+    return [dict(zip(keys, values)) for values in zip(*fields.values())]
+
+
+def _to_number(value):
+    """pandas.to_numeric(errors='coerce') for one cell: a float, or None if not a number"""
+    if isinstance(value, bool) or value is None or value in PANDAS_NA_STRINGS:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+def _to_text(value):
+    # Matches DataFrame.astype(str), where empty cells are NaN
+    return 'nan' if value is None or value in PANDAS_NA_STRINGS else str(value)
+
+
+def rows_to_locations(rows):
+    """Convert xlsx_reader rows (header first) into the same dicts as dataframe_to_locations"""
+    rows = iter(rows)
+    header = next(rows, [])
+    names = [f'Unnamed: {i}' if value is None else value for i, value in enumerate(header)]
+    columns = resolve_columns(names)
+    if not columns['lat'] or not columns['lng']:
+        return []
+    positions = {key: names.index(name) for key, name in columns.items() if name is not None}
+
+    locations = []
+    for index, row in enumerate(rows, 1):
+        row = row + [None] * (len(names) - len(row))
+        lat = _to_number(row[positions['lat']])
+        lng = _to_number(row[positions['lng']])
+        if lat is None or lng is None:
+            continue
+        location = {'lat': lat, 'lng': lng, 'index': index}
+        for key in ('date', 'image', 'site'):
+            if key in positions:
+                location[key] = _to_text(row[positions[key]])
+        if 'date' in location:
+            location['date_iso'] = normalize_date(location['date'])
+        locations.append(location)
+    return locations
+
+
+def read_locations(path):
+    """Read a sheet's locations with the streaming xlsx reader, so pandas is not imported
+
+    Anything the streaming reader cannot parse (old .xls files, unusual
+    workbooks) is read with pandas instead, which is imported only then.
+    """
+    try:
+        with stage('excel.read_xlsx'):
+            return rows_to_locations(iter_rows(path))
+    except (ValueError, ParseError) as e:
+        logger.info('Streaming xlsx reader failed, using pandas', extra={'path': path, 'error': str(e)})
+    import pandas as pd
+    with stage('excel.read_excel'):
+        df = pd.read_excel(path)
+    with stage('excel.to_locations'):
+        return dataframe_to_locations(df)
+
+
+class ExcelLocationCache:
+    """Parsed sheet locations plus their JSON payload, keyed on the file's mtime and size.
+
+    update_excel.py rewrites the sheet in place, which changes both, so the
+    next request reloads it without any explicit invalidation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    @staticmethod
+    def _file_key(path):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path):
+        """Return (locations, payload_bytes) for the sheet at path"""
+        key = self._file_key(path)
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1], entry[2]
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != key:
+                locations = read_locations(path)
+                with stage('excel.encode'):
+                    payload = json.dumps({
+                        'success': True,
+                        'locations': locations,
+                        'count': len(locations)
+                    }).encode('utf-8')
+                entry = (key, locations, payload)
+                self._entries[path] = entry
+                logger.info('Loaded Excel locations', extra={'path': path, 'locations': len(locations)})
+        return entry[1], entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Sheet cells that mean "no image" once pandas has turned them into strings
+EMPTY_IMAGE_NAMES = {'', 'nan', 'none', 'null'}
+
+
+def normalize_image_name(name):
+    """Return (name key, stem key) used to match sheet image names to stored files
+
+    Directories, surrounding whitespace, case and the characters that
+    secure_filename() strips on upload are ignored. The stem key also drops
+    the extension, so 'Photos\\IMG7.JPEG' in the sheet can still find img7.jpg.
+    """
+    name = secure_filename(str(name).strip().replace('\\', '/').rsplit('/', 1)[-1]).lower()
+    return name, name.rsplit('.', 1)[0]
+
+
+def join_sample_images(locations, files):
+    """Join sheet rows to stored photos by normalized image name.
+
+    files maps every stored filename to whether it has a location of its own.
+    Returns (rows, orphans): each row is the sheet location plus image_status
+    ('found', 'missing' or 'none'), the matched filename and its url and
+    thumbnail_url; orphans are stored photos that no row refers to and that
+    have no location, so they appear nowhere on the map.
+    """
+    by_name, by_stem = {}, {}
+    for filename in sorted(files):
+        name, stem = normalize_image_name(filename)
+        by_name.setdefault(name, filename)
+        by_stem.setdefault(stem, filename)
+
+    rows, referenced = [], set()
+    for location in locations:
+        row = dict(location, image_status='none', filename=None, url=None, thumbnail_url=None)
+        image = location.get('image')
+        if image is not None and str(image).strip().lower() not in EMPTY_IMAGE_NAMES:
+            name, stem = normalize_image_name(image)
+            filename = by_name.get(name) or by_stem.get(stem)
+            if filename is None:
+                row['image_status'] = 'missing'
+            else:
+                referenced.add(filename)
+                row.update(image_status='found', filename=filename, url=f'/uploads/{filename}',
+                           thumbnail_url=f'/uploads/{filename}?size=thumb')
+        rows.append(row)
+
+    orphans = sorted(filename for filename, located in files.items()
+                     if not located and filename not in referenced)
+    return rows, orphans
+
+
+class SampleImageIndex:
+    """Excel sample rows joined to stored photos, with the encoded API payload.
+
+    The join is rebuilt only when the sheet is reloaded or the photo store's
+    file set generation moves (a photo added, removed or (un)located), so
+    ordinary requests neither scan the upload folder nor redo the match.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locations = None
+        self._generation = None
+        self.rows = []
+        self.orphans = []
+        self.payload = None
+
+    def get(self, store, locations):
+        """Return (rows, payload_bytes) for these sheet locations and the store's photos"""
+        generation = store.file_set_generation()
+        with self._lock:
+            if locations is not self._locations or generation != self._generation:
+                with stage('excel.join_images'):
+                    self.rows, self.orphans = join_sample_images(locations, store.file_set())
+                missing = sum(1 for row in self.rows if row['image_status'] == 'missing')
+                self.payload = json.dumps({
+                    'success': True,
+                    'locations': self.rows,
+                    'count': len(self.rows),
+                    'missing_count': missing,
+                    'orphans': self.orphans,
+                }).encode('utf-8')
+                self._locations = locations
+                self._generation = generation
+            return self.rows, self.payload
@@ -0,0 +1,274 @@
+import re
+import zlib
+import struct
+from datetime import datetime
+
+# Largest metadata block we read (EXIF is capped at 64KB in JPEG; XMP packets are small)
+MAX_BLOCK_SIZE = 1024 * 1024
+
+# TIFF field types: (struct code, size in bytes)
+TIFF_TYPES = {
+    1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8),
+    7: ('B', 1), 9: ('i', 4), 10: ('ii', 8),
+}
+
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+TAG_DATETIME = 0x0132
+TAG_DATETIME_ORIGINAL = 0x9003
+GPS_LATITUDE_REF, GPS_LATITUDE, GPS_LONGITUDE_REF, GPS_LONGITUDE = 1, 2, 3, 4
+GPS_ALTITUDE_REF, GPS_ALTITUDE, GPS_H_POSITIONING_ERROR = 5, 6, 31
+
+XMP_NAMESPACE = b'http://ns.adobe.com/xap/1.0/\x00'
+XMP_DATE_FIELDS = ('exif:DateTimeOriginal', 'photoshop:DateCreated', 'xmp:CreateDate')
+
+
+def read_photo_metadata(path):
+    """Return (location, taken_at) from a photo's EXIF or XMP, reading only metadata blocks.
+
+    Walks the container's segment/chunk headers and seeks past image data,
+    so the pixels are never read or decoded. location is a dict with
+    latitude, longitude and, when present, altitude, accuracy and timestamp
+    (or None); taken_at is a naive ISO datetime string (or None).
+    """
+    with open(path, 'rb') as f:
+        head = f.read(12)
+        f.seek(0)
+        if head[:2] == b'\xff\xd8':
+            blocks = _jpeg_blocks(f)
+        elif head[:8] == b'\x89PNG\r\n\x1a\n':
+            blocks = _png_blocks(f)
+        elif head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            blocks = _webp_blocks(f)
+        else:
+            return None, None
+
+        gps, taken_at = {}, None
+        for kind, data in blocks:
+            try:
+                found_gps, found_time = parse_tiff(data) if kind == 'exif' else parse_xmp(data)
+            except (struct.error, ValueError, IndexError, ZeroDivisionError):
+                continue
+            gps = gps or found_gps
+            taken_at = taken_at or found_time
+            if gps and taken_at:
+                break
+
+    if not gps:
+        return None, taken_at
+    location = dict(gps)
+    if taken_at:
+        location['timestamp'] = taken_at
+    return location, taken_at
+
+
+def _read_block(f, length):
+    if length > MAX_BLOCK_SIZE:
+        f.seek(length, 1)
+        return None
+    data = f.read(length)
+    return data if len(data) == length else None
+
+
+def _jpeg_blocks(f):
+    """Yield ('exif' | 'xmp', bytes) from JPEG APP1 segments, stopping at the image data"""
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if byte != b'\xff':
+            return
+        marker = f.read(1)
+        while marker == b'\xff':  # fill bytes
+            marker = f.read(1)
+        if not marker or marker in (b'\xda', b'\xd9'):  # start of scan / end of image
+            return
+        if marker == b'\x01' or b'\xd0' <= marker <= b'\xd7':
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return
+        length = struct.unpack('>H', length_bytes)[0] - 2
+        if marker != b'\xe1':
+            f.seek(length, 1)
+            continue
+        data = _read_block(f, length)
+        if data is None:
+            continue
+        if data.startswith(b'Exif\x00\x00'):
+            yield 'exif', data[6:]
+        elif data.startswith(XMP_NAMESPACE):
+            yield 'xmp', data[len(XMP_NAMESPACE):]
+
+
+def _png_blocks(f):
+    """Yield metadata from PNG eXIf and XMP iTXt chunks, seeking past everything else"""
+    f.seek(8)
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'IEND':
+            return
+        if chunk_type == b'eXIf':
+            data = _read_block(f, length)
+            if data:
+                yield 'exif', data
+        elif chunk_type == b'iTXt':
+            data = _read_block(f, length)
+            if data and data.startswith(b'XML:com.adobe.xmp\x00'):
+                rest = data[len(b'XML:com.adobe.xmp\x00'):]
+                compressed = rest[:1] == b'\x01'
+                # Skip compression method, language tag and translated keyword
+                text = rest[2:].split(b'\x00', 2)[-1]
+                try:
+                    yield 'xmp', zlib.decompress(text) if compressed else text
+                except zlib.error:
+                    pass
+        else:
+            f.seek(length, 1)
+        f.seek(4, 1)  # CRC
+
+
+def _webp_blocks(f):
+    """Yield metadata from WebP EXIF and XMP chunks (they follow the bitstream, which is skipped)"""
+    f.seek(12)
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        chunk_type, length = struct.unpack('<4sI', header)
+        padded = length + (length & 1)
+        if chunk_type in (b'EXIF', b'XMP '):
+            data = _read_block(f, length)
+            if length & 1:
+                f.seek(1, 1)
+            if not data:
+                continue
+            if chunk_type == b'XMP ':
+                yield 'xmp', data
+            else:
+                yield 'exif', data[6:] if data.startswith(b'Exif\x00\x00') else data
+        else:
+            f.seek(padded, 1)
+
+
+def _read_ifd(data, offset, endian):
+    """Return {tag: value} for one TIFF IFD; values are tuples, or str for ASCII"""
+    count = struct.unpack_from(endian + 'H', data, offset)[0]
+    entries = {}
+    for i in range(count):
+        tag, field_type, n, value = struct.unpack_from(endian + 'HHI4s', data, offset + 2 + i * 12)
+        if field_type not in TIFF_TYPES:
+            continue
+        code, size = TIFF_TYPES[field_type]
+        total = size * n
+        if total <= 4:
+            raw = value[:total]
+        else:
+            start = struct.unpack(endian + 'I', value)[0]
+            raw = data[start:start + total]
+            if len(raw) < total:
+                continue
+        if field_type == 2:
+            entries[tag] = raw.split(b'\x00', 1)[0].decode('ascii', 'replace').strip()
+        else:
+            entries[tag] = struct.unpack(endian + code * n, raw)
+    return entries
+
+
+def _rationals(values):
+    return [values[i] / values[i + 1] for i in range(0, len(values), 2) if values[i + 1]]
+
+
+def _dms(values):
+    parts = _rationals(values)
+    if len(parts) != 3:
+        raise ValueError('GPS coordinate needs degrees, minutes and seconds')
+    return parts[0] + parts[1] / 60 + parts[2] / 3600
+
+
+def _exif_datetime(value):
+    """'YYYY:MM:DD HH:MM:SS' -> ISO string, or None"""
+    try:
+        return datetime.strptime(value[:19], '%Y:%m:%d %H:%M:%S').isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+def _valid_coordinates(lat, lng):
+    # (0, 0) is what some phones write when they had no fix
+    return -90 <= lat <= 90 and -180 <= lng <= 180 and (lat, lng) != (0, 0)
+
+
+def parse_tiff(data):
+    """Return (gps dict or {}, taken_at or None) from a TIFF/EXIF block"""
+    endian = {b'II': '<', b'MM': '>'}.get(data[:2])
+    if endian is None or struct.unpack_from(endian + 'H', data, 2)[0] != 42:
+        return {}, None
+    ifd0 = _read_ifd(data, struct.unpack_from(endian + 'I', data, 4)[0], endian)
+
+    taken_at = None
+    if EXIF_IFD_POINTER in ifd0:
+        exif = _read_ifd(data, ifd0[EXIF_IFD_POINTER][0], endian)
+        taken_at = _exif_datetime(exif.get(TAG_DATETIME_ORIGINAL))
+    taken_at = taken_at or _exif_datetime(ifd0.get(TAG_DATETIME))
+
+    gps = {}
+    if GPS_IFD_POINTER in ifd0:
+        tags = _read_ifd(data, ifd0[GPS_IFD_POINTER][0], endian)
+        if GPS_LATITUDE in tags and GPS_LONGITUDE in tags:
+            lat = _dms(tags[GPS_LATITUDE])
+            lng = _dms(tags[GPS_LONGITUDE])
+            if tags.get(GPS_LATITUDE_REF, 'N').upper().startswith('S'):
+                lat = -lat
+            if tags.get(GPS_LONGITUDE_REF, 'E').upper().startswith('W'):
+                lng = -lng
+            if _valid_coordinates(lat, lng):
+                gps = {'latitude': round(lat, 7), 'longitude': round(lng, 7), 'source': 'exif'}
+                altitude = _rationals(tags.get(GPS_ALTITUDE, ()))
+                if altitude:
+                    below_sea_level = tags.get(GPS_ALTITUDE_REF, (0,))[0] == 1
+                    gps['altitude'] = round(-altitude[0] if below_sea_level else altitude[0], 2)
+                accuracy = _rationals(tags.get(GPS_H_POSITIONING_ERROR, ()))
+                if accuracy:
+                    gps['accuracy'] = round(accuracy[0], 2)
+    return gps, taken_at
+
+
+def _xmp_value(text, name):
+    match = re.search(rf'{name}\s*=\s*"([^"]*)"', text) or \
+        re.search(rf'<{name}>\s*([^<]*?)\s*</{name}>', text)
+    return match.group(1) if match else None
+
+
+def _xmp_coordinate(value):
+    """XMP GPS coordinates look like '19,6.7438N' or '19,6,44.6N'"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?),(\d+(?:\.\d+)?)(?:,(\d+(?:\.\d+)?))?\s*([NSEW])\s*', value or '')
+    if not match:
+        return None
+    degrees, minutes, seconds, ref = match.groups()
+    result = float(degrees) + float(minutes) / 60 + float(seconds or 0) / 3600
+    return -result if ref in 'SW' else result
+
+
+def parse_xmp(data):
+    """Return (gps dict or {}, taken_at or None) from an XMP packet"""
+    text = data.decode('utf-8', 'replace')
+    gps = {}
+    lat = _xmp_coordinate(_xmp_value(text, 'exif:GPSLatitude'))
+    lng = _xmp_coordinate(_xmp_value(text, 'exif:GPSLongitude'))
+    if lat is not None and lng is not None and _valid_coordinates(lat, lng):
+        gps = {'latitude': round(lat, 7), 'longitude': round(lng, 7), 'source': 'xmp'}
+
+    taken_at = None
+    for field in XMP_DATE_FIELDS:
+        value = _xmp_value(text, field)
+        if value:
+            try:
+                # Drop any UTC offset: created_at values elsewhere are naive local times
+                taken_at = datetime.fromisoformat(value[:19]).isoformat()
+                break
+            except ValueError:
+                continue
+    return gps, taken_at
@@ -0,0 +1,161 @@
+import io
+import csv
+import json
+import tempfile
+
+EXPORT_COLUMNS = ['source', 'name', 'latitude', 'longitude', 'accuracy', 'date', 'url',
+                  'd10_mm', 'd50_mm', 'd90_mm', 'sorting', 'class']
+
+# Output formats: (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'geojson': ('application/geo+json', 'geojson'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+# Text formats are yielded in pieces of roughly this many characters
+CHUNK_SIZE = 64 * 1024
+
+def _in_bbox(lat, lng, bbox):
+    south, west, north, east = bbox
+    return south <= lat <= north and west <= lng <= east
+
+
+def photo_rows(store, cache, mm_per_pixel, start=None, end=None, bbox=None, batch_size=500):
+    """Yield export rows (lists in EXPORT_COLUMNS order) for photos, oldest first
+
+    Rows come from the store in batches; cached analysis results for each
+    batch are fetched with one query, so memory stays flat.
+    """
+    batch = []
+    for item in store.iter_photos(start=start, end=end, bbox=bbox, batch_size=batch_size):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield from _photo_batch(batch, cache, mm_per_pixel)
+            batch = []
+    yield from _photo_batch(batch, cache, mm_per_pixel)
+
+
+def _photo_batch(batch, cache, mm_per_pixel):
+    from analysis import summarize
+    digests = set(digest for _, _, digest in batch if digest)
+    spectra = cache.get_many(digests) if digests and cache is not None else {}
+    for filename, entry, digest in batch:
+        location = entry['location'] or {}
+        row = ['photo', filename, location.get('latitude'), location.get('longitude'),
+               location.get('accuracy'), entry['created_at'], f'/uploads/{filename}']
+        spectrum = spectra.get(digest)
+        if spectrum:
+            result = summarize(spectrum, mm_per_pixel)
+            row += [result['d10_mm'], result['d50_mm'], result['d90_mm'], result['sorting'], result['class']]
+        else:
+            row += [None] * 5
+        yield row
+
+
+def sample_rows(locations, start=None, end=None, bbox=None):
+    """Yield export rows for the joined Excel sample points, with the same filters as photos"""
+    for location in locations:
+        # Normalized to ISO when the sheet was loaded
+        date = location.get('date_iso')
+        if start is not None and (date is None or date < start):
+            continue
+        if end is not None and (date is None or date >= end):
+            continue
+        if bbox is not None and not _in_bbox(location['lat'], location['lng'], bbox):
+            continue
+        name = location.get('filename') or location.get('image') or f"sample {location['index']}"
+        yield ['sample', name, location['lat'], location['lng'],
+               None, date, location.get('url')] + [None] * 5
+
+
+def _buffered(pieces):
+    """Join small strings into CHUNK_SIZE pieces so the response is not one write per row"""
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def csv_chunks(rows):
+    def lines():
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            if out.tell() >= CHUNK_SIZE:
+                yield out.getvalue()
+                out.seek(0)
+                out.truncate()
+        yield out.getvalue()
+    return (chunk for chunk in lines() if chunk)
+
+
+def ndjson_chunks(rows):
+    return _buffered(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n' for row in rows)
+
+
+def geojson_chunks(rows):
+    """FeatureCollection written incrementally; rows without coordinates are left out"""
+    def pieces():
+        yield '{"type": "FeatureCollection", "features": ['
+        separator = ''
+        for row in rows:
+            lat, lng = row[2], row[3]
+            if lat is None or lng is None:
+                continue
+            try:
+                coordinates = [float(lng), float(lat)]
+            except (TypeError, ValueError):
+                continue
+            properties = {key: value for key, value in zip(EXPORT_COLUMNS, row)
+                          if key not in ('latitude', 'longitude')}
+            yield separator + json.dumps({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': coordinates},
+                'properties': properties,
+            })
+            separator = ','
+        yield ']}\n'
+    return _buffered(pieces())
+
+
+def write_xlsx(rows, target):
+    """Write rows to an .xlsx path or binary file with openpyxl's write-only (streaming) mode"""
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('export')
+    sheet.append(EXPORT_COLUMNS)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(target)
+
+
+def xlsx_chunks(rows):
+    """Build the workbook in an anonymous temporary file, then yield its bytes
+
+    The zip container can only be finished once all rows are written, so it
+    is spooled to disk rather than held in memory.
+    """
+    with tempfile.TemporaryFile() as f:
+        write_xlsx(rows, f)
+        f.seek(0)
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+TEXT_WRITERS = {
+    'csv': csv_chunks,
+    'ndjson': ndjson_chunks,
+    'geojson': geojson_chunks,
+}
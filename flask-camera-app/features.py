@@ -0,0 +1,426 @@
+import os
+import math
+import sqlite3
+import threading
+from contextlib import contextmanager
+import numpy as np
+from PIL import Image, ImageOps
+
+# Bump when the descriptor changes; an index built by another version is emptied
+FEATURE_VERSION = 1
+
+# Photos are described at most this many pixels along the longest edge
+FEATURE_EDGE = 256
+
+HUE_BINS = 12
+SATURATION_BINS = 4
+VALUE_BINS = 8
+# Gradient magnitudes are binned on a log scale between these (gray levels 0-1 per pixel)
+GRADIENT_BINS = 8
+GRADIENT_RANGE = (1e-3, 1.0)
+# Block sizes (pixels) of the multi-scale local contrast
+CONTRAST_SCALES = (2, 4, 8)
+
+# Relative weight of each descriptor block in the distance
+BLOCK_WEIGHTS = {'colour': 1.0, 'moments': 0.75, 'texture': 1.0, 'grain': 0.75}
+
+DIM = HUE_BINS + SATURATION_BINS + VALUE_BINS + 6 + GRADIENT_BINS + 1 + len(CONTRAST_SCALES) + 4
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Rows scored per matrix product, so a query over a large index never holds it all in memory
+SEARCH_BLOCK_ROWS = 65536
+
+
+def _histogram(values, bins, value_range, weights=None):
+    """Hellinger embedding (square root) of a normalized histogram; all zeros if empty"""
+    counts, _ = np.histogram(values, bins=bins, range=value_range, weights=weights)
+    total = counts.sum()
+    return np.sqrt(counts / total) if total > 0 else np.zeros(bins)
+
+
+def _block_mean(pixels, size):
+    """Mean of each size x size block (the image cropped to whole blocks)"""
+    h, w = (pixels.shape[0] // size) * size, (pixels.shape[1] // size) * size
+    return pixels[:h, :w].reshape(h // size, size, w // size, size).mean(axis=(1, 3))
+
+
+def describe(rgb, spectrum=None):
+    """Descriptor of an RGB uint8 array: colour, colour moments, texture and grain-size blocks
+
+    Histograms are Hellinger-embedded, so Euclidean distance between them
+    is a proper histogram distance; scalar statistics are scaled to about
+    unit range. Each block is scaled by the square root of its weight, and
+    photos are compared by Euclidean distance of the whole vector.
+    """
+    pixels = rgb.astype(np.float32) / 255.0
+    hsv = np.asarray(Image.fromarray(rgb).convert('HSV'), dtype=np.float32) / 255.0
+    hue, saturation, value = hsv[..., 0].ravel(), hsv[..., 1].ravel(), hsv[..., 2].ravel()
+    # Grey pixels have no meaningful hue, so each pixel votes with its saturation
+    colour = np.concatenate([
+        _histogram(hue, HUE_BINS, (0, 1), weights=saturation),
+        _histogram(saturation, SATURATION_BINS, (0, 1)),
+        _histogram(value, VALUE_BINS, (0, 1)),
+    ]) / math.sqrt(3)
+
+    ycbcr = np.asarray(Image.fromarray(rgb).convert('YCbCr'), dtype=np.float32).reshape(-1, 3) / 255.0
+    moments = np.concatenate([ycbcr.mean(axis=0), ycbcr.std(axis=0) * 2])
+
+    gray = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    gy, gx = np.gradient(gray)
+    magnitude = np.hypot(gx, gy)
+    low, high = GRADIENT_RANGE
+    gradients = _histogram(np.log(np.clip(magnitude, low, high)).ravel(), GRADIENT_BINS,
+                           (math.log(low), math.log(high)))
+    # Structure-tensor coherence: 0 for isotropic grain, 1 for ripples or streaks in one direction
+    jxx, jyy, jxy = (gx * gx).mean(), (gy * gy).mean(), (gx * gy).mean()
+    trace = jxx + jyy
+    coherence = math.sqrt((jxx - jyy) ** 2 + 4 * jxy ** 2) / trace if trace > 0 else 0.0
+    # Mean absolute deviation from the local mean at several block sizes
+    contrast = []
+    for size in CONTRAST_SCALES:
+        means = _block_mean(gray, size)
+        rows, cols = means.shape
+        blocks = gray[:rows * size, :cols * size].reshape(rows, size, cols, size)
+        contrast.append(float(np.abs(blocks - means[:, None, :, None]).mean()) * 4)
+    texture = np.concatenate([gradients, [coherence], contrast])
+
+    grain = np.zeros(4)
+    if spectrum:
+        # D10, D50, D90 (log2 of original pixels) and their spread, as in summarize()
+        sizes, finer = np.log2(spectrum['sizes_px']), np.asarray(spectrum['finer'])
+        d10, d50, d90 = (np.interp(p, finer, sizes) for p in (0.1, 0.5, 0.9))
+        grain = np.array([d10, d50, d90, d90 - d10]) / 8
+
+    return np.concatenate([
+        colour * math.sqrt(BLOCK_WEIGHTS['colour']),
+        moments * math.sqrt(BLOCK_WEIGHTS['moments']),
+        texture * math.sqrt(BLOCK_WEIGHTS['texture']),
+        grain * math.sqrt(BLOCK_WEIGHTS['grain']),
+    ]).astype(np.float32)
+
+
+def extract_features(path, spectrum=None):
+    """Descriptor of one photo file (see describe); spectrum is its cached grain-size spectrum"""
+    with Image.open(path) as image:
+        image.draft('RGB', (FEATURE_EDGE, FEATURE_EDGE))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image.thumbnail((FEATURE_EDGE, FEATURE_EDGE), Image.BILINEAR)
+        rgb = np.asarray(image)
+    return describe(rgb, spectrum)
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """Great-circle distance in km from one point to arrays of points"""
+    lat, lng, lats, lngs = map(np.radians, (lat, lng, lats, lngs))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class FeatureIndex:
+    """Photo descriptors in one contiguous float32 matrix file, memory-mapped for search.
+
+    Row i of vectors.f32 holds one photo's descriptor; which photo (and its
+    location) is recorded in a small SQLite table beside it. Rows freed by
+    deleted photos are reused, and the file grows by doubling. Writers (the
+    analysis job, in any process) take the table's write lock, write the
+    vector with pwrite, then commit its row with a new stamp. Readers map
+    the file read-only and load only rows stamped since their last look,
+    so an update costs one row, not a rebuild. Top-k queries score the
+    matrix in blocks with one matrix product per block.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS vectors (
+            row INTEGER PRIMARY KEY,
+            filename TEXT UNIQUE,
+            digest TEXT,
+            latitude REAL,
+            longitude REAL,
+            stamp INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_vectors_stamp ON vectors (stamp);
+        CREATE INDEX IF NOT EXISTS idx_vectors_digest ON vectors (digest);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('stamp', 0);
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('feed_seq', 0);
+    """
+
+    def __init__(self, root, dim=DIM):
+        self.root = root
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.db_path = os.path.join(root, 'index.db')
+        self.matrix_path = os.path.join(root, 'vectors.f32')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        with self._transaction() as conn:
+            conn.execute('INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)', ('version', FEATURE_VERSION))
+            version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            if version != FEATURE_VERSION or not os.path.exists(self.matrix_path):
+                conn.execute('DELETE FROM vectors')
+                conn.execute("UPDATE meta SET value = ? WHERE key = 'version'", (FEATURE_VERSION,))
+                conn.execute("UPDATE meta SET value = 0 WHERE key = 'feed_seq'")
+                self._next_stamp(conn)
+                open(self.matrix_path, 'wb').close()
+        self._reset_view()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE: also serializes writes to the matrix file across processes"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _next_stamp(conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'stamp'")
+        return conn.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()[0]
+
+    def stamp(self):
+        """Counter that moves with every change to the index"""
+        return self._connect().execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()[0]
+
+    # Writing
+
+    def _write_vectors(self, rows_and_vectors):
+        """pwrite vectors into their rows, growing the file (doubling) when a row is past its end"""
+        fd = os.open(self.matrix_path, os.O_RDWR)
+        try:
+            needed = (max(row for row, _ in rows_and_vectors) + 1) * self.row_bytes
+            size = os.fstat(fd).st_size
+            if needed > size:
+                os.ftruncate(fd, max(needed, size * 2, 1024 * self.row_bytes))
+            for row, vector in rows_and_vectors:
+                os.pwrite(fd, np.ascontiguousarray(vector, dtype=np.float32).tobytes(), row * self.row_bytes)
+        finally:
+            os.close(fd)
+
+    def put_many(self, items):
+        """Store (filename, digest, vector, location or None) items, replacing earlier vectors"""
+        items = list(items)
+        if not items:
+            return
+        with self._transaction() as conn:
+            stamp = self._next_stamp(conn)
+            free = [row for row, in conn.execute('SELECT row FROM vectors WHERE filename IS NULL ORDER BY row')]
+            next_row = conn.execute('SELECT COALESCE(MAX(row) + 1, 0) FROM vectors').fetchone()[0]
+            writes = []
+            for filename, digest, vector, location in items:
+                if len(vector) != self.dim:
+                    raise ValueError(f'Expected a {self.dim}-dimensional vector, got {len(vector)}')
+                existing = conn.execute('SELECT row FROM vectors WHERE filename = ?', (filename,)).fetchone()
+                if existing:
+                    row = existing[0]
+                elif free:
+                    row = free.pop(0)
+                else:
+                    row, next_row = next_row, next_row + 1
+                latitude = location.get('latitude') if location else None
+                longitude = location.get('longitude') if location else None
+                conn.execute('INSERT OR REPLACE INTO vectors (row, filename, digest, latitude, longitude, stamp) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', (row, filename, digest, latitude, longitude, stamp))
+                writes.append((row, vector))
+            # The vectors are in the file before the rows naming them commit
+            self._write_vectors(writes)
+
+    def put(self, filename, digest, vector, location=None):
+        self.put_many([(filename, digest, vector, location)])
+
+    def remove_many(self, filenames):
+        """Free the rows of deleted photos"""
+        with self._transaction() as conn:
+            stamp = self._next_stamp(conn)
+            conn.executemany('UPDATE vectors SET filename = NULL, digest = NULL, latitude = NULL, longitude = NULL, '
+                             'stamp = ? WHERE filename = ?', [(stamp, filename) for filename in filenames])
+
+    def vector_of_digest(self, digest):
+        """A stored vector for these image bytes (another photo of the same blob), or None"""
+        row = self._connect().execute('SELECT row FROM vectors WHERE digest = ? LIMIT 1', (digest,)).fetchone()
+        if row is None:
+            return None
+        with open(self.matrix_path, 'rb') as f:
+            f.seek(row[0] * self.row_bytes)
+            return np.frombuffer(f.read(self.row_bytes), dtype=np.float32).copy()
+
+    def indexed(self):
+        """Names of the photos that have a vector"""
+        return set(filename for filename, in self._connect().execute(
+            'SELECT filename FROM vectors WHERE filename IS NOT NULL'))
+
+    def sync(self, store):
+        """Follow the photo store's change feed: free rows of deleted photos, refresh moved ones
+
+        If the feed no longer reaches back to the last position seen, the
+        whole table is reconciled against the store instead.
+        """
+        latest = store.change_seq()
+        if self._connect().execute("SELECT value FROM meta WHERE key = 'feed_seq'").fetchone()[0] == latest:
+            return
+        with self._transaction() as conn:
+            since = conn.execute("SELECT value FROM meta WHERE key = 'feed_seq'").fetchone()[0]
+            stamp = self._next_stamp(conn)
+            while True:
+                delta = store.changes_since(since, 1000)
+                if delta is None:
+                    self._reconcile(conn, store, stamp)
+                    since = latest
+                    break
+                changes, since, more = delta
+                for filename, op, entry in changes:
+                    if entry is None:
+                        conn.execute('UPDATE vectors SET filename = NULL, digest = NULL, latitude = NULL, '
+                                     'longitude = NULL, stamp = ? WHERE filename = ?', (stamp, filename))
+                    else:
+                        location = entry['location'] or {}
+                        conn.execute('UPDATE vectors SET latitude = ?, longitude = ?, stamp = ? WHERE filename = ?',
+                                     (location.get('latitude'), location.get('longitude'), stamp, filename))
+                if not more:
+                    break
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'feed_seq'", (since,))
+
+    def _reconcile(self, conn, store, stamp):
+        located = {filename: (lat, lng) for filename, _, lat, lng in store.date_rows()}
+        for row, filename in conn.execute('SELECT row, filename FROM vectors WHERE filename IS NOT NULL').fetchall():
+            if filename in located:
+                conn.execute('UPDATE vectors SET latitude = ?, longitude = ?, stamp = ? WHERE row = ?',
+                             located[filename] + (stamp, row))
+            else:
+                conn.execute('UPDATE vectors SET filename = NULL, digest = NULL, latitude = NULL, '
+                             'longitude = NULL, stamp = ? WHERE row = ?', (stamp, row))
+
+    # Searching
+
+    def _reset_view(self):
+        self._seen_stamp = -1
+        self._names = []
+        self._rows = {}
+        self._valid = np.zeros(0, dtype=bool)
+        self._lat = np.zeros(0)
+        self._lng = np.zeros(0)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._matrix = None
+        self._mapped_size = 0
+
+    def _refresh(self):
+        """Bring the in-memory view up to date with rows stamped since the last call"""
+        rows = self._connect().execute(
+            'SELECT row, filename, latitude, longitude, stamp FROM vectors WHERE stamp > ? ORDER BY row',
+            (self._seen_stamp,)).fetchall()
+        # Checked after reading the rows: a row commits only once the file has grown to hold it
+        size = os.path.getsize(self.matrix_path)
+        if size != self._mapped_size:
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode='r',
+                                     shape=(size // self.row_bytes, self.dim)) if size else None
+            self._mapped_size = size
+        if not rows:
+            return
+        count = max(rows[-1][0] + 1, len(self._names))
+        if count > len(self._names):
+            grow = count - len(self._names)
+            self._names.extend([None] * grow)
+            self._valid = np.concatenate([self._valid, np.zeros(grow, dtype=bool)])
+            self._lat = np.concatenate([self._lat, np.full(grow, np.nan)])
+            self._lng = np.concatenate([self._lng, np.full(grow, np.nan)])
+            self._norms = np.concatenate([self._norms, np.zeros(grow, dtype=np.float32)])
+        changed = np.array([row for row, *_ in rows])
+        for row, filename, latitude, longitude, stamp in rows:
+            old = self._names[row]
+            if old is not None and self._rows.get(old) == row:
+                del self._rows[old]
+            self._names[row] = filename
+            if filename is not None:
+                self._rows[filename] = row
+            self._lat[row] = np.nan if latitude is None else latitude
+            self._lng[row] = np.nan if longitude is None else longitude
+            self._seen_stamp = max(self._seen_stamp, stamp)
+        self._valid[changed] = [self._names[row] is not None for row in changed.tolist()]
+        vectors = np.asarray(self._matrix[changed], dtype=np.float32)
+        self._norms[changed] = np.einsum('ij,ij->i', vectors, vectors)
+
+    def nearest(self, queries, k, mask):
+        """Rows and Euclidean distances of the k nearest allowed rows for each query vector
+
+        queries is (q, dim); mask marks the rows that may be returned.
+        Returns (rows, distances), both (q, k'), with k' <= k, nearest first.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        query_norms = np.einsum('ij,ij->i', queries, queries)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(mask), SEARCH_BLOCK_ROWS):
+            stop = min(start + SEARCH_BLOCK_ROWS, len(mask))
+            allowed = mask[start:stop].nonzero()[0]
+            if not len(allowed):
+                continue
+            block = self._matrix[start:stop]
+            # |x - q|^2 = |x|^2 - 2 x.q + |q|^2 for the whole block in one product
+            scores = self._norms[start:stop][allowed, None] - 2 * (block[allowed] @ queries.T) + query_norms
+            candidates = np.concatenate([best, scores.T], axis=1)
+            candidate_rows = np.concatenate([best_rows, np.broadcast_to(allowed + start, scores.T.shape)], axis=1)
+            keep = min(k, candidates.shape[1])
+            top = np.argpartition(candidates, keep - 1, axis=1)[:, :keep]
+            best = np.take_along_axis(candidates, top, axis=1)
+            best_rows = np.take_along_axis(candidate_rows, top, axis=1)
+        order = np.argsort(best, axis=1)
+        distances = np.sqrt(np.maximum(np.take_along_axis(best, order, axis=1), 0))
+        return np.take_along_axis(best_rows, order, axis=1), distances
+
+    def similar(self, filename, k=10, within_km=None):
+        """Photos that look most like filename: [(filename, distance, km from it or None)]
+
+        Raises KeyError if the photo has no vector yet, and ValueError if
+        within_km is given for a photo without a location.
+        """
+        with self._lock:
+            self._refresh()
+            row = self._rows.get(filename)
+            if row is None:
+                raise KeyError(filename)
+            count = len(self._names)
+            mask = self._valid[:count].copy()
+            mask[row] = False
+            lat, lng = self._lat[row], self._lng[row]
+            located = not (np.isnan(lat) or np.isnan(lng))
+            km = haversine_km(lat, lng, self._lat[:count], self._lng[:count]) if located else None
+            if within_km is not None:
+                if not located:
+                    raise ValueError(f'{filename} has no location')
+                mask &= km <= within_km
+            query = np.asarray(self._matrix[row], dtype=np.float32)[None]
+            rows, distances = self.nearest(query, k, mask)
+            return [(self._names[r], float(d), float(km[r]) if km is not None and not np.isnan(km[r]) else None)
+                    for r, d in zip(rows[0].tolist(), distances[0].tolist())]
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return int(self._valid.sum())
+
+
+def features_for_path(path, spectrum):
+    """extract_features for a pool worker: (vector, error)"""
+    try:
+        return extract_features(path, spectrum), None
+    except Exception as e:
+        return None, str(e)
@@ -0,0 +1,44 @@
+"""Gunicorn settings for the production server
+
+    python app.py                              # launches gunicorn with this file
+    gunicorn -c gunicorn.conf.py app:app       # the same, e.g. as a platform start command
+    kill -HUP $(cat $GUNICORN_PIDFILE)         # graceful reload onto new code
+
+Workers are forked from a master that never imports the app (no preload):
+each worker opens its own SQLite connections, job threads and memory maps,
+and a HUP starts fresh workers on the current code before the old ones
+finish their requests and exit. Workers share nothing in memory. Photos,
+metadata, jobs, upload sessions and the feature index live in SQLite (WAL)
+databases and in files written under a temporary name and renamed into
+place, so concurrent requests in different workers stay consistent.
+"""
+import os
+import sys
+
+bind = os.environ.get('BIND') or f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+# One process per core; each has a few threads so slow uploads and downloads
+# do not hold a whole worker
+workers = int(os.environ.get('WEB_CONCURRENCY', 0)) or os.cpu_count()
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+preload_app = False
+pidfile = os.environ.get('GUNICORN_PIDFILE') or None
+# Request logs come from the app's own JSON logging and metrics
+accesslog = None
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+
+
+def post_worker_init(worker):
+    """Start the worker's job threads now, so jobs queued before a restart or reload resume"""
+    sys.modules['app'].start_job_queue()
+
+
+def worker_exit(server, worker):
+    """Let the worker's job threads finish the jobs they are running"""
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.stop_job_queue()
@@ -0,0 +1,98 @@
+import gzip
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+from flask import request, make_response
+
+try:
+    import brotli
+except ImportError:  # optional: gzip is always available
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+
+# Compressed bodies kept per (etag, encoding), so repeat unconditional polls skip recompression
+COMPRESSED_CACHE_SIZE = 64
+
+_compressed_cache = OrderedDict()
+_compressed_cache_lock = threading.Lock()
+
+
+def choose_encoding(accept_encodings):
+    if brotli is not None and 'br' in accept_encodings:
+        return 'br'
+    if 'gzip' in accept_encodings:
+        return 'gzip'
+    return None
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def compress_response(response, cache_key=None):
+    """Compress a 200 response body with brotli or gzip if the client accepts it"""
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or response.direct_passthrough or \
+            'Content-Encoding' in response.headers:
+        return response
+    data = response.get_data()
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None or len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    key = (cache_key, encoding) if cache_key else None
+    with _compressed_cache_lock:
+        body = _compressed_cache.get(key) if key else None
+        if body is not None:
+            _compressed_cache.move_to_end(key)
+    if body is None:
+        body = _compress(data, encoding)
+        if key:
+            with _compressed_cache_lock:
+                _compressed_cache[key] = body
+                while len(_compressed_cache) > COMPRESSED_CACHE_SIZE:
+                    _compressed_cache.popitem(last=False)
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def conditional(validator):
+    """Decorate a view with ETag/Last-Modified validators and response compression.
+
+    validator() returns (version, last_modified): version is anything whose
+    repr changes whenever the view's output could change (a store generation
+    counter, a file's mtime and size), last_modified a datetime or None.
+    Combined with the full request path it yields the ETag, so a matching
+    If-None-Match is answered with 304 before the view runs at all.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            version, last_modified = validator()
+            etag = hashlib.sha1(f'{version!r}|{request.full_path}'.encode('utf-8')).hexdigest()
+
+            if request.if_none_match.contains(etag) or (
+                    not request.if_none_match and last_modified is not None and
+                    request.if_modified_since is not None and
+                    last_modified.replace(microsecond=0) <= request.if_modified_since):
+                response = make_response('', 304)
+            else:
+                response = compress_response(make_response(view(*args, **kwargs)), cache_key=etag)
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # Cacheable, but must be revalidated with the ETag on every use
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
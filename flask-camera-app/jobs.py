@@ -0,0 +1,301 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when a submission would take the queue past its maximum depth"""
+
+
+class JobQueue:
+    """Persistent SQLite job queue with a small in-process worker pool.
+
+    Jobs survive restarts: a worker claims the highest-priority queued job in
+    a write transaction, so several worker processes can share one queue
+    file. Failed jobs are retried with exponential backoff up to
+    max_attempts. Handlers registered with processes=True run in a process
+    pool (for CPU-bound work); the rest run on the worker threads. A kind's
+    `then` callback runs on the worker thread once a job of it is done, e.g.
+    to submit work that must only start after it.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_after REAL NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            result TEXT,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority DESC, id);
+    """
+
+    STATUSES = ('queued', 'running', 'done', 'failed')
+
+    def __init__(self, db_path, workers=2, processes=0, max_depth=1000, max_attempts=3,
+                 poll_interval=1.0, stale_after=600, keep_finished=24 * 3600):
+        self.db_path = db_path
+        self.workers = workers
+        self.processes = processes
+        self.max_depth = max_depth
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.keep_finished = keep_finished
+        self.handlers = {}
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._process_pool = None
+        self._last_prune = 0.0
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def register(self, kind, handler, processes=False, then=None):
+        """Register handler(payload) -> JSON-serializable result for a job kind, and
+        optionally then(payload, result), called after each job of it succeeds"""
+        self.handlers[kind] = (handler, processes, then)
+
+    # Submission
+
+    def depth(self):
+        """Number of queued plus running jobs"""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+    def full(self, extra=1):
+        return self.depth() + extra > self.max_depth
+
+    def submit(self, kind, payload, priority=0):
+        """Queue one job and return its id; raises QueueFull when at max depth"""
+        return self.submit_many([(kind, payload, priority)])[0]
+
+    def submit_many(self, jobs):
+        """Queue (kind, payload, priority) jobs all-or-nothing; returns their ids"""
+        jobs = list(jobs)
+        for kind, _, _ in jobs:
+            if kind not in self.handlers:
+                raise ValueError(f'Unknown job kind: {kind}')
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            depth = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+            if depth + len(jobs) > self.max_depth:
+                raise QueueFull(f'Job queue is full ({depth} of {self.max_depth})')
+            now = time.time()
+            ids = [
+                conn.execute(
+                    'INSERT INTO jobs (kind, payload, priority, max_attempts, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (kind, json.dumps(payload), priority, self.max_attempts, now)).lastrowid
+                for kind, payload, priority in jobs
+            ]
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self.start()
+        self._wakeup.set()
+        return ids
+
+    # Status
+
+    def get(self, job_id):
+        """Return a job as a dict, or None"""
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT id, kind, payload, priority, status, attempts, max_attempts, created_at, '
+            'started_at, finished_at, result, error FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(('id', 'kind', 'payload', 'priority', 'status', 'attempts', 'max_attempts',
+                        'created_at', 'started_at', 'finished_at', 'result', 'error'), row))
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        if job['status'] == 'queued':
+            job['queue_position'] = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND "
+                "(priority > ? OR (priority = ? AND id < ?))",
+                (job['priority'], job['priority'], job_id)).fetchone()[0] + 1
+        return job
+
+    def stats(self, recent=1000):
+        """Queue depth by status and wait/run latency per kind over recent finished jobs"""
+        conn = self._connect()
+        counts = dict.fromkeys(self.STATUSES, 0)
+        counts.update(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status'))
+        latency = {}
+        rows = conn.execute(
+            "SELECT kind, started_at - created_at, finished_at - started_at FROM jobs "
+            "WHERE status = 'done' ORDER BY finished_at DESC LIMIT ?", (recent,)).fetchall()
+        for kind in set(row[0] for row in rows):
+            waits = sorted(row[1] for row in rows if row[0] == kind)
+            runs = sorted(row[2] for row in rows if row[0] == kind)
+            latency[kind] = {
+                'jobs': len(runs),
+                'wait_ms_p50': round(waits[len(waits) // 2] * 1000, 1),
+                'wait_ms_p95': round(waits[int(len(waits) * 0.95)] * 1000, 1),
+                'run_ms_p50': round(runs[len(runs) // 2] * 1000, 1),
+                'run_ms_p95': round(runs[int(len(runs) * 0.95)] * 1000, 1),
+            }
+        return {
+            'depth': counts['queued'] + counts['running'],
+            'max_depth': self.max_depth,
+            'counts': counts,
+            'latency': latency,
+        }
+
+    # Workers
+
+    def start(self):
+        """Start the worker threads: at server (worker) start, so queued jobs resume after a
+        restart, and again on submit if they are not running yet"""
+        with self._start_lock:
+            if self._threads or self.workers <= 0:
+                return
+            self._requeue_stale()
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'jobs-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False)
+            self._process_pool = None
+
+    def _requeue_stale(self):
+        """Put back jobs left 'running' by a worker that died"""
+        self._connect().execute(
+            "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND started_at < ?",
+            (time.time() - self.stale_after,))
+
+    def _claim(self):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT id, kind, payload FROM jobs WHERE status = 'queued' AND run_after <= ? "
+                "ORDER BY priority DESC, id LIMIT 1", (now,)).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1 "
+                    "WHERE id = ?", (now, row[0]))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return row
+
+    def _finish(self, job_id, result=None, error=None):
+        conn = self._connect()
+        now = time.time()
+        if error is None:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ?, result = ?, error = NULL WHERE id = ?",
+                (now, json.dumps(result), job_id))
+            return
+        attempts, max_attempts = conn.execute(
+            'SELECT attempts, max_attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if attempts < max_attempts:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', run_after = ?, error = ? WHERE id = ?",
+                (now + 2 ** attempts, error, job_id))
+        else:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ?",
+                (now, error, job_id))
+            logger.warning('Job failed', extra={'job_id': job_id, 'attempts': attempts, 'error': error})
+
+    def _run(self, kind, payload):
+        handler, processes, _ = self.handlers[kind]
+        if processes and self.processes > 0:
+            with self._start_lock:
+                if self._process_pool is None:
+                    from concurrent.futures import ProcessPoolExecutor
+                    self._process_pool = ProcessPoolExecutor(max_workers=self.processes)
+            return self._process_pool.submit(handler, payload).result()
+        return handler(payload)
+
+    def run_pending(self):
+        """Run queued jobs on the calling thread until none are ready (or the queue is
+        stopping); returns how many ran"""
+        ran = 0
+        while not self._stopping.is_set():
+            job = self._claim()
+            if job is None:
+                return ran
+            self._execute(job)
+            ran += 1
+        return ran
+
+    def _execute(self, job):
+        job_id, kind, payload = job
+        try:
+            if kind not in self.handlers:
+                raise ValueError(f'No handler for job kind {kind}')
+            payload = json.loads(payload)
+            result = self._run(kind, payload)
+            self._finish(job_id, result=result)
+        except Exception as e:
+            self._finish(job_id, error=f'{type(e).__name__}: {e}')
+            return
+        then = self.handlers[kind][2]
+        if then is not None:
+            try:
+                then(payload, result)
+            except Exception:
+                logger.exception('Job follow-up failed', extra={'job_id': job_id, 'kind': kind})
+
+    def _work(self):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                self.run_pending()
+                self._prune()
+            except Exception:
+                logger.exception('Job worker error')
+            self._wakeup.wait(self.poll_interval)
+
+    def _prune(self):
+        """At most once a minute: put back jobs of workers that died while running them, and
+        delete finished jobs older than keep_finished"""
+        now = time.time()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        self._requeue_stale()
+        self._connect().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (now - self.keep_finished,))
@@ -0,0 +1,427 @@
+import os
+import json
+import logging
+import sqlite3
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from storage import file_lock
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoMetadataStore:
+    """SQLite-backed photo metadata store (WAL mode) with an in-process read cache.
+
+    Each capture or delete touches a single row instead of rewriting the whole
+    metadata file. Every write also bumps a generation counter in the same
+    transaction, so readers in this or any other process can tell when their
+    cached view is stale.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS photos (
+            filename TEXT PRIMARY KEY,
+            location TEXT,
+            created_at TEXT,
+            digest TEXT,
+            source_digest TEXT,
+            source_kept INTEGER NOT NULL DEFAULT 0
+        );
+        DROP INDEX IF EXISTS idx_photos_created_at;
+        CREATE INDEX IF NOT EXISTS idx_photos_created_filename ON photos (created_at, filename);
+        CREATE TABLE IF NOT EXISTS blobs (
+            digest TEXT PRIMARY KEY,
+            extension TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('folder_indexed', 0);
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('modified_at', 0);
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('file_set_generation', 0);
+        -- Bumped only when a photo is added or removed or gains or loses its location
+        CREATE TRIGGER IF NOT EXISTS photos_file_set_insert AFTER INSERT ON photos BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'file_set_generation';
+        END;
+        CREATE TRIGGER IF NOT EXISTS photos_file_set_delete AFTER DELETE ON photos BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'file_set_generation';
+        END;
+        CREATE TRIGGER IF NOT EXISTS photos_file_set_located AFTER UPDATE OF location ON photos
+        WHEN (old.location IS NULL) != (new.location IS NULL) BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'file_set_generation';
+        END;
+        -- Change feed: one row per photo added, removed or relocated/redated, numbered in
+        -- commit order. Rows are written by triggers so every write path records them;
+        -- only the newest 100,000 are kept
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL,
+            filename TEXT NOT NULL
+        );
+        CREATE TRIGGER IF NOT EXISTS photos_change_insert AFTER INSERT ON photos BEGIN
+            INSERT INTO changes (op, filename) VALUES ('add', new.filename);
+        END;
+        CREATE TRIGGER IF NOT EXISTS photos_change_delete AFTER DELETE ON photos BEGIN
+            INSERT INTO changes (op, filename) VALUES ('delete', old.filename);
+        END;
+        CREATE TRIGGER IF NOT EXISTS photos_change_update AFTER UPDATE OF location, created_at ON photos
+        WHEN old.location IS NOT new.location OR old.created_at IS NOT new.created_at BEGIN
+            INSERT INTO changes (op, filename) VALUES ('update', new.filename);
+        END;
+        CREATE TRIGGER IF NOT EXISTS changes_trim AFTER INSERT ON changes BEGIN
+            DELETE FROM changes WHERE seq <= new.seq - 100000;
+        END;
+    """
+
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._cache_lock = threading.Lock()
+        self._cache = {}
+        self._cache_generation = None
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # Server workers starting together would otherwise race to add columns
+        # and import the legacy file
+        with file_lock(self.lock_path):
+            conn = self._connect()
+            conn.executescript(self.SCHEMA)
+            self._migrate_schema(conn)
+            if legacy_json_path:
+                self._migrate_legacy_json(legacy_json_path)
+
+    @property
+    def lock_path(self):
+        """File locked while the database is set up or the upload folder first indexed"""
+        return self.db_path + '.lock'
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _migrate_schema(conn):
+        """Add columns introduced after the first release to an existing database"""
+        columns = set(row[1] for row in conn.execute('PRAGMA table_info(photos)'))
+        if 'digest' not in columns:
+            conn.execute('ALTER TABLE photos ADD COLUMN digest TEXT')
+        # Set when the stored bytes were transcoded: the digest as uploaded and
+        # whether that original blob is still kept
+        if 'source_digest' not in columns:
+            conn.execute('ALTER TABLE photos ADD COLUMN source_digest TEXT')
+        if 'source_kept' not in columns:
+            conn.execute('ALTER TABLE photos ADD COLUMN source_kept INTEGER NOT NULL DEFAULT 0')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_photos_digest ON photos (digest)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_photos_source_digest ON photos (source_digest)')
+
+    @contextmanager
+    def transaction(self):
+        """Yield the connection inside BEGIN IMMEDIATE; bumps the generation if rows changed
+
+        Holding the write lock also serializes any file operations done in
+        the block against other threads and processes using the store.
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            changes = conn.total_changes
+            yield conn
+            if conn.total_changes != changes:
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+                conn.execute("UPDATE meta SET value = ? WHERE key = 'modified_at'", (int(time.time()),))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _write(self, statements):
+        """Run (sql, params) pairs in one transaction and bump the generation"""
+        with self.transaction() as conn:
+            rowcount = 0
+            for sql, params in statements:
+                rowcount += conn.execute(sql, params).rowcount
+        return rowcount
+
+    def _migrate_legacy_json(self, json_path):
+        """One-time import of the old photo_metadata.json file"""
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, 'r') as f:
+                legacy = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            logger.warning('Could not read legacy metadata file', extra={'path': json_path})
+            return
+
+        self._write(
+            ('INSERT OR IGNORE INTO photos (filename, location, created_at) VALUES (?, ?, ?)',
+             (filename, self._encode_location(entry.get('location')), entry.get('created_at') or ''))
+            for filename, entry in legacy.items()
+        )
+        # The rows are committed, so renaming the file marks the migration done
+        os.replace(json_path, json_path + '.migrated')
+        logger.info('Migrated legacy metadata', extra={'path': json_path, 'entries': len(legacy)})
+
+    @staticmethod
+    def _encode_location(location):
+        # NULL (rather than JSON 'null') so has-location filters can use IS NOT NULL
+        return json.dumps(location) if location is not None else None
+
+    @staticmethod
+    def _row_to_entry(location, created_at):
+        return {
+            'location': json.loads(location) if location else None,
+            'created_at': created_at
+        }
+
+    def generation(self):
+        """Return the write generation counter"""
+        row = self._connect().execute(
+            "SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return row[0]
+
+    def file_set_generation(self):
+        """Return a counter that moves only when photos are added, removed or (un)located"""
+        row = self._connect().execute(
+            "SELECT value FROM meta WHERE key = 'file_set_generation'").fetchone()
+        return row[0]
+
+    def file_set(self):
+        """Return {filename: whether the photo has a location} for every photo"""
+        rows = self._connect().execute('SELECT filename, location IS NOT NULL FROM photos')
+        return {filename: bool(located) for filename, located in rows}
+
+    def change_seq(self):
+        """Return the sequence number of the newest change-feed entry (0 before the first)"""
+        row = self._connect().execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+        return row[0] if row else 0
+
+    def changes_since(self, since, limit=1000):
+        """Return (changes, seq, more) for change-feed entries after since, or None
+
+        changes lists (filename, op, entry) once per photo, in the order of
+        its last change, with the photo's current entry (None once deleted);
+        op is 'add' if the photo was added in this range, else 'update' or
+        'delete'. seq is the cursor to pass next time, and more is True when
+        limit cut the range short. None means since is older than the kept
+        history (or from another database) and the caller must reload fully.
+        """
+        conn = self._connect()
+        latest = self.change_seq()
+        oldest = conn.execute('SELECT MIN(seq) FROM changes').fetchone()[0]
+        if since > latest or (since < latest and (oldest is None or since < oldest - 1)):
+            return None
+        rows = conn.execute(
+            'SELECT changes.seq, changes.op, changes.filename, photos.location, photos.created_at, '
+            'photos.filename IS NOT NULL FROM changes LEFT JOIN photos ON photos.filename = changes.filename '
+            'WHERE changes.seq > ? ORDER BY changes.seq LIMIT ?', (since, limit)).fetchall()
+        latest_change = {}
+        added = set()
+        for seq, op, filename, location, created_at, exists in rows:
+            if op == 'add':
+                added.add(filename)
+            latest_change.pop(filename, None)
+            latest_change[filename] = self._row_to_entry(location, created_at) if exists else None
+        changes = [(filename, 'delete' if entry is None else 'add' if filename in added else 'update', entry)
+                   for filename, entry in latest_change.items()]
+        return changes, rows[-1][0] if rows else since, len(rows) == limit
+
+    def version(self):
+        """Return (generation, time of the last write as an aware UTC datetime or None)"""
+        rows = dict(self._connect().execute(
+            "SELECT key, value FROM meta WHERE key IN ('generation', 'modified_at')"))
+        modified_at = rows['modified_at']
+        return rows['generation'], datetime.fromtimestamp(modified_at, timezone.utc) if modified_at else None
+
+    def all(self):
+        """Return {filename: {'location', 'created_at'}} for every photo.
+
+        The dict is shared between callers until the next write, so treat it
+        as read-only.
+        """
+        generation = self.generation()
+        with self._cache_lock:
+            if generation != self._cache_generation:
+                rows = self._connect().execute(
+                    'SELECT filename, location, created_at FROM photos')
+                self._cache = {
+                    filename: self._row_to_entry(location, created_at)
+                    for filename, location, created_at in rows
+                }
+                self._cache_generation = generation
+            return self._cache
+
+    def get(self, filename):
+        """Return the metadata entry for a single photo, or None"""
+        row = self._connect().execute(
+            'SELECT location, created_at FROM photos WHERE filename = ?',
+            (filename,)).fetchone()
+        return self._row_to_entry(*row) if row else None
+
+    def blob_of(self, filename):
+        """Return (digest, extension) of the blob holding a photo, or None for a plain upload"""
+        return self._connect().execute(
+            'SELECT blobs.digest, blobs.extension FROM photos JOIN blobs ON blobs.digest = photos.digest '
+            'WHERE photos.filename = ?', (filename,)).fetchone()
+
+    def created_between(self, start=None, end=None, newest_first=True):
+        """Return (filename, entry) pairs ordered by created_at using the index"""
+        sql = 'SELECT filename, location, created_at FROM photos WHERE 1 = 1'
+        params = []
+        if start is not None:
+            sql += ' AND created_at >= ?'
+            params.append(start)
+        if end is not None:
+            sql += ' AND created_at < ?'
+            params.append(end)
+        sql += ' ORDER BY created_at DESC' if newest_first else ' ORDER BY created_at'
+        rows = self._connect().execute(sql, params)
+        return [(filename, self._row_to_entry(location, created_at))
+                for filename, location, created_at in rows]
+
+    def date_rows(self):
+        """Return (filename, created_at, latitude, longitude) for every photo, oldest first"""
+        return self._connect().execute(
+            "SELECT filename, created_at, CAST(json_extract(location, '$.latitude') AS REAL), "
+            "CAST(json_extract(location, '$.longitude') AS REAL) FROM photos ORDER BY created_at, filename"
+        ).fetchall()
+
+    def iter_photos(self, start=None, end=None, bbox=None, batch_size=500):
+        """Yield (filename, entry, digest) oldest first, fetching batch_size rows at a time
+
+        bbox is (south, west, north, east); rows without a location are
+        skipped when it is given. Memory use does not depend on table size.
+        """
+        sql = 'SELECT filename, location, created_at, digest FROM photos WHERE 1 = 1'
+        params = []
+        if start is not None:
+            sql += ' AND created_at >= ?'
+            params.append(start)
+        if end is not None:
+            sql += ' AND created_at < ?'
+            params.append(end)
+        if bbox is not None:
+            sql += (" AND CAST(json_extract(location, '$.latitude') AS REAL) BETWEEN ? AND ?"
+                    " AND CAST(json_extract(location, '$.longitude') AS REAL) BETWEEN ? AND ?")
+            south, west, north, east = bbox
+            params.extend([south, north, west, east])
+        sql += ' ORDER BY created_at, filename'
+        cursor = self._connect().execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for filename, location, created_at, digest in rows:
+                    yield filename, self._row_to_entry(location, created_at), digest
+        finally:
+            cursor.close()
+
+    def page(self, limit, after=None, has_location=None, start=None, end=None):
+        """Return up to limit (filename, entry) pairs, newest first.
+
+        after is the (created_at, filename) key of the last row of the
+        previous page; keyset pagination keeps every page an index range scan
+        no matter how deep the client has scrolled.
+        """
+        sql = 'SELECT filename, location, created_at FROM photos WHERE 1 = 1'
+        params = []
+        if after is not None:
+            sql += ' AND (created_at, filename) < (?, ?)'
+            params.extend(after)
+        if has_location is True:
+            sql += ' AND location IS NOT NULL'
+        elif has_location is False:
+            sql += ' AND location IS NULL'
+        if start is not None:
+            sql += ' AND created_at >= ?'
+            params.append(start)
+        if end is not None:
+            sql += ' AND created_at < ?'
+            params.append(end)
+        sql += ' ORDER BY created_at DESC, filename DESC LIMIT ?'
+        params.append(limit)
+        rows = self._connect().execute(sql, params)
+        return [(filename, self._row_to_entry(location, created_at))
+                for filename, location, created_at in rows]
+
+    def count(self, has_location=None):
+        """Return the number of photos, optionally only those with(out) a location"""
+        sql = 'SELECT COUNT(*) FROM photos'
+        if has_location is True:
+            sql += ' WHERE location IS NOT NULL'
+        elif has_location is False:
+            sql += ' WHERE location IS NULL'
+        return self._connect().execute(sql).fetchone()[0]
+
+    def folder_indexed(self):
+        row = self._connect().execute(
+            "SELECT value FROM meta WHERE key = 'folder_indexed'").fetchone()
+        return bool(row[0])
+
+    def reconcile(self, files):
+        """Make the photo rows match the files on disk.
+
+        files maps each filename present on disk to a fallback created_at
+        (normally its mtime). Missing rows are added without a location, rows
+        whose file is gone are dropped (blob-backed rows are left alone).
+        Returns (added, removed).
+        """
+        existing = {}
+        for filename, digest in self._connect().execute('SELECT filename, digest FROM photos'):
+            existing[filename] = digest
+        added = [name for name in files if name not in existing]
+        # Photos stored as content-addressed blobs have no file of their own in the folder
+        removed = [name for name, digest in existing.items() if digest is None and name not in files]
+        statements = [
+            ('INSERT OR IGNORE INTO photos (filename, location, created_at) VALUES (?, NULL, ?)',
+             (name, files[name]))
+            for name in added
+        ]
+        statements += [('DELETE FROM photos WHERE filename = ?', (name,)) for name in removed]
+        statements.append(("UPDATE meta SET value = 1 WHERE key = 'folder_indexed'", ()))
+        self._write(statements)
+        return len(added), len(removed)
+
+    def put(self, filename, location, created_at=None):
+        """Insert or replace the metadata row for a photo; returns the stored entry"""
+        created_at = created_at or datetime.now().isoformat()
+        self._write([(
+            'INSERT INTO photos (filename, location, created_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (filename) DO UPDATE SET location = excluded.location, created_at = excluded.created_at',
+            (filename, self._encode_location(location), created_at)
+        )])
+        return {'location': location, 'created_at': created_at}
+
+    def update_many(self, updates):
+        """Set (filename, location, created_at or None) for existing rows in one transaction
+
+        A None created_at keeps the stored value. Returns the number of rows updated.
+        """
+        return self._write(
+            ('UPDATE photos SET location = ?, created_at = COALESCE(?, created_at) WHERE filename = ?',
+             (self._encode_location(location), created_at, filename))
+            for filename, location, created_at in updates
+        )
+
+    def delete(self, filename):
+        """Delete the metadata row for a plain upload; returns True if it existed
+
+        Blob-backed photos are deleted through BlobStore.release so the blob's
+        reference count stays right.
+        """
+        return self._write([
+            ('DELETE FROM photos WHERE filename = ?', (filename,))
+        ]) > 0
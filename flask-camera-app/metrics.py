@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from flask import Response, g, has_request_context, request
+
+# Latency histogram buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Attributes every LogRecord has; anything else on a record came from `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+logger = logging.getLogger(__name__)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Registry:
+    """In-process counters, histograms and gauges rendered in the Prometheus text format.
+
+    Values are per process: with several server workers each one reports its
+    own, and the scraper (or a sum() in the query) combines them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def counter(self, name, help_text):
+        self._metrics[name] = ('counter', help_text, None, {})
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._metrics[name] = ('histogram', help_text, tuple(buckets), {})
+
+    def gauge(self, name, help_text, read):
+        """Register a gauge whose value is read(), called at scrape time"""
+        self._metrics[name] = ('gauge', help_text, read, {})
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._metrics[name][3]
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        _, _, buckets, series = self._metrics[name]
+        with self._lock:
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * len(buckets) + [0, 0.0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    def render(self):
+        lines = []
+        with self._lock:
+            snapshot = [(name, kind, help_text, extra, dict(series))
+                        for name, (kind, help_text, extra, series) in self._metrics.items()]
+        for name, kind, help_text, extra, series in snapshot:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'gauge':
+                try:
+                    lines.append(f'{name} {_format_value(extra())}')
+                except Exception as e:
+                    logger.warning('Could not read gauge', extra={'metric': name, 'error': str(e)})
+                continue
+            for labels, value in sorted(series.items()):
+                if kind == 'counter':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                for bound, count in zip(extra, value):
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {count}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {value[-2]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {value[-1]!r}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value[-2]}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REGISTRY.histogram('http_request_duration_seconds', 'Time from request start to response, by route')
+REGISTRY.counter('http_requests_total', 'Requests answered, by route and status code')
+REGISTRY.histogram('stage_duration_seconds', 'Time spent in named stages inside handlers and jobs')
+
+
+@contextmanager
+def stage(name):
+    """Time a block as stage_duration_seconds{stage=name}; inside a request it is also
+    added to the per-request breakdown logged for slow requests"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        REGISTRY.observe('stage_duration_seconds', elapsed, stage=name)
+        if has_request_context():
+            stages = g.setdefault('stage_timings', {})
+            stages[name] = stages.get(name, 0.0) + elapsed
+
+
+def _collapse(frame, depth):
+    """'file:function:line;...' from the outermost frame in, like collapsed flame graph stacks"""
+    parts = []
+    while frame is not None and len(parts) < depth:
+        code = frame.f_code
+        parts.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+        frame = frame.f_back
+    return ';'.join(reversed(parts))
+
+
+class SamplingProfiler:
+    """Samples the stacks of threads serving requests every `interval` seconds.
+
+    One background thread reads sys._current_frames() while any request is
+    being sampled and sleeps otherwise. The cost is per sample, not per
+    function call, so it is cheap enough to leave on for slow-request
+    diagnosis.
+    """
+
+    def __init__(self, interval=0.005, depth=40):
+        self.interval = interval
+        self.depth = depth
+        self._lock = threading.Lock()
+        self._active = {}
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._active[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def stop(self, thread_id):
+        """Stop sampling a thread and return Counter({collapsed stack: samples})"""
+        with self._lock:
+            return self._active.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._wakeup.clear()
+            self._wakeup.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[_collapse(frame, self.depth)] += 1
+
+
+def instrument(app, slow_request_ms=0, profile=False, profile_interval=0.005):
+    """Record per-route latency for every request; log requests slower than slow_request_ms
+
+    The slow-request log line carries the stage breakdown and, with profile
+    set, the most frequent sampled stacks. Routes are labelled by their URL
+    rule (e.g. /uploads/<filename>) so the label set stays small.
+    """
+    profiler = SamplingProfiler(profile_interval) if profile and slow_request_ms else None
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        if profiler is not None:
+            profiler.start(threading.get_ident())
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REGISTRY.observe('http_request_duration_seconds', elapsed, method=request.method, route=route)
+        REGISTRY.inc('http_requests_total', method=request.method, route=route, status=response.status_code)
+        samples = profiler.stop(threading.get_ident()) if profiler is not None else None
+        if slow_request_ms and elapsed * 1000 >= slow_request_ms:
+            details = {
+                'method': request.method,
+                'route': route,
+                'path': request.full_path.rstrip('?'),
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 1),
+                'stages_ms': {name: round(seconds * 1000, 1)
+                              for name, seconds in g.get('stage_timings', {}).items()},
+            }
+            if samples:
+                details['profile'] = [{'stack': stack, 'samples': count}
+                                      for stack, count in samples.most_common(10)]
+            logger.warning('Slow request', extra=details)
+        return response
+
+    @app.teardown_request
+    def stop_profiling(error=None):
+        if profiler is not None:
+            profiler.stop(threading.get_ident())
+
+
+def metrics_response():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any `extra=` fields"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level='INFO', fmt='json'):
+    """Send log records to stderr as JSON lines (or plain text), unless logging is already set up"""
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handler = logging.StreamHandler()
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root.addHandler(handler)
+    root.setLevel(level.upper())
@@ -0,0 +1,92 @@
+import os
+import gzip
+import json
+import mmap
+import struct
+import hashlib
+from datetime import datetime, timezone
+
+MAGIC = b'SANDSNAP'
+FORMAT_VERSION = 1
+# Magic, format version, then offset and length of the JSON index (little-endian)
+HEADER = struct.Struct('<8sIQI')
+
+
+class SnapshotError(ValueError):
+    """The file is not a snapshot this code can read"""
+
+
+def write_snapshot(path, sections, info=None):
+    """Write pre-encoded response bodies into one snapshot file
+
+    sections maps a name to the exact bytes to send; each is stored as is
+    and gzipped. A small JSON index at the end records every body's offset
+    and length plus the snapshot version (a hash of all bodies), so a reader
+    finds a body without parsing it. The file is written under a temporary
+    name and renamed into place.
+    """
+    version = hashlib.sha1()
+    index = {
+        'built_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'info': info or {},
+        'sections': {},
+    }
+    temp_path = f'{path}.part'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, 0))
+        for name, body in sections.items():
+            version.update(name.encode('utf-8') + b'\0' + body + b'\0')
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            offset = f.tell()
+            f.write(body)
+            f.write(compressed)
+            index['sections'][name] = {'offset': offset, 'length': len(body),
+                                       'gzip_offset': offset + len(body), 'gzip_length': len(compressed)}
+        index['version'] = version.hexdigest()
+        encoded = json.dumps(index, separators=(',', ':')).encode('utf-8')
+        index_offset = f.tell()
+        f.write(encoded)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, index_offset, len(encoded)))
+    os.replace(temp_path, path)
+    return index
+
+
+class Snapshot:
+    """A snapshot file mapped read-only into memory
+
+    Only the small index is decoded when the file is opened; bodies are
+    sliced straight out of the mapping, and pages the OS has not read yet
+    are loaded on first access.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise SnapshotError(f'{path} is too short to be a snapshot')
+        magic, format_version, index_offset, index_length = HEADER.unpack_from(self._map)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise SnapshotError(f'{path} is not a version {FORMAT_VERSION} snapshot')
+        index = json.loads(self._map[index_offset:index_offset + index_length])
+        self.version = index['version']
+        self.built_at = datetime.fromisoformat(index['built_at'])
+        self.info = index['info']
+        self.sections = index['sections']
+
+    def body(self, name, encoding=None):
+        """The stored bytes of a section, gzipped if encoding is 'gzip'"""
+        section = self.sections[name]
+        if encoding == 'gzip':
+            offset, length = section['gzip_offset'], section['gzip_length']
+        else:
+            offset, length = section['offset'], section['length']
+        return self._map[offset:offset + length]
+
+
+def open_snapshot(path):
+    """Open a snapshot, or return None if there is no file at path"""
+    if not os.path.exists(path):
+        return None
+    return Snapshot(path)
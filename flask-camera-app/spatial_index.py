@@ -0,0 +1,201 @@
+import math
+import threading
+
+# Clusters are pre-aggregated for every zoom level up to this one; above it the
+# map always gets individual points
+MAX_CLUSTER_ZOOM = 18
+
+# Cluster cells per 256px map tile edge (so a cell is roughly 64px on screen)
+CELLS_PER_TILE = 4
+
+# Zoom level whose cells bucket the individual points
+POINT_BUCKET_ZOOM = 12
+
+
+def cell_size(zoom):
+    """Cell edge in degrees for a zoom level"""
+    return 360.0 / (2 ** zoom) / CELLS_PER_TILE
+
+
+def cell_of(lat, lng, size):
+    return (math.floor(lat / size), math.floor(lng / size))
+
+
+CELL_SIZES = [cell_size(zoom) for zoom in range(MAX_CLUSTER_ZOOM + 1)]
+BUCKET_SIZE = cell_size(POINT_BUCKET_ZOOM)
+
+
+class _Layer:
+    """Points of one kind: grid buckets plus per-zoom (count, lat_sum, lng_sum) cells"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.clusters = [{} for _ in CELL_SIZES]
+
+
+class GridIndex:
+    """In-memory grid index over lat/lng points with per-zoom cluster aggregates.
+
+    Points are bucketed into fixed grid cells so a bounding-box query only
+    visits the cells it overlaps. For every zoom level up to MAX_CLUSTER_ZOOM
+    the index also keeps a count and coordinate sums per cell, updated on each
+    add/remove, so clustering a viewport costs O(visible cells) rather than
+    O(points). Each kind of point (photo, sample) is a separate layer so a
+    layer can be dropped and rebuilt without touching the others.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._points = {}
+        self._layers = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def _layer(self, kind):
+        layer = self._layers.get(kind)
+        if layer is None:
+            layer = self._layers[kind] = _Layer()
+        return layer
+
+    def add(self, key, lat, lng, kind, payload):
+        """Add or move a point; payload is returned as-is by points()"""
+        with self._lock:
+            if key in self._points:
+                self.remove(key)
+            point = (lat, lng, kind, payload)
+            self._points[key] = point
+            layer = self._layer(kind)
+            layer.buckets.setdefault(cell_of(lat, lng, BUCKET_SIZE), {})[key] = point
+            for cells, size in zip(layer.clusters, CELL_SIZES):
+                cell = (math.floor(lat / size), math.floor(lng / size))
+                cluster = cells.get(cell)
+                if cluster is None:
+                    cells[cell] = (1, lat, lng)
+                else:
+                    cells[cell] = (cluster[0] + 1, cluster[1] + lat, cluster[2] + lng)
+
+    def add_many(self, kind, items):
+        """Bulk-add (key, lat, lng, payload) items of one kind.
+
+        Cluster aggregates are computed per zoom level with NumPy (floor,
+        unique, bincount), so rebuilding a layer does one vectorized pass per
+        level instead of one Python update per point per level. Keys must not
+        already be indexed.
+        """
+        if not items:
+            return
+        # Imported here so that only the first layer build pays for NumPy
+        import numpy as np
+        lats = np.fromiter((item[1] for item in items), dtype=np.float64, count=len(items))
+        lngs = np.fromiter((item[2] for item in items), dtype=np.float64, count=len(items))
+        offset = 1 << 24  # keeps cell numbers non-negative so a cell packs into one int64
+        with self._lock:
+            layer = self._layer(kind)
+            for key, lat, lng, payload in items:
+                point = (lat, lng, kind, payload)
+                self._points[key] = point
+                layer.buckets.setdefault(cell_of(lat, lng, BUCKET_SIZE), {})[key] = point
+            for cells, size in zip(layer.clusters, CELL_SIZES):
+                rows = np.floor(lats / size).astype(np.int64) + offset
+                cols = np.floor(lngs / size).astype(np.int64) + offset
+                packed, inverse, counts = np.unique(
+                    (rows << 32) | cols, return_inverse=True, return_counts=True)
+                cell_keys = zip(((packed >> 32) - offset).tolist(),
+                                ((packed & 0xFFFFFFFF) - offset).tolist())
+                aggregates = zip(counts.tolist(),
+                                 np.bincount(inverse, weights=lats).tolist(),
+                                 np.bincount(inverse, weights=lngs).tolist())
+                if not cells:
+                    cells.update(zip(cell_keys, aggregates))
+                    continue
+                for cell, (count, lat_sum, lng_sum) in zip(cell_keys, aggregates):
+                    cluster = cells.get(cell)
+                    if cluster is None:
+                        cells[cell] = (count, lat_sum, lng_sum)
+                    else:
+                        cells[cell] = (cluster[0] + count, cluster[1] + lat_sum, cluster[2] + lng_sum)
+
+    def remove(self, key):
+        """Remove a point; returns False if it was not indexed"""
+        with self._lock:
+            point = self._points.pop(key, None)
+            if point is None:
+                return False
+            lat, lng, kind, _ = point
+            layer = self._layers[kind]
+            bucket_cell = cell_of(lat, lng, BUCKET_SIZE)
+            bucket = layer.buckets[bucket_cell]
+            del bucket[key]
+            if not bucket:
+                del layer.buckets[bucket_cell]
+            for cells, size in zip(layer.clusters, CELL_SIZES):
+                cell = (math.floor(lat / size), math.floor(lng / size))
+                count, lat_sum, lng_sum = cells[cell]
+                if count == 1:
+                    del cells[cell]
+                else:
+                    cells[cell] = (count - 1, lat_sum - lat, lng_sum - lng)
+            return True
+
+    def remove_kind(self, kind):
+        """Drop a whole layer (used before rebuilding it)"""
+        with self._lock:
+            if self._layers.pop(kind, None) is not None:
+                self._points = {key: point for key, point in self._points.items() if point[2] != kind}
+
+    @staticmethod
+    def _cells_in_bbox(bbox, size, cells):
+        """Yield the keys of non-empty cells overlapping bbox (south, west, north, east)"""
+        south, west, north, east = bbox
+        row_min, col_min = cell_of(south, west, size)
+        row_max, col_max = cell_of(north, east, size)
+        span = (row_max - row_min + 1) * (col_max - col_min + 1)
+        if span <= len(cells):
+            for row in range(row_min, row_max + 1):
+                for col in range(col_min, col_max + 1):
+                    if (row, col) in cells:
+                        yield (row, col)
+        else:
+            # Fewer occupied cells than cells in view: filter the occupied ones
+            for row, col in list(cells):
+                if row_min <= row <= row_max and col_min <= col <= col_max:
+                    yield (row, col)
+
+    def _selected_layers(self, kinds):
+        return [(kind, layer) for kind, layer in self._layers.items()
+                if kinds is None or kind in kinds]
+
+    def points(self, bbox, kinds=None, limit=None):
+        """Return (payloads, total) for points inside bbox, optionally only some kinds"""
+        south, west, north, east = bbox
+        results = []
+        total = 0
+        with self._lock:
+            for _, layer in self._selected_layers(kinds):
+                for cell in self._cells_in_bbox(bbox, BUCKET_SIZE, layer.buckets):
+                    for lat, lng, _, payload in layer.buckets[cell].values():
+                        if south <= lat <= north and west <= lng <= east:
+                            total += 1
+                            if limit is None or len(results) < limit:
+                                results.append(payload)
+        return results, total
+
+    def clusters(self, bbox, zoom, kinds=None):
+        """Return cluster cells (centroid, count, per-kind counts) visible in bbox at zoom"""
+        zoom = max(0, min(int(zoom), MAX_CLUSTER_ZOOM))
+        merged = {}
+        with self._lock:
+            for kind, layer in self._selected_layers(kinds):
+                cells = layer.clusters[zoom]
+                for cell in self._cells_in_bbox(bbox, CELL_SIZES[zoom], cells):
+                    count, lat_sum, lng_sum = cells[cell]
+                    cluster = merged.setdefault(cell, [0, 0.0, 0.0, {}])
+                    cluster[0] += count
+                    cluster[1] += lat_sum
+                    cluster[2] += lng_sum
+                    cluster[3][kind] = count
+        return [
+            {'lat': lat_sum / count, 'lng': lng_sum / count, 'count': count, 'kinds': by_kind}
+            for count, lat_sum, lng_sum, by_kind in merged.values()
+        ]
@@ -2,6 +2,7 @@
 let currentStream = null;
 let facingMode = 'user'; // 'user' for front camera, 'environment' for back camera
 let capturedImageData = null;
+let capturedImageBlob = null;
 let capturedLocationData = null;
 
 const video = document.getElementById('video');
@@ -291,8 +292,12 @@ async function capturePhoto() {
         // Draw current video frame to canvas with proper scaling
         context.drawImage(video, 0, 0, canvas.width, canvas.height);
         
-        // Get image data as high-quality JPEG (smaller file size, good quality)
-        capturedImageData = canvas.toDataURL('image/jpeg', 0.92);
+        // Get image as a high-quality JPEG Blob (smaller file size, good quality);
+        // it is uploaded as a binary body instead of a base64 data URL
+        capturedImageBlob = await canvasToBlob(canvas, 'image/jpeg', 0.92);
+        capturedImageData = capturedImageBlob
+            ? URL.createObjectURL(capturedImageBlob)
+            : canvas.toDataURL('image/jpeg', 0.92);
         
         // Store location data for saving
         capturedLocationData = locationData;
@@ -319,11 +324,72 @@ function showPreview(imageData) {
     document.getElementById('cameraSection').style.display = 'none';
 }
 
+// Convert canvas contents to a Blob (resolves to null if toBlob is unsupported)
+function canvasToBlob(canvas, type, quality) {
+    return new Promise(resolve => {
+        if (!canvas.toBlob) {
+            resolve(null);
+            return;
+        }
+        canvas.toBlob(resolve, type, quality);
+    });
+}
+
+// Release the captured image and its preview URL
+function clearCapturedImage() {
+    if (capturedImageBlob && capturedImageData) {
+        URL.revokeObjectURL(capturedImageData);
+    }
+    capturedImageData = null;
+    capturedImageBlob = null;
+}
+
 // Cancel preview and return to camera
 function cancelPreview() {
     document.getElementById('previewSection').style.display = 'none';
     document.getElementById('cameraSection').style.display = 'block';
-    capturedImageData = null;
+    clearCapturedImage();
+}
+
+// Build the /capture request: binary Blob body with location in the query
+// string, or the legacy JSON/base64 body when no Blob is available
+function buildCaptureRequest() {
+    if (!capturedImageBlob) {
+        return {
+            url: '/capture',
+            options: {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    image: capturedImageData,
+                    location: capturedLocationData
+                })
+            }
+        };
+    }
+
+    const params = new URLSearchParams();
+    if (capturedLocationData) {
+        ['latitude', 'longitude', 'accuracy', 'timestamp'].forEach(key => {
+            if (capturedLocationData[key] !== undefined && capturedLocationData[key] !== null) {
+                params.append(key, capturedLocationData[key]);
+            }
+        });
+    }
+    const query = params.toString();
+
+    return {
+        url: '/capture' + (query ? '?' + query : ''),
+        options: {
+            method: 'POST',
+            headers: {
+                'Content-Type': capturedImageBlob.type || 'application/octet-stream',
+            },
+            body: capturedImageBlob
+        }
+    };
 }
 
 // Save captured photo
@@ -336,26 +402,25 @@ async function savePhoto() {
     try {
         showLoading(true);
         
-        const response = await fetch('/capture', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                image: capturedImageData,
-                location: capturedLocationData
-            })
-        });
+        let result;
+        if (capturedImageBlob && capturedImageBlob.size > RESUMABLE_THRESHOLD) {
+            // Large captures go up in resumable chunks so a weak signal does not restart them
+            result = await uploadResumable(capturedImageBlob, { location: capturedLocationData });
+        } else {
+            const captureRequest = buildCaptureRequest();
+            const response = await fetch(captureRequest.url, captureRequest.options);
 
-        const result = await response.json();
+            result = await response.json();
+        }
         
         if (result.success) {
             showStatus(result.message, 'success');
+            pullChanges(); // Patch the new photo into the map and gallery
             
             // Reset to main screen
             document.getElementById('previewSection').style.display = 'none';
             hideCamera();
-            capturedImageData = null;
+            clearCapturedImage();
             capturedLocationData = null;
         } else {
             showStatus(result.message, 'error');
@@ -0,0 +1,111 @@
+// Photo change feed client (/api/changes)
+//
+// Keeps a cursor into the server's change feed and hands every batch of changes
+// ({op: 'add' | 'update' | 'delete', filename, photo}) to the registered handlers,
+// so pages patch their markers and tiles instead of re-downloading every photo.
+// Changes are pushed over Server-Sent Events when the server advertises a stream
+// (EVENTS_URL); otherwise, or when the stream gives up, the feed is polled.
+
+const CHANGE_POLL_INTERVAL = 15000;
+
+const changeFeed = {
+    seq: null,
+    handlers: [],
+    source: null,
+    pollTimer: null,
+    pulling: null,
+    started: null
+};
+
+// Apply one delta; a reset means the cursor fell out of the server's history
+function applyChangeDelta(delta) {
+    if (!delta.success) return;
+    if (delta.reset) {
+        changeFeed.seq = delta.seq;
+        changeFeed.handlers.forEach(handler => handler.onReset && handler.onReset());
+        return;
+    }
+    // Stream and explicit pulls may deliver the same range; apply it once
+    if (changeFeed.seq !== null && delta.seq <= changeFeed.seq) return;
+    changeFeed.seq = delta.seq;
+    if (delta.changes.length) {
+        changeFeed.handlers.forEach(handler => handler.onChanges(delta.changes));
+    }
+}
+
+// Fetch and apply everything after the cursor now (e.g. right after this page uploaded
+// or deleted something); concurrent calls share one request chain
+function pullChanges() {
+    if (changeFeed.seq === null) return Promise.resolve();
+    if (!changeFeed.pulling) {
+        changeFeed.pulling = (async () => {
+            try {
+                let more = true;
+                while (more) {
+                    const response = await fetch(`/api/changes?since=${changeFeed.seq}`);
+                    const delta = await response.json();
+                    applyChangeDelta(delta);
+                    more = delta.success && delta.more;
+                }
+            } catch (error) {
+                console.warn('Could not fetch photo changes:', error);
+            } finally {
+                changeFeed.pulling = null;
+            }
+        })();
+    }
+    return changeFeed.pulling;
+}
+
+function startChangePolling() {
+    if (!changeFeed.pollTimer) {
+        changeFeed.pollTimer = setInterval(pullChanges, CHANGE_POLL_INTERVAL);
+    }
+}
+
+function openChangeStream(url) {
+    const source = new EventSource(`${url}?since=${changeFeed.seq}`);
+    const onMessage = event => applyChangeDelta(JSON.parse(event.data));
+    source.addEventListener('changes', onMessage);
+    source.addEventListener('reset', onMessage);
+    // EventSource reconnects by itself (resuming from the last event id); it only
+    // closes for good when the server refuses, and then polling takes over
+    source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+            changeFeed.source = null;
+            startChangePolling();
+        }
+    };
+    changeFeed.source = source;
+}
+
+// Register {onChanges(changes), onReset()} and start following the feed. Resolves once
+// the starting cursor is known: load the page's full state after that, so nothing
+// committed in between is missed (a change seen twice is applied idempotently).
+function subscribeToChanges(handler) {
+    changeFeed.handlers.push(handler);
+    if (!changeFeed.started) {
+        changeFeed.started = (async () => {
+            try {
+                const response = await fetch('/api/changes');
+                const current = await response.json();
+                changeFeed.seq = current.seq;
+                if (current.stream && window.EventSource) {
+                    openChangeStream(current.stream);
+                } else {
+                    startChangePolling();
+                }
+            } catch (error) {
+                console.warn('Photo change feed unavailable:', error);
+            }
+        })();
+    }
+    return changeFeed.started;
+}
+
+// A page coming back to the foreground catches up at once instead of at the next poll
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'visible' && !changeFeed.source) {
+        pullChanges();
+    }
+});
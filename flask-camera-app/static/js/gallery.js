@@ -24,8 +24,8 @@ function locatePhotoOnMap(filename, latitude, longitude) {
 }
 
 // Enhanced selection functionality with dots
-function initializeSelectionDots() {
-    const selectionDots = document.querySelectorAll('.selection-dot');
+function initializeSelectionDots(root = document) {
+    const selectionDots = root.querySelectorAll('.selection-dot');
     
     selectionDots.forEach(dot => {
         dot.addEventListener('click', function(e) {
@@ -44,6 +44,92 @@ function initializeSelectionDots() {
     });
 }
 
+// Incremental loading: the server renders the first page, the rest comes from /api/photos
+let isLoadingMore = false;
+
+async function loadMorePhotos() {
+    const grid = document.querySelector('.gallery-grid');
+    const loadMoreBtn = document.getElementById('loadMoreBtn');
+    if (!grid || isLoadingMore || !grid.dataset.nextCursor) return;
+    
+    isLoadingMore = true;
+    if (loadMoreBtn) loadMoreBtn.disabled = true;
+    
+    try {
+        const response = await fetch(`/api/photos?limit=60&after=${encodeURIComponent(grid.dataset.nextCursor)}`);
+        const result = await response.json();
+        
+        if (!result.success) {
+            showMessage('Failed to load more photos: ' + result.message, 'error');
+            return;
+        }
+        
+        const fragment = document.createElement('div');
+        fragment.innerHTML = result.photos.map(createGalleryItemHtml).join('');
+        initializeSelectionDots(fragment);
+        if (isSelectMode) {
+            fragment.querySelectorAll('.selection-checkbox').forEach(cb => cb.style.display = 'block');
+        }
+        grid.append(...fragment.children);
+        
+        grid.dataset.nextCursor = result.next || '';
+        if (!result.next && loadMoreBtn) {
+            loadMoreBtn.parentNode.remove();
+        }
+    } catch (error) {
+        console.error('Error loading more photos:', error);
+        showMessage('Error loading more photos', 'error');
+    } finally {
+        isLoadingMore = false;
+        if (loadMoreBtn) loadMoreBtn.disabled = false;
+    }
+}
+
+// Build the same markup as templates/gallery.html for a photo from /api/photos
+function createGalleryItemHtml(photo) {
+    const hasLocation = !!photo.location;
+    const locateButton = hasLocation
+        ? `<button class="locate-btn" title="Show on map"
+                   onclick="locatePhotoOnMap('${photo.filename}', '${photo.location.latitude}', '${photo.location.longitude}')">
+               <i class="fas fa-map-marker-alt"></i>
+           </button>`
+        : `<button class="locate-btn disabled" title="No location data" disabled>
+               <i class="fas fa-map-marker-alt"></i>
+           </button>`;
+    
+    return `
+        <div class="gallery-item fade-in" data-filename="${photo.filename}" data-has-location="${hasLocation}">
+            <div class="selection-checkbox" style="display: none;">
+                <input type="checkbox" class="photo-select" value="${photo.filename}">
+                <div class="selection-dot"></div>
+            </div>
+            <img src="${photo.thumbnail_url}" alt="Photo"
+                 onclick="handleImageClick('${photo.url}', '${photo.filename}')"
+                 loading="lazy">
+            <div class="gallery-item-overlay">
+                <span class="filename">${photo.filename}</span>
+                ${hasLocation ? '<span class="location-indicator"><i class="fas fa-map-marker-alt"></i></span>' : ''}
+            </div>
+            <div class="photo-actions">
+                ${locateButton}
+            </div>
+        </div>
+    `;
+}
+
+// Load the next page automatically when the Load More button scrolls into view
+function initializeInfiniteScroll() {
+    const loadMoreBtn = document.getElementById('loadMoreBtn');
+    if (!loadMoreBtn || !('IntersectionObserver' in window)) return;
+    
+    const observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadMorePhotos();
+        }
+    }, { rootMargin: '400px' });
+    observer.observe(loadMoreBtn);
+}
+
 function enterSelectionMode() {
     isSelectMode = true;
     document.body.classList.add('selection-mode');
@@ -446,12 +532,13 @@ document.addEventListener('keydown', function(event) {
 
 // Navigate between images in modal
 function navigateImage(direction) {
-    const currentImage = document.getElementById('modalImage');
-    const currentSrc = currentImage.src;
+    const currentFilename = document.getElementById('modalFilename').textContent;
     
-    // Get all gallery images
+    // Get all gallery images (thumbnails); match the open one by filename
     const galleryImages = Array.from(document.querySelectorAll('.gallery-item img'));
-    const currentIndex = galleryImages.findIndex(img => img.src === currentSrc);
+    const currentIndex = galleryImages.findIndex(
+        img => img.closest('.gallery-item').getAttribute('data-filename') === currentFilename
+    );
     
     if (currentIndex === -1) return;
     
@@ -466,7 +553,7 @@ function navigateImage(direction) {
     const galleryItem = newImage.closest('.gallery-item');
     const filename = galleryItem.getAttribute('data-filename');
     
-    openModal(newImage.src, filename);
+    openModal(`/uploads/${encodeURIComponent(filename)}`, filename);
 }
 
 // Add touch/swipe support for mobile
@@ -525,6 +612,7 @@ function initializeLazyLoading() {
 document.addEventListener('DOMContentLoaded', function() {
     initializeLazyLoading();
     initializeSelectionDots();
+    initializeInfiniteScroll();
     
     // Add keyboard shortcuts
     document.addEventListener('keydown', function(e) {
@@ -2,14 +2,23 @@
 
 let map;
 let photoMarkers = [];
-let photosData = [];
+let markersByFilename = new Map();
+let photosByFilename = new Map();
+let photosTotal = 0;
+let photosBounds = null;
+let viewportRequestId = 0;
+let pendingLocateFilename = null;
 let currentPreviewPhoto = null;
 let clusteringEnabled = false;
+let mapMode = null;
+let countRefreshTimer = null;
 
 // Initialize map when page loads
 document.addEventListener('DOMContentLoaded', function() {
     initializeMap();
-    loadPhotosWithLocations();
+    // Take a change-feed cursor before the first load; later changes are patched in
+    subscribeToChanges({ onChanges: applyMapChanges, onReset: loadPhotosWithLocations })
+        .then(loadPhotosWithLocations);
     
     // Check if we need to locate a specific photo
     checkForPhotoLocation();
@@ -53,24 +62,10 @@ function checkForPhotoLocation() {
 
 // Locate a specific photo on the map
 function locateSpecificPhoto(filename, latitude, longitude) {
-    // Set map view to the photo location
+    // Open the photo's popup once the viewport query for its location comes back
+    pendingLocateFilename = filename;
     map.setView([latitude, longitude], 16);
     
-    // Find the marker for this photo and open its popup
-    const targetPhoto = photosData.find(photo => photo.filename === filename);
-    if (targetPhoto) {
-        const targetMarker = photoMarkers.find(marker => {
-            const markerLatLng = marker.getLatLng();
-            return Math.abs(markerLatLng.lat - latitude) < 0.000001 && 
-                   Math.abs(markerLatLng.lng - longitude) < 0.000001;
-        });
-        
-        if (targetMarker) {
-            targetMarker.openPopup();
-            showMessage(`Located "${filename}" on the map!`, 'success');
-        }
-    }
-    
     // Add a temporary highlight marker
     const highlightMarker = L.marker([latitude, longitude], {
         icon: L.divIcon({
@@ -97,68 +92,173 @@ function initializeMap() {
         attribution: '© <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
         maxZoom: 19
     }).addTo(map);
+    
+    // Markers only cover the visible area, so refetch whenever it changes
+    map.on('moveend', refreshViewport);
 
     console.log('Map initialized');
 }
 
-// Load photos with location data from the server
+// Fetch points or clusters for a bounding box from the server-side spatial index
+async function fetchMapPoints(bbox, zoom, cluster) {
+    const params = new URLSearchParams({ bbox: bbox, zoom: zoom, layers: 'photos', cluster: cluster });
+    const response = await fetch(`/api/map-points?${params}`);
+    return response.json();
+}
+
+// Find the extent of all located photos (from zoom 0 clusters) and fit the map to it
 async function loadPhotosWithLocations() {
     try {
-        const response = await fetch('/api/photos-with-locations');
-        const result = await response.json();
+        const [overview, listing] = await Promise.all([
+            fetchMapPoints('-180,-90,180,90', 0, '1'),
+            fetch('/api/photos?limit=1').then(response => response.json())
+        ]);
         
-        if (result.success) {
-            photosData = result.photos;
-            displayPhotosOnMap();
-            updatePhotoCount();
-        } else {
-            console.error('Failed to load photos:', result.message);
+        if (!overview.success) {
+            console.error('Failed to load photos:', overview.message);
             updatePhotoCount(0);
+            return;
+        }
+        
+        photosTotal = listing.success ? listing.total : overview.total;
+        
+        if (overview.clusters.length === 0) {
+            photosBounds = null;
+            clearMarkers();
+            updatePhotoCount(0, photosTotal);
+            showMessage('No photos with location data found. Enable location access when taking photos to see them on the map.', 'info');
+            return;
         }
+        
+        updatePhotoCount(overview.total, Math.max(photosTotal, overview.total));
+        photosBounds = L.latLngBounds(overview.clusters.map(c => [c.lat, c.lng])).pad(0.1);
+        if (!pendingLocateFilename) {
+            map.fitBounds(photosBounds);
+        }
+        refreshViewport();
     } catch (error) {
         console.error('Error loading photos:', error);
         updatePhotoCount(0);
     }
 }
 
-// Display photos on map
-function displayPhotosOnMap() {
-    // Clear existing markers
-    clearMarkers();
-    
-    const photosWithLocation = photosData.filter(photo => photo.location);
-    
-    if (photosWithLocation.length === 0) {
-        updatePhotoCount(0);
-        showMessage('No photos with location data found. Enable location access when taking photos to see them on the map.', 'info');
-        return;
-    }
-    
-    // Add markers for each photo
-    photosWithLocation.forEach(photo => {
-        const marker = L.marker([photo.location.latitude, photo.location.longitude])
-            .addTo(map);
+// Load the markers (or clusters) for the visible part of the map
+async function refreshViewport() {
+    const requestId = ++viewportRequestId;
+    try {
+        const result = await fetchMapPoints(
+            map.getBounds().toBBoxString(), map.getZoom(), clusteringEnabled ? '1' : 'auto');
         
-        // Create popup content
-        const popupContent = createPopupContent(photo);
-        marker.bindPopup(popupContent);
+        // A newer pan/zoom has started; drop this stale response
+        if (requestId !== viewportRequestId) return;
         
-        // Add click event to show preview
-        marker.on('click', () => {
-            showPhotoPreview(photo);
-        });
+        if (!result.success) {
+            console.error('Failed to load map points:', result.message);
+            return;
+        }
+        
+        clearMarkers();
+        mapMode = result.mode;
+        if (result.mode === 'clusters') {
+            result.clusters.forEach(addClusterMarker);
+        } else {
+            result.points.forEach(addPhotoMarker);
+        }
         
-        photoMarkers.push(marker);
+        if (pendingLocateFilename && markersByFilename.has(pendingLocateFilename)) {
+            markersByFilename.get(pendingLocateFilename).openPopup();
+            showMessage(`Located "${pendingLocateFilename}" on the map!`, 'success');
+        }
+        pendingLocateFilename = null;
+    } catch (error) {
+        console.error('Error loading map points:', error);
+    }
+}
+
+// Add a marker for one photo
+function addPhotoMarker(photo) {
+    const marker = L.marker([photo.location.latitude, photo.location.longitude])
+        .addTo(map);
+    
+    // Create popup content
+    const popupContent = createPopupContent(photo);
+    marker.bindPopup(popupContent);
+    
+    // Add click event to show preview
+    marker.on('click', () => {
+        showPhotoPreview(photo);
     });
     
-    // Fit map to show all markers
-    if (photoMarkers.length > 0) {
-        const group = new L.featureGroup(photoMarkers);
-        map.fitBounds(group.getBounds().pad(0.1));
+    photoMarkers.push(marker);
+    markersByFilename.set(photo.filename, marker);
+    photosByFilename.set(photo.filename, photo);
+}
+
+// Remove the marker of one photo, if it is shown
+function removePhotoMarker(filename) {
+    const marker = markersByFilename.get(filename);
+    if (!marker) return;
+    map.removeLayer(marker);
+    photoMarkers = photoMarkers.filter(other => other !== marker);
+    markersByFilename.delete(filename);
+}
+
+// Change-feed handler: patch individual markers in point mode; cluster counts
+// are recomputed by the server, so in cluster mode the viewport is reloaded
+function applyMapChanges(changes) {
+    if (mapMode === 'clusters') {
+        refreshViewport();
+    } else {
+        const bounds = map.getBounds();
+        changes.forEach(change => {
+            removePhotoMarker(change.filename);
+            const photo = change.photo;
+            if (photo && photo.location &&
+                    bounds.contains([photo.location.latitude, photo.location.longitude])) {
+                addPhotoMarker(photo);
+            } else if (!photo) {
+                photosByFilename.delete(change.filename);
+            }
+        });
+    }
+    
+    // Several changes in a burst update the counts once
+    clearTimeout(countRefreshTimer);
+    countRefreshTimer = setTimeout(refreshPhotoCount, 1000);
+}
+
+// Re-read the located and total photo counts (zoom 0 clusters and a one-row listing)
+async function refreshPhotoCount() {
+    try {
+        const [overview, listing] = await Promise.all([
+            fetchMapPoints('-180,-90,180,90', 0, '1'),
+            fetch('/api/photos?limit=1').then(response => response.json())
+        ]);
+        if (!overview.success) return;
+        photosTotal = listing.success ? listing.total : overview.total;
+        updatePhotoCount(overview.total, Math.max(photosTotal, overview.total));
+    } catch (error) {
+        console.error('Error refreshing photo count:', error);
     }
+}
+
+// Add a cluster bubble; clicking it zooms in on the cluster
+function addClusterMarker(cluster) {
+    const size = cluster.count < 10 ? 30 : cluster.count < 100 ? 38 : 46;
+    const marker = L.marker([cluster.lat, cluster.lng], {
+        icon: L.divIcon({
+            className: 'map-cluster',
+            html: `<div class="map-cluster-count">${cluster.count}</div>`,
+            iconSize: [size, size],
+            iconAnchor: [size / 2, size / 2]
+        })
+    }).addTo(map);
     
-    updatePhotoCount(photosWithLocation.length, photosData.length);
-    console.log(`Displayed ${photosWithLocation.length} photos on map`);
+    marker.on('click', () => {
+        map.setView([cluster.lat, cluster.lng], Math.min(map.getZoom() + 2, map.getMaxZoom()));
+    });
+    
+    photoMarkers.push(marker);
 }
 
 // Create popup content for a photo marker
@@ -168,7 +268,7 @@ function createPopupContent(photo) {
     
     return `
         <div class="map-popup">
-            <img src="${photo.url}" alt="Photo" style="width: 150px; height: 150px; object-fit: cover; border-radius: 8px;">
+            <img src="${photo.thumbnail_url || photo.url}" alt="Photo" style="width: 150px; height: 150px; object-fit: cover; border-radius: 8px;">
             <div class="popup-info">
                 <h4>${photo.filename}</h4>
                 <p><i class="fas fa-calendar"></i> ${date}</p>
@@ -185,7 +285,7 @@ function createPopupContent(photo) {
 function showPhotoPreview(photoOrFilename) {
     let photo;
     if (typeof photoOrFilename === 'string') {
-        photo = photosData.find(p => p.filename === photoOrFilename);
+        photo = photosByFilename.get(photoOrFilename);
     } else {
         photo = photoOrFilename;
     }
@@ -194,7 +294,7 @@ function showPhotoPreview(photoOrFilename) {
     
     currentPreviewPhoto = photo;
     
-    document.getElementById('previewImg').src = photo.url;
+    document.getElementById('previewImg').src = `${photo.url}?size=medium`;
     document.getElementById('previewFilename').textContent = photo.filename;
     
     if (photo.location) {
@@ -248,7 +348,7 @@ async function deletePhoto() {
         if (result.success) {
             showMessage('Photo deleted successfully', 'success');
             closePreview();
-            loadPhotosWithLocations(); // Refresh the map
+            pullChanges(); // Removes the marker via the change feed
         } else {
             showMessage('Failed to delete photo: ' + result.message, 'error');
         }
@@ -325,19 +425,24 @@ function findMyLocation() {
 
 // Show all photos on map
 function showAllPhotos() {
-    displayPhotosOnMap();
+    clusteringEnabled = false;
+    if (photosBounds) {
+        map.fitBounds(photosBounds);
+    }
+    refreshViewport();
     
     // Update button states
     document.getElementById('showAllBtn').classList.add('active');
     document.getElementById('clusterBtn').classList.remove('active');
 }
 
-// Toggle clustering (placeholder for future enhancement)
+// Toggle clustering: always group markers into server-side clusters, or only when too many are visible
 function toggleClustering() {
     clusteringEnabled = !clusteringEnabled;
+    refreshViewport();
     
     if (clusteringEnabled) {
-        showMessage('Clustering enabled (feature coming soon)', 'info');
+        showMessage('Clustering enabled', 'info');
         document.getElementById('clusterBtn').classList.add('active');
         document.getElementById('showAllBtn').classList.remove('active');
     } else {
@@ -353,6 +458,7 @@ function clearMarkers() {
         map.removeLayer(marker);
     });
     photoMarkers = [];
+    markersByFilename.clear();
 }
 
 // Update photo count display
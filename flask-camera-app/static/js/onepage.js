@@ -256,16 +256,8 @@ function performUpload(formData, filename) {
         if (data.success) {
             showStatusMessage(`Successfully uploaded ${filename}`, 'success');
             
-            // Refresh gallery if it's open
-            const modal = document.getElementById('galleryModal');
-            if (modal && modal.classList.contains('show')) {
-                loadGalleryPhotos();
-            }
-            
-            // Refresh map markers
-            if (window.map) {
-                loadPhotoMarkers();
-            }
+            // The new photo arrives through the change feed and is patched into the map and gallery
+            pullChanges();
         } else {
             showStatusMessage(`Failed to upload ${filename}: ${data.message || 'Unknown error'}`, 'error');
         }
@@ -317,7 +309,7 @@ function displayAnalysisData(photos) {
         const analysisData = generateMockAnalysis(photo);
         return `
             <div class="analysis-item">
-                <img src="${photo.url}" alt="Photo" class="analysis-image" loading="lazy">
+                <img src="${photo.thumbnail_url || photo.url}" alt="Photo" class="analysis-image" loading="lazy">
                 <div class="analysis-data">
                     <h4>${photo.filename}</h4>
                     <div class="analysis-details">
@@ -412,24 +404,46 @@ function displayPhotos(photos) {
         return;
     }
     
-    galleryGrid.innerHTML = photos.map(photo => `
-        <div class="gallery-item" data-filename="${photo.filename}">
-            <div class="selection-checkbox" style="display: none;">
-                <input type="checkbox" class="photo-select" value="${photo.filename}">
-                <div class="selection-dot"></div>
-            </div>
-            <img src="${photo.url}" alt="Photo" loading="lazy">
-            <div class="photo-info">
-                ${photo.location ? `<i class="fas fa-map-marker-alt"></i>` : ''}
-                <span class="photo-date">${formatDate(photo.created_at)}</span>
-            </div>
-            <div class="photo-actions">
-                <button class="action-btn delete-btn" onclick="deletePhoto('${photo.filename}')" title="Delete">
-                    <i class="fas fa-trash"></i>
-                </button>
-            </div>
+    galleryGrid.innerHTML = photos.map(galleryTileHtml).join('');
+}
+
+function galleryTileHtml(photo) {
+    return `
+    <div class="gallery-item" data-filename="${photo.filename}">
+        <div class="selection-checkbox" style="display: none;">
+            <input type="checkbox" class="photo-select" value="${photo.filename}">
+            <div class="selection-dot"></div>
+        </div>
+        <img src="${photo.thumbnail_url || photo.url}" alt="Photo" loading="lazy">
+        <div class="photo-info">
+            ${photo.location ? `<i class="fas fa-map-marker-alt"></i>` : ''}
+            <span class="photo-date">${formatDate(photo.created_at)}</span>
+        </div>
+        <div class="photo-actions">
+            <button class="action-btn delete-btn" onclick="deletePhoto('${photo.filename}')" title="Delete">
+                <i class="fas fa-trash"></i>
+            </button>
         </div>
-    `).join('');
+    </div>
+`;
+}
+
+// Patch one change-feed entry into the gallery modal, if it has been loaded
+function applyGalleryChange(change) {
+    const galleryGrid = document.getElementById('galleryGrid');
+    if (!galleryGrid || !galleryGrid.querySelector('.gallery-item, .no-photos')) return;
+    
+    const tile = galleryGrid.querySelector(`.gallery-item[data-filename="${CSS.escape(change.filename)}"]`);
+    if (!change.photo) {
+        if (tile) tile.remove();
+    } else if (tile) {
+        tile.outerHTML = galleryTileHtml(change.photo);
+    } else {
+        // Newest first, so new photos go on top
+        const placeholder = galleryGrid.querySelector('.no-photos');
+        if (placeholder) placeholder.remove();
+        galleryGrid.insertAdjacentHTML('afterbegin', galleryTileHtml(change.photo));
+    }
 }
 
 function formatDate(dateString) {
@@ -477,10 +491,7 @@ function deletePhoto(filename) {
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                loadGalleryPhotos(); // Reload gallery
-                if (window.map) {
-                    loadPhotoMarkers(); // Reload map markers
-                }
+                pullChanges(); // Drops the tile and marker via the change feed
                 showStatusMessage('Photo deleted successfully', 'success');
             } else {
                 showStatusMessage('Failed to delete photo: ' + data.error, 'error');
@@ -496,6 +507,7 @@ function deletePhoto(filename) {
 // Map functionality
 let map = null;
 let photoMarkers = [];
+let photoMarkersByFilename = new Map();
 
 function initializePhotoMap() {
     const mapElement = document.getElementById('photoMap');
@@ -509,8 +521,10 @@ function initializePhotoMap() {
         attribution: '© OpenStreetMap contributors'
     }).addTo(map);
     
-    // Load photo markers
-    loadPhotoMarkers();
+    // Take a change-feed cursor, then load the markers once; later uploads, deletes and
+    // location fixes are patched in from the feed
+    subscribeToChanges({ onChanges: applyPhotoChanges, onReset: reloadPhotoState })
+        .then(loadPhotoMarkers);
     
     // Load Excel locations
     loadExcelLocations();
@@ -534,31 +548,17 @@ function initializePhotoMap() {
 function loadPhotoMarkers() {
     if (!map) return;
     
-    // Clear existing markers
-    photoMarkers.forEach(marker => map.removeLayer(marker));
-    photoMarkers = [];
+    // Clear existing photo markers (sample markers stay)
+    Array.from(photoMarkersByFilename.keys()).forEach(removePhotoMarker);
     
     fetch('/api/photos-with-locations')
         .then(response => response.json())
         .then(data => {
             if (data.success && data.photos) {
-                data.photos.forEach(photo => {
-                    if (photo.location && photo.location.lat && photo.location.lng) {
-                        const marker = L.marker([photo.location.lat, photo.location.lng])
-                            .addTo(map)
-                            .bindPopup(`
-                                <div class="map-popup">
-                                    <img src="${photo.url}" alt="Photo" style="width: 200px; height: auto; border-radius: 8px;">
-                                    <p><strong>${formatDate(photo.created_at)}</strong></p>
-                                    <p>📍 ${photo.location.lat.toFixed(6)}, ${photo.location.lng.toFixed(6)}</p>
-                                </div>
-                            `);
-                        photoMarkers.push(marker);
-                    }
-                });
+                data.photos.forEach(addPhotoMarker);
                 
-                if (photoMarkers.length > 0) {
-                    const group = new L.featureGroup(photoMarkers);
+                if (photoMarkersByFilename.size > 0) {
+                    const group = new L.featureGroup(Array.from(photoMarkersByFilename.values()));
                     map.fitBounds(group.getBounds().pad(0.1));
                 }
             }
@@ -568,6 +568,60 @@ function loadPhotoMarkers() {
         });
 }
 
+// [lat, lng] of a photo's location, or null
+function photoLatLng(photo) {
+    const location = photo.location;
+    if (!location) return null;
+    const lat = location.lat ?? location.latitude;
+    const lng = location.lng ?? location.longitude;
+    return typeof lat === 'number' && typeof lng === 'number' ? [lat, lng] : null;
+}
+
+function addPhotoMarker(photo) {
+    const position = photoLatLng(photo);
+    if (!position) return;
+    
+    const marker = L.marker(position)
+        .addTo(map)
+        .bindPopup(`
+            <div class="map-popup">
+                <img src="${photo.thumbnail_url || photo.url}" alt="Photo" style="width: 200px; height: auto; border-radius: 8px;">
+                <p><strong>${formatDate(photo.created_at)}</strong></p>
+                <p>📍 ${position[0].toFixed(6)}, ${position[1].toFixed(6)}</p>
+            </div>
+        `);
+    photoMarkers.push(marker);
+    photoMarkersByFilename.set(photo.filename, marker);
+}
+
+function removePhotoMarker(filename) {
+    const marker = photoMarkersByFilename.get(filename);
+    if (!marker) return;
+    map.removeLayer(marker);
+    photoMarkers = photoMarkers.filter(other => other !== marker);
+    photoMarkersByFilename.delete(filename);
+}
+
+// Change-feed handler: replace each changed photo's marker and gallery tile
+function applyPhotoChanges(changes) {
+    changes.forEach(change => {
+        if (map) {
+            removePhotoMarker(change.filename);
+            if (change.photo) addPhotoMarker(change.photo);
+        }
+        applyGalleryChange(change);
+    });
+}
+
+// The feed cursor expired: reload everything once
+function reloadPhotoState() {
+    loadPhotoMarkers();
+    const modal = document.getElementById('galleryModal');
+    if (modal && modal.classList.contains('show')) {
+        loadGalleryPhotos();
+    }
+}
+
 function loadExcelLocations() {
     if (!map) return;
     
@@ -601,17 +655,16 @@ function loadExcelLocations() {
                         }
                         
                         // Add image preview if available
-                        if (location.image && location.image !== 'nan') {
-                            // Check if image exists in uploads folder
-                            const imageUrl = `/uploads/${location.image}`;
+                        // The server has already matched the sheet's image name to an upload
+                        if (location.image_status === 'found') {
                             popupContent += `
                                 <div class="image-preview">
-                                    <img src="${imageUrl}" alt="Location Image" 
-                                         style="width: 150px; height: auto; border-radius: 8px; margin-top: 8px;"
-                                         onerror="this.style.display='none'; this.nextElementSibling.style.display='block';">
-                                    <p style="display: none; color: #999; font-size: 12px;">Image: ${location.image}</p>
+                                    <img src="${location.thumbnail_url}" alt="Location Image"
+                                         style="width: 150px; height: auto; border-radius: 8px; margin-top: 8px;">
                                 </div>
                             `;
+                        } else if (location.image_status === 'missing') {
+                            popupContent += `<p style="color: #999; font-size: 12px;">Image not uploaded: ${location.image}</p>`;
                         }
                         
                         popupContent += '</div>';
@@ -1,6 +1,13 @@
 // Gallery upload functionality
 const fileInput = document.getElementById('fileInput');
 
+// Files above this size use the resumable chunked protocol (/api/uploads) instead of one request
+const RESUMABLE_THRESHOLD = 2 * 1024 * 1024;
+const RESUMABLE_MAX_SIZE = 512 * 1024 * 1024;
+// Chunks in flight at once, and attempts per chunk before giving up
+const UPLOAD_PARALLEL_CHUNKS = 3;
+const UPLOAD_CHUNK_ATTEMPTS = 6;
+
 // Open file dialog for gallery selection
 function openGallery() {
     fileInput.click();
@@ -22,10 +29,9 @@ fileInput.addEventListener('change', async function(event) {
         return;
     }
 
-    // Validate file size (16MB max)
-    const maxSize = 16 * 1024 * 1024; // 16MB in bytes
-    if (file.size > maxSize) {
-        showStatus('File size too large. Please select a file smaller than 16MB', 'error');
+    // Validate file size (larger files than the single-shot limit go up in chunks)
+    if (file.size > RESUMABLE_MAX_SIZE) {
+        showStatus('File size too large. Please select a file smaller than 512MB', 'error');
         fileInput.value = ''; // Clear the input
         return;
     }
@@ -33,19 +39,27 @@ fileInput.addEventListener('change', async function(event) {
     try {
         showLoading(true);
         
-        // Create FormData for file upload
-        const formData = new FormData();
-        formData.append('file', file);
+        let result;
+        if (file.size > RESUMABLE_THRESHOLD) {
+            result = await uploadResumable(file, {
+                onProgress: (sent, total) => showStatus(`Uploading... ${Math.floor(sent * 100 / total)}%`, 'info')
+            });
+        } else {
+            // Create FormData for file upload
+            const formData = new FormData();
+            formData.append('file', file);
 
-        const response = await fetch('/upload', {
-            method: 'POST',
-            body: formData
-        });
+            const response = await fetch('/upload', {
+                method: 'POST',
+                body: formData
+            });
 
-        const result = await response.json();
+            result = await response.json();
+        }
         
         if (result.success) {
             showStatus(result.message, 'success');
+            pullChanges(); // Patch the new photo into the map and gallery
             
             // Show a preview of the uploaded image
             showUploadedImagePreview(file);
@@ -155,4 +169,120 @@ function handleDrop(e) {
 }
 
 // Initialize drag and drop when DOM is loaded
-document.addEventListener('DOMContentLoaded', initializeDragAndDrop);
\ No newline at end of file
+document.addEventListener('DOMContentLoaded', initializeDragAndDrop);
+
+// SHA-256 of a blob as hex, or null where WebCrypto is unavailable (plain http)
+async function sha256Hex(blob) {
+    if (!window.crypto || !crypto.subtle) {
+        return null;
+    }
+    const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+// fetch() that retries network errors and 5xx/429 replies with exponential backoff
+async function fetchWithRetry(url, options) {
+    for (let attempt = 1; ; attempt++) {
+        try {
+            const response = await fetch(url, options);
+            if (response.status < 500 && response.status !== 429) {
+                return response;
+            }
+            if (attempt >= UPLOAD_CHUNK_ATTEMPTS) {
+                return response;
+            }
+        } catch (error) {
+            if (attempt >= UPLOAD_CHUNK_ATTEMPTS) {
+                throw error;
+            }
+        }
+        await sleep(Math.min(30000, 500 * 2 ** attempt));
+    }
+}
+
+// Split [start, end) byte ranges into chunks of at most chunkSize
+function chunkRanges(ranges, chunkSize) {
+    const chunks = [];
+    ranges.forEach(([start, end]) => {
+        for (let offset = start; offset < end; offset += chunkSize) {
+            chunks.push([offset, Math.min(end, offset + chunkSize)]);
+        }
+    });
+    return chunks;
+}
+
+// Upload a blob through /api/uploads: create (or resume) a session, send the missing
+// chunks a few at a time, then complete it. Resolves to the same JSON as /upload.
+// The session id is kept in localStorage, so a page reload or a dropped connection
+// picks up where it stopped instead of starting over.
+async function uploadResumable(blob, { location = null, onProgress = null } = {}) {
+    const sha256 = await sha256Hex(blob);
+    const resumeKey = 'resumableUpload:' + (sha256 || `${blob.name}:${blob.size}:${blob.lastModified}`);
+
+    let session = null;
+    const savedId = localStorage.getItem(resumeKey);
+    if (savedId) {
+        const response = await fetchWithRetry(`/api/uploads/${savedId}`, { method: 'GET' });
+        if (response.ok) {
+            session = await response.json();
+        } else {
+            localStorage.removeItem(resumeKey);
+        }
+    }
+    if (!session) {
+        const response = await fetchWithRetry('/api/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                length: blob.size,
+                filename: blob.name || null,
+                type: blob.type || 'application/octet-stream',
+                sha256: sha256,
+                location: location
+            })
+        });
+        session = await response.json();
+        if (!session.success) {
+            return session;
+        }
+        localStorage.setItem(resumeKey, session.upload_id);
+    }
+
+    const uploadUrl = `/api/uploads/${session.upload_id}`;
+    const chunks = chunkRanges(session.missing, session.chunk_size);
+    let sent = blob.size - session.missing.reduce((total, [start, end]) => total + end - start, 0);
+    if (onProgress) onProgress(sent, blob.size);
+
+    async function sendChunks() {
+        while (chunks.length) {
+            const [start, end] = chunks.shift();
+            const response = await fetchWithRetry(uploadUrl, {
+                method: 'PATCH',
+                headers: { 'Upload-Offset': String(start), 'Content-Type': 'application/offset+octet-stream' },
+                body: blob.slice(start, end)
+            });
+            if (!response.ok) {
+                throw new Error((await response.json()).message);
+            }
+            sent += end - start;
+            if (onProgress) onProgress(sent, blob.size);
+        }
+    }
+    await Promise.all(Array.from({ length: UPLOAD_PARALLEL_CHUNKS }, sendChunks));
+
+    const response = await fetchWithRetry(`${uploadUrl}/complete`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ sha256: sha256 })
+    });
+    const result = await response.json();
+    // Keep the session on 409 (ranges missing) so the next attempt resends only those
+    if (response.status !== 409) {
+        localStorage.removeItem(resumeKey);
+    }
+    return result;
+}
\ No newline at end of file
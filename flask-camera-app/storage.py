@@ -0,0 +1,79 @@
+import os
+import hashlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, and no pre-fork server to guard against either
+    fcntl = None
+
+# Files are spread over two levels of two-character prefix directories
+# (ab/cd/<name>): 65,536 leaf directories, so ten million files still leave
+# only about 150 per directory
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+
+def name_key(name):
+    """Shard key for names that are not themselves hashes (upload filenames)"""
+    return hashlib.md5(name.encode('utf-8')).hexdigest()
+
+
+def shard_path(root, key, name):
+    """Where a file named `name` with shard key `key` lives under root"""
+    parts = [key[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+    return os.path.join(root, *parts, name)
+
+
+def resolve(root, key, name):
+    """Path of an existing file: its sharded path, or the flat root/name left from
+    before sharding
+
+    When neither exists the sharded path is returned. That also covers a file
+    an online migration moved between the two checks.
+    """
+    path = shard_path(root, key, name)
+    if os.path.exists(path):
+        return path
+    flat = os.path.join(root, name)
+    if os.path.exists(flat):
+        return flat
+    return path
+
+
+def move_to_shard(root, key, name):
+    """Move root/name to its sharded path; returns False if it was not there"""
+    path = shard_path(root, key, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.replace(os.path.join(root, name), path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def flat_files(root, suffix=None):
+    """Names of regular files directly in root (not yet sharded)"""
+    if not os.path.isdir(root):
+        return []
+    with os.scandir(root) as entries:
+        return [entry.name for entry in entries
+                if entry.is_file() and (suffix is None or entry.name.endswith(suffix))]
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on the file at path (created if missing) for the block
+
+    The lock is a flock, so it excludes other threads and processes alike and
+    is released if the holder dies. Where fcntl is unavailable it does nothing.
+    """
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
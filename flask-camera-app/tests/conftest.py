@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+# Settings read when app is imported: a throwaway upload folder, no sheet and
+# no job threads, so tests run queued jobs themselves with run_pending()
+os.environ.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp(prefix='uploads-'))
+os.environ.setdefault('EXCEL_PATH', os.path.join(os.environ['UPLOAD_FOLDER'], 'none.xlsx'))
+os.environ.setdefault('JOB_WORKERS', '0')
+
+
+@pytest.fixture
+def app_module(tmp_path):
+    """The app module pointed at an empty upload folder for this test"""
+    import app
+    folder = app.app.config['UPLOAD_FOLDER']
+    app.app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    os.makedirs(app.app.config['UPLOAD_FOLDER'])
+    yield app
+    app.get_job_queue().stop()
+    app.app.config['UPLOAD_FOLDER'] = folder
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
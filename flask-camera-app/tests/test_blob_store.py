@@ -0,0 +1,30 @@
+import io
+
+import pytest
+
+from blob_store import BlobStore
+from metadata_store import PhotoMetadataStore
+
+
+def put(blobs, data):
+    return blobs.write_temp(io.BytesIO(data), 1024)
+
+
+@pytest.mark.parametrize('keep_source', [False, True])
+def test_replacing_twice_releases_the_intermediate_blob(tmp_path, keep_source):
+    store = PhotoMetadataStore(str(tmp_path / 'photo_metadata.db'))
+    blobs = BlobStore(str(tmp_path / 'blobs'), store)
+    filename, _, _ = blobs.add(*put(blobs, b'uploaded'), 'png')
+    source = store.blob_of(filename)[0]
+    temp, first, size = put(blobs, b'first copy')
+    # replace() returns the bytes freed: the source's 8 unless it is kept, less the copy's 10
+    assert blobs.replace(filename, source, temp, first, size, 'webp', keep_source) == (-10 if keep_source else -2)
+    temp, second, size = put(blobs, b'second copy')
+    assert blobs.replace(filename, first, temp, second, size, 'jpg', keep_source) == -1
+
+    refcounts = dict(store._connect().execute('SELECT digest, refcount FROM blobs'))
+    assert refcounts == ({source: 1, second: 1} if keep_source else {second: 1})
+    assert blobs.orphans() == []
+    blobs.delete(filename)
+    assert store._connect().execute('SELECT COUNT(*) FROM blobs').fetchone()[0] == 0
+    assert blobs.orphans() == []
@@ -0,0 +1,57 @@
+import io
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+def photo_png(seed):
+    buffer = io.BytesIO()
+    Image.frombytes('RGB', (16, 16), random.Random(seed).randbytes(16 * 16 * 3)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def list_all(client):
+    names, after = [], ''
+    while True:
+        page = client.get(f'/api/photos?limit=7{after}').get_json()
+        names += [photo['filename'] for photo in page['photos']]
+        if not page['next']:
+            return names
+        after = f"&after={page['next']}"
+
+
+def test_concurrent_capture_and_remove_keep_refcounts_and_listing_consistent(app_module, client):
+    etag = client.get('/api/photos').headers['ETag']
+    stored, removed = {}, Counter()
+
+    def remove(filename):
+        removed.update(client.post('/remove', json={'filenames': [filename]}).get_json()['removed_files'])
+
+    def capture_then_maybe_remove(seed):
+        # Every photo is sent twice at once with the same location; every third is then removed twice at once
+        reply = client.post(f'/capture?latitude=19.{seed}&longitude=72.8', data=photo_png(seed),
+                            content_type='image/png').get_json()
+        assert reply['success'], reply
+        stored.setdefault(seed, set()).add(reply['filename'])
+        if seed % 3 == 0 and not reply['duplicate']:
+            with ThreadPoolExecutor(max_workers=2) as removers:
+                list(removers.map(remove, [reply['filename']] * 2))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(capture_then_maybe_remove, [seed for seed in range(40) for _ in range(2)]))
+
+    # A twin that arrives after the first copy was removed is stored again, which is fine
+    assert all(len(names - set(removed)) <= 1 for names in stored.values()), 'identical captures were stored twice'
+    assert all(count == 1 for count in removed.values()), 'a photo was removed by two requests'
+    expected = {name for names in stored.values() for name in names} - set(removed)
+    listed = list_all(client)
+    assert len(listed) == len(set(listed)) and set(listed) == expected
+    assert client.get('/api/photos').get_json()['total'] == len(expected)
+    assert client.get('/api/photos').headers['ETag'] != etag
+
+    conn = app_module.get_metadata_store()._connect()
+    references = Counter(digest for (digest,) in conn.execute('SELECT digest FROM photos'))
+    assert dict(conn.execute('SELECT digest, refcount FROM blobs')) == dict(references)
+    assert app_module.get_blob_store().orphans() == []
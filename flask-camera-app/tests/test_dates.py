@@ -0,0 +1,18 @@
+import io
+
+from PIL import Image
+
+
+def capture(client, shade):
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), (shade, 0, 0)).save(buffer, 'PNG')
+    return client.post('/capture', data=buffer.getvalue(), content_type='image/png').get_json()['filename']
+
+
+def test_photo_listing_and_export_agree_on_date_filters(client):
+    filename = capture(client, 1)
+    listed = client.get('/api/photos?from=01-01-2000&to=01-01-2999').get_json()
+    exported = client.get('/api/export?format=ndjson&sources=photos&from=01-01-2000&to=01-01-2999').data
+    assert [photo['filename'] for photo in listed['photos']] == [filename]
+    assert filename.encode() in exported
+    assert client.get('/api/photos?from=yesterday').status_code == 400
@@ -0,0 +1,62 @@
+import io
+import json
+import logging
+import random
+
+import pytest
+from PIL import Image
+
+from metrics import JsonFormatter
+
+
+def photo_png(seed):
+    buffer = io.BytesIO()
+    Image.frombytes('RGB', (16, 16), random.Random(seed).randbytes(16 * 16 * 3)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def log_lines(app_module):
+    """JSON log lines written while the test runs, at INFO"""
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    level = root.level
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    yield lambda: [json.loads(line) for line in stream.getvalue().splitlines()]
+    root.removeHandler(handler)
+    root.setLevel(level)
+
+
+def capture(client, seed):
+    reply = client.post('/capture', data=photo_png(seed), content_type='image/png').get_json()
+    assert reply['success'], reply
+    return reply['filename']
+
+
+def test_delete_photo_logs_and_succeeds(client, log_lines):
+    filename = capture(client, 1)
+    reply = client.post('/delete_photo', json={'filename': filename}).get_json()
+    assert reply['success'], reply
+    assert {'message': 'Deleted photo', 'photo': filename}.items() <= log_lines()[-1].items()
+
+
+def test_remove_reports_each_photo_once(client, log_lines):
+    filenames = [capture(client, seed) for seed in (2, 3)]
+    reply = client.post('/remove', json={'filenames': filenames}).get_json()
+    assert sorted(reply['removed_files']) == sorted(filenames)
+    assert not reply.get('errors')
+    assert sorted(entry['photo'] for entry in log_lines() if entry['message'] == 'Removed photo') == sorted(filenames)
+
+
+def test_undecodable_derivative_falls_back_to_the_original(app_module, client, log_lines):
+    reply = client.post('/upload', data={'file': (io.BytesIO(b'not an image'), 'broken.jpg')},
+                        content_type='multipart/form-data').get_json()
+    assert reply['success'], reply
+    response = client.get(f"/uploads/{reply['filename']}?size=thumb")
+    assert response.status_code == 200
+    assert response.data == b'not an image'
+    assert any(entry['message'] == 'Could not create derivative' and entry['photo'] == reply['filename']
+               for entry in log_lines())
@@ -0,0 +1,21 @@
+import os
+import sys
+import statistics
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from bench_startup import TARGETS, measure_import
+
+# Median import time allowed per entry point; CI machines can set their own
+BUDGET_MS = float(os.environ.get('STARTUP_BUDGET_MS', 1000))
+
+
+@pytest.mark.parametrize('name, directory, module', TARGETS, ids=[target[0] for target in TARGETS])
+def test_import_is_fast_and_loads_no_heavy_libraries(tmp_path, name, directory, module):
+    env = dict(os.environ, UPLOAD_FOLDER=str(tmp_path), JOB_WORKERS='0')
+    runs = [measure_import(directory, module, env) for _ in range(3)]
+    loaded = sorted(set(library for run in runs for library in run['loaded']))
+    assert not loaded, f'{name} imports {", ".join(loaded)} at startup instead of on first use'
+    median = statistics.median(run['import_ms'] for run in runs)
+    assert median <= BUDGET_MS, f'{name} import took {median:.0f}ms, budget is {BUDGET_MS:.0f}ms'
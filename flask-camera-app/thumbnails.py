@@ -0,0 +1,104 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from storage import flat_files, move_to_shard, name_key, resolve, shard_path
+
+# Longest edge in pixels for each derivative size
+DERIVATIVE_SIZES = {
+    'thumb': 320,
+    'medium': 1280
+}
+
+
+class DerivativeGenerator:
+    """Creates and caches downscaled copies (thumbnails, medium previews) of uploads.
+
+    Derivatives live under <upload folder>/derivatives/<size>/<ab>/<cd>/ (sharded
+    by a hash of the upload's name) and are written
+    to a temporary name then renamed, so a reader never sees a partial file and
+    two concurrent generators for the same photo are harmless.
+    """
+
+    def __init__(self, upload_folder, quality=82, source_path=None):
+        self.upload_folder = upload_folder
+        # Maps an upload's filename to the file holding its bytes
+        self.source_path = source_path or (lambda filename: os.path.join(upload_folder, filename))
+        self.root = os.path.join(upload_folder, 'derivatives')
+        self.quality = quality
+        # Pillow is imported on first use so that starting the app does not load it
+        from PIL import features
+        self.format, self.extension = ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+    def derivative_path(self, filename, size):
+        """Where a derivative is written"""
+        return shard_path(os.path.join(self.root, size), name_key(filename), f'{filename}.{self.extension}')
+
+    def existing_path(self, filename, size):
+        """Where a derivative is read from: sharded, or flat until shard() has run"""
+        return resolve(os.path.join(self.root, size), name_key(filename), f'{filename}.{self.extension}')
+
+    def generate(self, filename, sizes=None):
+        """Create the requested derivatives for one upload, skipping ones that exist"""
+        sizes = sizes or list(DERIVATIVE_SIZES)
+        missing = [size for size in sizes if not os.path.exists(self.existing_path(filename, size))]
+        if not missing:
+            return
+
+        from PIL import Image, ImageOps
+        with Image.open(self.source_path(filename)) as image:
+            # Let the JPEG decoder downscale while decoding for the largest size we need
+            largest = max(DERIVATIVE_SIZES[size] for size in missing)
+            image.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA') or (self.format == 'JPEG' and image.mode == 'RGBA'):
+                image = image.convert('RGB')
+
+            for size in sorted(missing, key=DERIVATIVE_SIZES.get, reverse=True):
+                edge = DERIVATIVE_SIZES[size]
+                image.thumbnail((edge, edge), Image.LANCZOS)
+                path = self.derivative_path(filename, size)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f'{path}.{uuid.uuid4().hex}.part'
+                try:
+                    image.save(temp_path, self.format, quality=self.quality)
+                    os.replace(temp_path, path)
+                except Exception:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
+
+    def get_or_create(self, filename, size):
+        """Return the path of a derivative, generating it synchronously if missing"""
+        path = self.existing_path(filename, size)
+        if not os.path.exists(path):
+            self.generate(filename, [size])
+            path = self.derivative_path(filename, size)
+        return path
+
+    def remove(self, filename):
+        """Delete all derivatives of an upload"""
+        for size in DERIVATIVE_SIZES:
+            path = self.existing_path(filename, size)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def shard(self):
+        """Move derivatives still stored flat into their prefix directories; returns the count"""
+        moved = 0
+        for size in DERIVATIVE_SIZES:
+            folder = os.path.join(self.root, size)
+            for name in flat_files(folder, suffix=f'.{self.extension}'):
+                moved += move_to_shard(folder, name_key(name[:-len(self.extension) - 1]), name)
+        return moved
+
+    def backfill(self, filenames, workers=4):
+        """Generate missing derivatives for many uploads; returns (done, failed)"""
+        done, failed = 0, []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self.generate, filename): filename for filename in filenames}
+            for future in as_completed(futures):
+                if future.exception() is None:
+                    done += 1
+                else:
+                    failed.append((futures[future], str(future.exception())))
+        return done, failed
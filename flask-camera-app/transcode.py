@@ -0,0 +1,121 @@
+import io
+import os
+
+# Target formats: Pillow format name and file extension of the stored blob
+TRANSCODE_FORMATS = {'webp': ('WEBP', 'webp'), 'jpeg': ('JPEG', 'jpg')}
+
+# JPEG chroma subsampling. 4:4:4 keeps colour at full resolution, which is what
+# keeps the edges of single sand grains sharp; 4:2:0 is smallest
+SUBSAMPLING = {'4:4:4': 0, '4:2:2': 1, '4:2:0': 2}
+
+
+def sniff_format(header):
+    """Extension for the image format the first bytes of a file show, or None"""
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def file_format(path):
+    """sniff_format() of the file at path"""
+    with open(path, 'rb') as f:
+        return sniff_format(f.read(12))
+
+
+class Transcoder:
+    """Re-encodes stored photos (by default the PNGs the capture canvas produces)
+    into a smaller format, off the request path.
+
+    The photo keeps its filename, location and created_at; only the blob its
+    row points at changes (see BlobStore.replace), so URLs, the map and
+    exports are unaffected. A result that is not smaller than the source is
+    discarded. The source blob is released unless keep_source is set, in
+    which case transcoding adds the new copy's bytes rather than saving any.
+    Lossy WebP always stores colour at 4:2:0; use lossless WebP, or JPEG
+    with 4:4:4 subsampling, where grain colour detail matters.
+    """
+
+    def __init__(self, blobs, fmt='webp', quality=90, max_edge=0, subsampling='4:4:4',
+                 lossless=False, keep_source=False, sources=('png',)):
+        if fmt not in TRANSCODE_FORMATS:
+            raise ValueError(f'Unknown transcode format: {fmt}')
+        if subsampling not in SUBSAMPLING:
+            raise ValueError(f'Unknown chroma subsampling: {subsampling}')
+        self.blobs = blobs
+        self.format, self.extension = TRANSCODE_FORMATS[fmt]
+        self.quality = quality
+        self.max_edge = max_edge
+        self.subsampling = subsampling
+        self.lossless = lossless and fmt == 'webp'
+        self.keep_source = keep_source
+        # Source formats, as the extensions sniff_format() returns ('jpeg' is accepted for 'jpg')
+        self.sources = set('jpg' if source.lower() == 'jpeg' else source.lower() for source in sources)
+
+    def wants(self, path):
+        """Whether the photo at path is transcoded: decided by its bytes, since a stored
+        extension can be wrong (older clients sent JPEG captures labelled as PNG)"""
+        source = file_format(path)
+        return source is not None and source in self.sources
+
+    def encode(self, path):
+        """Return the photo at path re-encoded with these settings, as bytes"""
+        # Pillow is imported on first use so that starting the app does not load it
+        from PIL import Image
+        with Image.open(path) as image:
+            exif = image.info.get('exif')
+            icc_profile = image.info.get('icc_profile')
+            if image.mode not in ('RGB', 'RGBA', 'L'):
+                image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+            # Canvas captures carry an alpha channel that is always opaque
+            if image.mode == 'RGBA' and (self.format == 'JPEG' or image.getextrema()[3][0] == 255):
+                image = image.convert('RGB')
+            if self.max_edge and max(image.size) > self.max_edge:
+                image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+            options = {}
+            if exif:
+                options['exif'] = exif
+            if icc_profile:
+                options['icc_profile'] = icc_profile
+            if self.format == 'JPEG':
+                options.update(quality=self.quality, subsampling=SUBSAMPLING[self.subsampling], optimize=True)
+            else:
+                options.update(quality=self.quality, lossless=self.lossless, method=6)
+            buffer = io.BytesIO()
+            image.save(buffer, self.format, **options)
+        return buffer.getvalue()
+
+    def transcode(self, filename, dry_run=False):
+        """Re-encode one blob-backed photo and point it at the result
+
+        Returns {'filename', 'before', 'after'} with sizes in bytes (plus
+        'source_digest', 'digest' and 'released', the bytes the blob store
+        shrank by, when stored), or {'filename', 'skipped': reason}. With
+        dry_run nothing is written.
+        """
+        blob = self.blobs.metadata.blob_of(filename)
+        if blob is None:
+            return {'filename': filename, 'skipped': 'not in the blob store'}
+        digest, extension = blob
+        path = self.blobs.locate(digest, extension)
+        if not self.wants(path):
+            return {'filename': filename, 'skipped': f'{file_format(path) or "unknown format"} is not transcoded'}
+        before = os.path.getsize(path)
+        data = self.encode(path)
+        if len(data) >= before:
+            return {'filename': filename, 'skipped': 'not smaller', 'before': before, 'after': len(data)}
+        result = {'filename': filename, 'before': before, 'after': len(data)}
+        if dry_run:
+            return result
+        temp_path, new_digest, size = self.blobs.write_temp(io.BytesIO(data), len(data))
+        released = self.blobs.replace(filename, digest, temp_path, new_digest, size, self.extension,
+                                      self.keep_source)
+        if released is None:
+            return {'filename': filename, 'skipped': 'changed while transcoding'}
+        result.update(source_digest=digest, digest=new_digest, released=released)
+        return result
@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 
 # Create the data with the new coordinates
@@ -31,8 +32,11 @@ data = {
 # Create DataFrame
 df = pd.DataFrame(data)
 
-# Save to Excel file
-df.to_excel('complete_gps_and_dates.xlsx', index=False)
+# Save to Excel file: write a temporary copy and rename it over the sheet, so
+# server workers reading it never see a half-written file
+temp_path = f'complete_gps_and_dates.{os.getpid()}.tmp.xlsx'
+df.to_excel(temp_path, index=False)
+os.replace(temp_path, 'complete_gps_and_dates.xlsx')
 print("✅ Excel file updated successfully!")
 print(f"📊 Total locations: {len(df)}")
 print("📍 Sample coordinates:")
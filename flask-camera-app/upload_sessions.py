@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SessionError(Exception):
+    """A session operation that cannot be done; status is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadSessions:
+    """Resumable uploads: a session is a preallocated file that chunks are written into.
+
+    A client creates a session with the total length (and optionally the
+    SHA-256 of the whole file), then sends chunks tagged with their byte
+    offset, in any order and in parallel. Each chunk is streamed straight to
+    its place in the file. The ranges received are recorded in SQLite, so any
+    server process can report which ranges are still missing, and a client
+    whose connection dropped resumes by sending only those. Sessions expire
+    after `ttl` seconds without a chunk; collect_expired() deletes them.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            length INTEGER NOT NULL,
+            extension TEXT NOT NULL,
+            sha256 TEXT,
+            location TEXT,
+            status TEXT NOT NULL DEFAULT 'open',
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at);
+        CREATE TABLE IF NOT EXISTS chunks (
+            session_id TEXT NOT NULL,
+            start INTEGER NOT NULL,
+            end INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_chunks_session ON chunks (session_id, start);
+    """
+
+    def __init__(self, root, max_length, ttl=24 * 3600, collect_interval=300):
+        self.root = root
+        self.db_path = os.path.join(root, 'sessions.db')
+        self.max_length = max_length
+        self.ttl = ttl
+        self.collect_interval = collect_interval
+        self._local = threading.local()
+        self._last_collect = 0.0
+        os.makedirs(root, exist_ok=True)
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def path(self, session_id):
+        return os.path.join(self.root, f'{session_id}.part')
+
+    def _session(self, session_id):
+        row = self._connect().execute(
+            'SELECT length, extension, sha256, location, status, expires_at FROM sessions WHERE id = ?',
+            (session_id,)).fetchone()
+        if row is None or row[5] < time.time():
+            raise SessionError('Upload session not found or expired', 404)
+        length, extension, sha256, location, status, expires_at = row
+        return {'length': length, 'extension': extension, 'sha256': sha256,
+                'location': json.loads(location) if location else None,
+                'status': status, 'expires_at': expires_at}
+
+    def create(self, length, extension, sha256=None, location=None):
+        """Start a session and preallocate its file; returns the session id"""
+        if length <= 0 or length > self.max_length:
+            raise SessionError(f'Length must be between 1 and {self.max_length} bytes', 413)
+        if time.time() - self._last_collect > self.collect_interval:
+            self.collect_expired()
+        session_id = uuid.uuid4().hex
+        with open(self.path(session_id), 'wb') as f:
+            # Reserve the space up front so a full disk fails here, not mid-upload
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, length)
+            else:
+                f.truncate(length)
+        now = time.time()
+        self._connect().execute(
+            'INSERT INTO sessions (id, length, extension, sha256, location, created_at, expires_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (session_id, length, extension, sha256.lower() if sha256 else None,
+             json.dumps(location) if location else None, now, now + self.ttl))
+        return session_id
+
+    def write_chunk(self, session_id, offset, stream, chunk_size, content_length=None):
+        """Copy a request body into the session file at offset; returns bytes written
+
+        The body is read in chunk_size pieces and written with pwrite, so
+        parallel chunks of one session never share a file position. Only the
+        bytes that actually arrived are recorded, so a chunk cut off midway
+        leaves the rest of its range missing.
+        """
+        session = self._session(session_id)
+        if session['status'] != 'open':
+            raise SessionError('Upload session is already complete', 409)
+        if offset < 0 or offset >= session['length'] or \
+                (content_length is not None and offset + content_length > session['length']):
+            raise SessionError(f"Chunk at {offset} does not fit in {session['length']} bytes", 416)
+        written = 0
+        fd = os.open(self.path(session_id), os.O_WRONLY)
+        try:
+            while True:
+                data = stream.read(chunk_size)
+                if not data:
+                    break
+                if offset + written + len(data) > session['length']:
+                    raise SessionError(f"Chunk at {offset} runs past {session['length']} bytes", 416)
+                os.pwrite(fd, data, offset + written)
+                written += len(data)
+        finally:
+            os.close(fd)
+            if written:
+                self._connect().execute(
+                    'INSERT INTO chunks (session_id, start, end) VALUES (?, ?, ?)',
+                    (session_id, offset, offset + written))
+                self._connect().execute('UPDATE sessions SET expires_at = ? WHERE id = ?',
+                                        (time.time() + self.ttl, session_id))
+        return written
+
+    def status(self, session_id):
+        """Return {'length', 'offset', 'missing', 'expires_at'}
+
+        offset is the length of the contiguous prefix received so far and
+        missing lists the [start, end) ranges still to send.
+        """
+        session = self._session(session_id)
+        missing, covered = [], 0
+        for start, end in self._connect().execute(
+                'SELECT start, end FROM chunks WHERE session_id = ? ORDER BY start', (session_id,)):
+            if start > covered:
+                missing.append([covered, start])
+            covered = max(covered, end)
+        if covered < session['length']:
+            missing.append([covered, session['length']])
+        return {
+            'length': session['length'],
+            'offset': missing[0][0] if missing else session['length'],
+            'missing': missing,
+            'expires_at': session['expires_at'],
+        }
+
+    def finish(self, session_id, sha256=None):
+        """Verify a fully received session and hand over its file
+
+        Returns (path, sha256 hex, length, extension, location); the caller
+        moves the file away and then calls discard(). Raises SessionError if
+        ranges are missing (409) or the checksum does not match (422), in
+        which case the session stays open for the client to resend.
+        """
+        status = self.status(session_id)
+        if status['missing']:
+            raise SessionError(f"{sum(end - start for start, end in status['missing'])} bytes "
+                               f"still missing", 409)
+        # Claim the session so a second finish of the same upload cannot race this one
+        claimed = self._connect().execute(
+            "UPDATE sessions SET status = 'finishing' WHERE id = ? AND status = 'open'", (session_id,)).rowcount
+        if not claimed:
+            raise SessionError('Upload session is already being completed', 409)
+        session = self._session(session_id)
+        digest = hashlib.sha256()
+        with open(self.path(session_id), 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        actual = digest.hexdigest()
+        expected = (sha256 or session['sha256'] or '').lower()
+        if expected and expected != actual:
+            self._connect().execute("UPDATE sessions SET status = 'open' WHERE id = ?", (session_id,))
+            raise SessionError(f'Checksum mismatch: expected {expected}, received {actual}', 422)
+        return self.path(session_id), actual, session['length'], session['extension'], session['location']
+
+    def discard(self, session_id):
+        """Forget a session and delete its file if it is still there"""
+        conn = self._connect()
+        conn.execute('DELETE FROM chunks WHERE session_id = ?', (session_id,))
+        conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+        if os.path.exists(self.path(session_id)):
+            os.remove(self.path(session_id))
+
+    def collect_expired(self):
+        """Delete expired sessions and their files; returns how many were removed"""
+        self._last_collect = time.time()
+        expired = [row[0] for row in self._connect().execute(
+            'SELECT id FROM sessions WHERE expires_at < ?', (time.time(),))]
+        for session_id in expired:
+            self.discard(session_id)
+        # Files whose row is gone (e.g. a crash between the two) are removed too
+        known = set(row[0] for row in self._connect().execute('SELECT id FROM sessions'))
+        for name in os.listdir(self.root):
+            if name.endswith('.part') and name[:-5] not in known and \
+                    os.path.getmtime(os.path.join(self.root, name)) < time.time() - self.ttl:
+                os.remove(os.path.join(self.root, name))
+        if expired:
+            logger.info('Collected expired upload sessions', extra={'sessions': len(expired)})
+        return len(expired)
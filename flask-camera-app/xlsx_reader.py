@@ -0,0 +1,139 @@
+import re
+import zipfile
+import posixpath
+from datetime import datetime, timedelta
+from xml.etree.ElementTree import iterparse
+
+# SpreadsheetML and relationship namespaces
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# Built-in number formats that display dates or times
+BUILTIN_DATE_FORMATS = set(range(14, 23)) | {45, 46, 47}
+
+# Day 0 of the 1900 date system, as Excel counts it (including its 1900 leap-year bug)
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+_CELL_REF = re.compile(r'([A-Z]+)(\d+)')
+
+
+class XlsxError(ValueError):
+    """The file is not a workbook this reader understands; callers fall back to pandas"""
+
+
+def _column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def _shared_strings(archive):
+    try:
+        source = archive.open('xl/sharedStrings.xml')
+    except KeyError:
+        return []
+    strings = []
+    with source:
+        for _, element in iterparse(source):
+            if element.tag == MAIN_NS + 'si':
+                strings.append(''.join(text.text or '' for text in element.iter(MAIN_NS + 't')))
+                element.clear()
+    return strings
+
+
+def _date_styles(archive):
+    """Indexes into cellXfs whose number format shows a date"""
+    try:
+        source = archive.open('xl/styles.xml')
+    except KeyError:
+        return set()
+    custom_dates, styles = set(), []
+    with source:
+        for _, element in iterparse(source):
+            if element.tag == MAIN_NS + 'numFmt':
+                # Strip quoted text and [colour]/[locale] sections before looking for date tokens
+                code = re.sub(r'"[^"]*"|\[[^\]]*\]', '', element.get('formatCode', '')).lower()
+                if re.search(r'[dmyhs]', code):
+                    custom_dates.add(int(element.get('numFmtId')))
+            elif element.tag == MAIN_NS + 'cellXfs':
+                styles = [int(xf.get('numFmtId', 0)) for xf in element.findall(MAIN_NS + 'xf')]
+    return {index for index, fmt in enumerate(styles) if fmt in BUILTIN_DATE_FORMATS or fmt in custom_dates}
+
+
+def _first_sheet_path(archive):
+    try:
+        with archive.open('xl/workbook.xml') as source:
+            sheet = next(element for _, element in iterparse(source) if element.tag == MAIN_NS + 'sheet')
+        rel_id = sheet.get(REL_NS + 'id')
+        with archive.open('xl/_rels/workbook.xml.rels') as source:
+            for _, element in iterparse(source):
+                if element.tag == PACKAGE_REL_NS + 'Relationship' and element.get('Id') == rel_id:
+                    target = element.get('Target')
+                    return target.lstrip('/') if target.startswith('/') else posixpath.join('xl', target)
+    except (KeyError, StopIteration):
+        pass
+    return 'xl/worksheets/sheet1.xml'
+
+
+def _number(text):
+    # Same rule as openpyxl (and so pandas): integers stay int
+    return float(text) if '.' in text or 'E' in text or 'e' in text else int(text)
+
+
+def _cell_value(cell, shared, date_styles):
+    kind = cell.get('t', 'n')
+    if kind == 'inlineStr':
+        return ''.join(text.text or '' for text in cell.iter(MAIN_NS + 't'))
+    value = cell.findtext(MAIN_NS + 'v')
+    if value is None:
+        return None
+    if kind == 's':
+        return shared[int(value)]
+    if kind == 'b':
+        return value == '1'
+    if kind in ('str', 'e'):
+        return value
+    number = _number(value)
+    if int(cell.get('s', 0)) in date_styles:
+        # Serial dates are fractions of a day; round away float noise as openpyxl does
+        return EXCEL_EPOCH + timedelta(milliseconds=round(number * 86400000))
+    return number
+
+
+def iter_rows(path):
+    """Yield the first worksheet's rows as lists of cell values (str, int, float, bool,
+    datetime or None), streaming the sheet XML so memory does not grow with it.
+
+    Blank rows (absent from the XML) come out as empty lists, so positions
+    match the sheet's row numbers.
+    """
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile as e:
+        raise XlsxError(f'{path} is not an xlsx file: {e}')
+    with archive:
+        shared = _shared_strings(archive)
+        date_styles = _date_styles(archive)
+        try:
+            source = archive.open(_first_sheet_path(archive))
+        except KeyError as e:
+            raise XlsxError(f'{path} has no worksheet: {e}')
+        with source:
+            next_row = 1
+            for _, element in iterparse(source):
+                if element.tag != MAIN_NS + 'row':
+                    continue
+                number = int(element.get('r', next_row))
+                for _ in range(number - next_row):
+                    yield []
+                next_row = number + 1
+                row = []
+                for cell in element.iter(MAIN_NS + 'c'):
+                    match = _CELL_REF.match(cell.get('r', ''))
+                    column = _column_index(match.group(1)) if match else len(row)
+                    row.extend([None] * (column - len(row)))
+                    row.append(_cell_value(cell, shared, date_styles))
+                element.clear()
+                yield row